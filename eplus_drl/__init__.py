@@ -1,3 +1,5 @@
 from .emspy import EmsPy
 from .bca import BcaEnv
-from . import utils
\ No newline at end of file
+from . import utils
+from . import idf
+from .sharding import ShardedEvaluation, plan_run_period_shards
\ No newline at end of file
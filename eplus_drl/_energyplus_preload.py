@@ -0,0 +1,14 @@
+"""
+Imported by the fork server of eplus_drl.workers.get_worker_context() only: loads the EnergyPlus API (and its shared
+library) once, so that all forked workers share it.
+"""
+
+import os
+
+from eplus_drl.emspy import _load_energyplus_api
+
+if os.environ.get('EPLUS_DRL_EP_PATH'):
+    try:
+        _load_energyplus_api(os.environ['EPLUS_DRL_EP_PATH'])
+    except (ImportError, OSError):
+        pass  # E+ not found, workers will report it when creating their simulation
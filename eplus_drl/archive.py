@@ -0,0 +1,200 @@
+"""
+Append-only, memory-mapped on-disk archive of the experience harvested from EnergyPlus episodes.
+
+Experience is stored column-wise, one raw binary file per column with a fixed dtype and row width, plus a small JSON
+index of the episodes (id, first row, number of rows). Harvesting workers append whole episodes directly to the
+archive (appends are serialized with a file lock, and written right after the rows of the index, so that an
+interrupted append never misaligns the columns), learners open the columns as read-only NumPy memory maps, so random
+minibatches and contiguous windows (e.g. for NODE system identification) are read without loading the whole archive
+into RAM.
+
+    archive = ExperienceArchive('Archive', obs_size=9, action_size=10)
+    archive.append_episode(episode, states, actions, rewards, times)  # worker
+    batch = archive.sample(256)  # learner, dict of column name -> array
+    windows = archive.sample_windows(64, window=10)  # dict of column name -> [64, 10, width] array
+"""
+
+import os
+import json
+import fcntl
+
+import numpy as np
+
+
+class ExperienceArchive:
+    """Column-wise experience archive, see module documentation."""
+
+    index_file_name = 'index.json'
+
+    def __init__(self, path: str, obs_size: int = None, action_size: int = None, reward_size: int = 1):
+        """
+        Opens an existing archive, or creates a new one if obs_size and action_size are given.
+
+        :param path: directory of the archive
+        :param obs_size: width of the observation (state) column
+        :param action_size: width of the action column (e.g. number of discrete actions for one-hot actions)
+        :param reward_size: width of the reward column, > 1 for multi-objective rewards
+        """
+        self.path = path
+        self.index_path = os.path.join(path, self.index_file_name)
+        if not os.path.exists(self.index_path):
+            if obs_size is None or action_size is None:
+                raise FileNotFoundError(f'ERROR: There is no experience archive at [{path}], give obs_size and '
+                                        f'action_size to create one.')
+            os.makedirs(path, exist_ok=True)
+            with self._lock():
+                if not os.path.exists(self.index_path):  # another worker may have created it meanwhile
+                    self._write_index({
+                        'columns': {
+                            'obs': {'dtype': 'float32', 'width': int(obs_size)},
+                            'actions': {'dtype': 'float32', 'width': int(action_size)},
+                            'rewards': {'dtype': 'float32', 'width': int(reward_size)},
+                            'time': {'dtype': 'datetime64[s]', 'width': 1},
+                            'episode': {'dtype': 'int64', 'width': 1},
+                        },
+                        'n_rows': 0,
+                        'episodes': [],  # [episode id, first row, number of rows]
+                    })
+        self.index = self._read_index()
+        self.columns = self.index['columns']
+        self._maps = {}  # column name -> memmap, reopened when the archive grows
+        self._maps_rows = 0
+
+    def __len__(self):
+        return self.index['n_rows']
+
+    def _lock(self):
+        """Returns an exclusive lock on the archive, as context manager, to serialize appends of several workers."""
+
+        return _FileLock(os.path.join(self.path, '.lock'))
+
+    def _read_index(self) -> dict:
+        with open(self.index_path, 'r') as f:
+            return json.load(f)
+
+    def _write_index(self, index: dict):
+        # write then rename, readers never see a partially written index
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.path, name + '.bin')
+
+    def append_episode(self, episode_id: int, obs, actions, rewards, times):
+        """
+        Appends the experience of a whole episode to the archive.
+
+        :param episode_id: id of the episode, stored with every row
+        :param obs: sequence of observation vectors (n_steps x obs_size)
+        :param actions: sequence of action vectors (n_steps x action_size), e.g. one-hot
+        :param rewards: sequence of rewards (n_steps, or n_steps x reward_size)
+        :param times: sequence of simulation datetimes (n_steps)
+        """
+        n_steps = len(obs)
+        data = {
+            'obs': obs,
+            'actions': actions,
+            'rewards': rewards,
+            'time': np.asarray(times, dtype='datetime64[s]'),
+            'episode': np.full(n_steps, episode_id),
+        }
+        arrays = {}
+        for name, column in self.columns.items():
+            array = np.ascontiguousarray(data[name], dtype=column['dtype']).reshape(-1, column['width'])
+            if array.shape[0] != n_steps:
+                raise ValueError(f'ERROR: Column [{name}] has [{array.shape[0]}] rows, the episode has [{n_steps}] '
+                                 f'observations.')
+            arrays[name] = array
+        if n_steps == 0:
+            return
+
+        with self._lock():
+            index = self._read_index()
+            for name, array in arrays.items():
+                # written at the end of the indexed rows, not of the file: the index is the single source of truth,
+                # bytes left past it by a crashed append are overwritten, then cut
+                with open(os.open(self._column_path(name), os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+                    f.seek(index['n_rows'] * array.itemsize * self.columns[name]['width'])
+                    f.write(array.tobytes())
+                    f.truncate()
+            index['episodes'].append([int(episode_id), index['n_rows'], n_steps])
+            index['n_rows'] += n_steps
+            self._write_index(index)
+        self.index = index
+
+    def refresh(self):
+        """Reloads the index to see episodes appended by other processes since opening the archive."""
+
+        self.index = self._read_index()
+
+    def column(self, name: str) -> np.ndarray:
+        """Returns the read-only memory map of a column, as [n_rows, width] array."""
+
+        n_rows = self.index['n_rows']
+        if self._maps_rows != n_rows:
+            self._maps = {}
+            self._maps_rows = n_rows
+        if name not in self._maps:
+            column = self.columns[name]
+            if n_rows == 0:
+                return np.empty((0, column['width']), dtype=column['dtype'])
+            self._maps[name] = np.memmap(self._column_path(name), dtype=column['dtype'], mode='r',
+                                         shape=(n_rows, column['width']))
+        return self._maps[name]
+
+    def episode(self, episode_id: int) -> dict:
+        """Returns the rows of an episode as dict of column name -> [n_steps, width] memory map views."""
+
+        for e_id, first_row, n_rows in self.index['episodes']:
+            if e_id == episode_id:
+                return {name: self.column(name)[first_row:first_row + n_rows] for name in self.columns}
+        raise KeyError(f'ERROR: Episode [{episode_id}] is not in the experience archive [{self.path}].')
+
+    def sample(self, batch_size: int, rng: np.random.Generator = None, columns: list = None) -> dict:
+        """
+        Samples random rows (transitions) from the whole archive, only the sampled rows are read from disk.
+
+        :return: dict of column name -> [batch_size, width] array
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        rows = np.sort(rng.integers(0, len(self), size=batch_size))  # sorted rows read the files in order
+        return {name: np.asarray(self.column(name)[rows]) for name in (columns or self.columns)}
+
+    def sample_windows(self, batch_size: int, window: int, rng: np.random.Generator = None,
+                       columns: list = None) -> dict:
+        """
+        Samples random windows of contiguous timesteps, never crossing episode boundaries (e.g. for NODE training).
+
+        :return: dict of column name -> [batch_size, window, width] array
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        episodes = np.array([e for e in self.index['episodes'] if e[2] >= window], dtype=np.int64).reshape(-1, 3)
+        if episodes.shape[0] == 0:
+            raise ValueError(f'ERROR: No episode of the archive has at least [{window}] timesteps.')
+        # windows are uniform over all valid start rows of all episodes
+        n_starts = episodes[:, 2] - window + 1
+        picks = rng.integers(0, n_starts.sum(), size=batch_size)
+        episode_i = np.searchsorted(np.cumsum(n_starts), picks, side='right')
+        starts = episodes[episode_i, 1] + picks - (np.cumsum(n_starts) - n_starts)[episode_i]
+        rows = starts[:, None] + np.arange(window)[None, :]
+        return {name: np.asarray(self.column(name)[rows.ravel()]).reshape(batch_size, window, -1)
+                for name in (columns or self.columns)}
+
+
+class _FileLock:
+    """Exclusive advisory lock on a file (Linux/Unix), used as context manager."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
@@ -1,7 +1,6 @@
-import pandas as pd
-
 from eplus_drl import EmsPy
 import os
+import numpy as np
 
 
 class BcaEnv(EmsPy):
@@ -30,6 +29,101 @@ class BcaEnv(EmsPy):
         super().__init__(ep_path, ep_idf_to_run, timesteps, tc_vars, tc_intvars, tc_meters, tc_actuator, tc_weather)
         self.ems_list_update_checked = False  # TODO get rid off, doesnt work with multiple method instances
 
+        # multi-zone layout, see set_zone_layout()
+        self.zones = []
+        self.zone_features = []
+        self.zone_actuation_order = []
+        self._zone_data_lists = None  # [feature][zone] data lists, bound at first zone observation
+        self._zone_observations = None  # [n_zones, n_features] buffer
+        self.bulk_harvested = False  # data loaded from the SQLite output by run_env_bulk(), no callbacks
+
+        # time-indexed history of tracked metrics, see track_history() and window()
+        self.history_metrics = []
+        self._history = None  # [capacity, n_metrics] buffer, rows [:_history_count] filled
+        self._history_times = None  # datetime64 end of the timestep of each row, strictly increasing
+        self._history_count = 0
+        self._history_synced = 0  # rows of the data lists already copied to the history
+        self._history_source = None  # t_datetimes list the history was copied from
+
+    @staticmethod
+    def zone_toc(template: dict, zones: dict) -> dict:
+        """
+        Expands a per-zone ToC template, the same EMS variables/actuators repeated across zone keys, into a ToC.
+
+        Every '{zone}' in the template's EMS object details is replaced by the zone's key, and each metric is named
+        '<template name>_<zone name>', e.g.:
+            zone_toc({'temp': ('Zone Air Temperature', '{zone}')}, {'z1': 'Thermal Zone 1', 'z2': 'Thermal Zone 2'})
+            -> {'temp_z1': ('Zone Air Temperature', 'Thermal Zone 1'), 'temp_z2': ('Zone Air Temperature', 'Thermal Zone 2')}
+
+        :param template: ToC dict (var, intvar, meter or actuator form) with '{zone}' placeholders
+        :param zones: dict of zone name -> zone key in the .idf, in zone order
+        :return: ToC dict to merge into the ToCs given to BcaEnv
+        """
+        toc = {}
+        for zone_name, zone_key in zones.items():
+            for name, details in template.items():
+                if isinstance(details, str):
+                    zone_details = details.replace('{zone}', zone_key)
+                else:
+                    zone_details = type(details)(detail.replace('{zone}', zone_key) for detail in details)
+                toc[f'{name}_{zone_name}'] = zone_details
+        return toc
+
+    def set_zone_layout(self, zones: list, features: list, actuators: list = None):
+        """
+        Declares the zones of a multi-zone (shared-parameter, multi-agent) controller, see zone_toc().
+
+        Observations of all zones are then returned together as one [n_zones, n_features] array by
+        get_zone_observations(), and actions of all zones can be returned by the actuation function as one
+        [n_zones, n_actions] array, by setting actuation_order=zone_actuation_order for its calling point.
+
+        :param zones: zone names, as given to zone_toc()
+        :param features: observation features, either template names of zone_toc() (per zone metric
+        '<feature>_<zone>') or any other EMS/timing metric (e.g. weather, time), repeated for all zones
+        :param actuators: template names of zone_toc() of the per zone actuators, in action order
+        """
+        for feature in features:
+            zone_metrics = [f'{feature}_{zone}' for zone in zones]
+            if not all(metric in self.ems_type_dict for metric in zone_metrics) and feature not in self.ems_type_dict:
+                raise ValueError(f'ERROR: The zone feature [{feature}] is neither a zone template metric for all '
+                                 f'zones {zone_metrics}, nor an EMS/timing metric of your ToCs.')
+        self.zone_actuation_order = [f'{actuator}_{zone}' for zone in zones for actuator in (actuators or [])]
+        for actuator_name in self.zone_actuation_order:
+            if actuator_name not in self._actuator_index:
+                raise ValueError(f'ERROR: The zone actuator [{actuator_name}] is not in your Actuator ToC.')
+        self.zones = list(zones)
+        self.zone_features = list(features)
+        self._zone_data_lists = None
+        self._zone_observations = np.zeros((len(zones), len(features)))
+
+    def _zone_data_list(self, metric: str) -> list:
+        ems_type = self._get_ems_type(metric)
+        if ems_type == 'time':
+            return getattr(self, metric)
+        return getattr(self, 'data_' + ems_type + '_' + metric)
+
+    def get_zone_observations(self, out: np.ndarray = None) -> np.ndarray:
+        """
+        Returns the most recent values of the zone features of all zones, see set_zone_layout().
+
+        :param out: optional [n_zones, n_features] array to write into, otherwise an internal buffer is returned, which
+        is overwritten at the next call
+        :return: [n_zones, n_features] array, one row per zone
+        """
+        if self._zone_data_lists is None:
+            if not self.zones:
+                raise Exception('ERROR: No zones declared, please use set_zone_layout() first.')
+            # per zone data lists of every feature, shared (same list) for features common to all zones
+            self._zone_data_lists = [[self._zone_data_list(feature if feature in self.ems_type_dict
+                                                           else f'{feature}_{zone}') for zone in self.zones]
+                                     for feature in self.zone_features]
+        observations = self._zone_observations if out is None else out
+        for j, zone_lists in enumerate(self._zone_data_lists):
+            column = observations[:, j]
+            for i, data_list in enumerate(zone_lists):
+                column[i] = data_list[-1]
+        return observations
+
     def set_calling_point_and_callback_function(self, calling_point: str,
                                                 observation_function,
                                                 actuation_function,
@@ -37,7 +131,8 @@ class BcaEnv(EmsPy):
                                                 update_observation_frequency: int = 1,
                                                 update_actuation_frequency: int = 1,
                                                 observation_function_kwargs: dict = None,
-                                                actuation_function_kwargs: dict = None
+                                                actuation_function_kwargs: dict = None,
+                                                actuation_order: list = None
                                                 ):
         """
         Sets connection for runtime calling points and custom callback function specification with defined arguments.
@@ -51,7 +146,8 @@ class BcaEnv(EmsPy):
         :param observation_function: the user defined observation function to be called at runtime calling point and desired
         timestep frequency, to be used to gather state data for agent before taking actions.
         :param actuation_function: the user defined actuation function to be called at runtime calling point and desired
-        timestep frequency, function must return dict of actuator names (key) and associated setpoint (value)
+        timestep frequency, function must return dict of actuator names (key) and associated setpoint (value), or a
+        vector (list, NumPy array) of setpoints in the order given by actuation_order
         :param update_state: whether EMS and time/timestep data should be updated from simulation for this calling point.
         :param update_observation_frequency: the number of zone timesteps per running the observation function
         :param update_actuation_frequency: the number of zone timesteps per updating the actuators from the actuation
@@ -60,6 +156,9 @@ class BcaEnv(EmsPy):
         **kwargs must be in your passed observation function to use, otherwise leave as None
         :param actuation_function_kwargs: a dictionary to be fixed input to your actuation function as **kwargs.
         **kwargs must be in your passed actuation function to use, otherwise leave as None
+        :param actuation_order: list of actuator names from the actuator ToC, the order of the setpoint vector returned
+        by the actuation function. Leave as None to use the actuator ToC order. Names are verified once at simulation
+        start, vector setpoints are then written with no per-actuator name lookups.
         """
 
         if update_actuation_frequency > update_observation_frequency:
@@ -70,7 +169,8 @@ class BcaEnv(EmsPy):
         else:
             self.calling_point_callback_dict[calling_point] = [observation_function, actuation_function, update_state,
                                                                update_observation_frequency, update_actuation_frequency,
-                                                               observation_function_kwargs, actuation_function_kwargs]
+                                                               observation_function_kwargs, actuation_function_kwargs,
+                                                               actuation_order]
 
     def _check_ems_metric_input(self, ems_metric):
         """Verifies user-input of EMS metric/type list is valid."""
@@ -93,7 +193,8 @@ class BcaEnv(EmsPy):
         EMS metrics and timing can be called, or just a single EMS Category (either 'var', 'intvar', 'meter', 'actuator'
         or, 'weather'), and 1 data point to the entire current data set can be returned.
 
-        It is likely that the user will want the most recent data point only, this is a default argument.
+        It is likely that the user will want the most recent data point only, this is a default argument. For time
+        windows of data (e.g. the last 2 hours), see window().
 
         If calling any default timing data, see emspy.available_timing_metrics for available timing data.
 
@@ -187,6 +288,138 @@ class BcaEnv(EmsPy):
 
         return return_data
 
+    def track_history(self, metrics: list, capacity: int = 4096):
+        """
+        Declares the EMS/timing metrics kept in a time-indexed history, queried by window().
+
+        The history is a [timesteps, metrics] float array in the order of the given metrics, filled from the data lists
+        as they grow (only new timesteps are copied, at the next window() call) and doubled in capacity when full. Its
+        datetime index is strictly increasing: repeated datetimes (several calling points per timestep) keep the most
+        recent values, and a datetime going back (a new environment, e.g. from the sizing periods to the run period)
+        restarts the history.
+
+        :param metrics: var, meter, actuator, weather or numeric timing metrics (e.g. t_hours), in column order
+        :param capacity: initial number of timesteps of the history buffer
+        """
+        for metric in metrics:
+            ems_type = self.ems_type_dict.get(metric)
+            if metric not in self.available_timing_metrics and ems_type not in ('var', 'meter', 'actuator', 'weather'):
+                raise ValueError(f'ERROR: The metric [{metric}] can not be tracked in the history, only var, meter, '
+                                 f'actuator, weather and timing metrics updated at every timestep can.')
+            if metric in ('t_datetimes', 't_actual_date_times', 'timesteps_zone', 'callbacks'):
+                raise ValueError(f'ERROR: The timing metric [{metric}] is not numeric, it can not be tracked in the '
+                                 f'history.')
+        self.history_metrics = list(metrics)
+        self._history = np.empty((max(capacity, 1), len(metrics)))
+        self._history_times = np.empty(max(capacity, 1), dtype='datetime64[s]')
+        self._history_count = 0
+        self._history_synced = 0
+        self._history_source = None
+
+    def _sync_history(self):
+        """Copies the timesteps appended to the data lists since the last call into the history."""
+
+        if self._history_source is not self.t_datetimes:  # new data lists, e.g. loaded in bulk
+            self._history_source = self.t_datetimes
+            self._history_count = 0
+            self._history_synced = 0
+        start, stop = self._history_synced, len(self.t_datetimes)
+        if stop == start:
+            return
+        times = np.array(self.t_datetimes[start:stop], dtype='datetime64[s]')
+        values = np.empty((stop - start, len(self.history_metrics)))
+        for j, metric in enumerate(self.history_metrics):
+            values[:, j] = self._zone_data_list(metric)[start:stop]
+        self._history_synced = stop
+
+        # keep the datetime index strictly increasing
+        backwards = np.flatnonzero(times[1:] < times[:-1])
+        if len(backwards):
+            times, values = times[backwards[-1] + 1:], values[backwards[-1] + 1:]
+            self._history_count = 0
+        count = self._history_count
+        if count and times[0] <= self._history_times[count - 1]:
+            if times[0] < self._history_times[count - 1]:
+                count = 0  # new environment
+            else:
+                count -= 1  # same timestep, most recent values
+        last = np.append(times[1:] != times[:-1], True)  # last of repeated datetimes
+        times, values = times[last], values[last]
+
+        needed = count + len(times)
+        if needed > len(self._history_times):
+            capacity = max(needed, 2 * len(self._history_times))
+            history = np.empty((capacity, len(self.history_metrics)))
+            history[:count] = self._history[:count]
+            history_times = np.empty(capacity, dtype='datetime64[s]')
+            history_times[:count] = self._history_times[:count]
+            self._history, self._history_times = history, history_times  # earlier views keep the old buffer
+        self._history[count:needed] = values
+        self._history_times[count:needed] = times
+        self._history_count = needed
+
+    def window(self, metrics: list = None, start=None, end=None, lookback=None, return_times: bool = False):
+        """
+        Returns the tracked history of metrics over a time window, as a [timesteps, metrics] NumPy array.
+
+        Timesteps are selected by the datetime of their end (t_datetimes), those ending in (start, end], resolved by
+        binary search of the history index. E.g. the last 2 hours: window(['zn0_temp'], lookback=timedelta(hours=2)),
+        the same hour yesterday: window(['zn0_temp'], start=now - timedelta(hours=25), end=now - timedelta(hours=24)).
+
+        The array is a view of the history buffer (no copy) when the metrics are all tracked metrics, or tracked
+        metrics evenly spaced in tracking order (e.g. a contiguous run), otherwise a copy. Views are read-only and
+        stay valid, but are not updated by later timesteps.
+
+        :param metrics: metrics to return, all tracked metrics if None. If no history is tracked yet, it is started
+        with these metrics (from the data lists so far), see track_history()
+        :param start: datetime, timesteps ending after it, from the start of the history if None
+        :param end: datetime, timesteps ending at or before it, up to the most recent timestep if None
+        :param lookback: timedelta, sets start to end - lookback
+        :param return_times: also return the datetime64 view of the timestep ends of the rows
+        :return: [timesteps, metrics] array, and the [timesteps] datetimes if return_times
+        """
+        if metrics is not None and type(metrics) is not list:
+            metrics = [metrics]
+        if self._history is None:
+            if metrics is None:
+                raise Exception('ERROR: No history tracked, please use track_history() or pass metrics.')
+            self.track_history(metrics)
+        self._sync_history()
+
+        count = self._history_count
+        times = self._history_times[:count]
+        if end is None:
+            stop = count
+            end = times[-1] if count else None
+        else:
+            stop = int(np.searchsorted(times, np.datetime64(end, 's'), side='right'))
+        if lookback is not None:
+            if end is None:  # no data yet
+                start = None
+            else:
+                start = np.datetime64(end, 's') - np.timedelta64(lookback).astype('timedelta64[s]')
+        first = 0 if start is None else min(int(np.searchsorted(times, np.datetime64(start, 's'), side='right')), stop)
+
+        rows = self._history[first:stop]
+        if metrics is not None and metrics != self.history_metrics:
+            try:
+                columns = [self.history_metrics.index(metric) for metric in metrics]
+            except ValueError:
+                raise ValueError(f'ERROR: Only the tracked metrics {self.history_metrics} can be queried, use '
+                                 f'track_history() to track {metrics}.')
+            step = columns[1] - columns[0] if len(columns) > 1 else 1
+            if step > 0 and columns == list(range(columns[0], columns[0] + step * len(columns), step)):
+                rows = rows[:, columns[0]:columns[-1] + 1:step]
+            else:
+                rows = rows[:, columns]  # copy
+        if np.shares_memory(rows, self._history):
+            rows.flags.writeable = False
+        if return_times:
+            row_times = times[first:stop].view()
+            row_times.flags.writeable = False
+            return rows, row_times
+        return rows
+
     def get_weather_forecast(self, weather_metrics: list, when: str, hour: int, zone_ts: int):
         """
         Fetches given weather metric from today/tomorrow for a given hour of the day and timestep within that hour.
@@ -269,7 +502,9 @@ class BcaEnv(EmsPy):
         :return: (concatenation of) pandas dataframes in order of entry or [vars, intvars, meters, weather, actuator] by
         default.
         """
-        if not self.calling_point_callback_dict:
+        import pandas as pd  # imported lazily, only needed once the simulation is done
+
+        if not self.calling_point_callback_dict and not self.bulk_harvested:
             raise Exception('ERROR: There is no dataframe data to collect and return, please specific calling point(s)'
                             ' first.')
         if self.simulation_success != 0:
@@ -339,4 +574,84 @@ class BcaEnv(EmsPy):
         """
         
         return self.run_simulation(weather_file_path,output_dir)
-        
+
+    def run_env_bulk(self, weather_file_path: str, output_dir: str = 'out'):
+        """
+        Runs E+ simulation without any Python callback, for observation-only simulations (no actuators).
+
+        The ToC variables, meters and weather metrics are requested as zone timestep outputs of a copy of the .idf
+        model, written to output_dir, and bulk-loaded from the SQLite output after the run into the same data lists,
+        timing lists and default dataframes (see get_df()) as run_env() would fill, see eplus_drl.bulk.
+        """
+        from eplus_drl import bulk
+
+        success = self._run_bulk(weather_file_path, output_dir, bulk.output_requests(self))
+        if success == 0 and self.default_dfs_tracked:
+            self._create_default_dataframes()
+            print('* * * Default DF Creation Done * * *')
+        return success
+
+    def run_env_erl(self, controllers: list, weather_file_path: str, output_dir: str = 'out',
+                    calling_point: str = 'callback_begin_zone_timestep_before_init_heat_balance'):
+        """
+        Runs E+ simulation controlled by controllers compiled to native EMS Erl programs, without any Python callback.
+
+        The controllers (see eplus_drl.erl) are injected into a copy of the .idf model, the ToC metrics and the values
+        of the controlled actuators are then harvested as with run_env_bulk(). ToC actuators without controller are
+        removed, as unused actuators of run_env().
+
+        :param controllers: list of eplus_drl.erl.ErlController, expressed against the ToC names
+        :param calling_point: calling point at which the controllers run, see EmsPy.available_calling_points
+        """
+        from eplus_drl import bulk, erl
+
+        actuators = [controller.actuator for controller in controllers]
+        ems_objects = erl.compile_erl(self, controllers, calling_point=calling_point)
+        success = self._run_bulk(weather_file_path, output_dir, bulk.output_requests(self, actuators), ems_objects)
+        if success == 0:
+            # setpoints are the actuated values, unused actuators removed as in _post_process_data()
+            self._actuators_used_set = set(actuators)
+            for actuator_name in self.tc_actuator:
+                if actuator_name in self._actuators_used_set:
+                    setattr(self, 'data_setpoint_' + actuator_name,
+                            np.asarray(getattr(self, 'data_actuator_' + actuator_name)))
+                else:
+                    delattr(self, 'data_actuator_' + actuator_name)
+            if actuators:
+                self.ems_num_dict['actuator'] = len(actuators)
+            else:
+                self.ems_num_dict.pop('actuator', None)
+            if self.default_dfs_tracked:
+                self._create_default_dataframes()
+                print('* * * Default DF Creation Done * * *')
+        return success
+
+    def _run_bulk(self, weather_file_path: str, output_dir: str, requests: list, extra_idf_objects: list = None):
+        """Runs a copy of the .idf model with the requested outputs (and extra objects), loads the SQLite output."""
+
+        from eplus_drl import bulk, idf
+
+        if not requests:
+            raise ValueError('ERROR: No ToC variables, meters or weather metrics to harvest.')
+        idf_text = idf.read_idf(self.idf_file)
+        run_idf_text = bulk.add_output_requests(idf_text, requests)
+        if extra_idf_objects:
+            run_idf_text = idf.append_idf_objects(run_idf_text, extra_idf_objects)
+        run_idf_path = idf.write_idf(run_idf_text, idf.idf_variant_path(self.idf_file, output_dir, 'bulk'))
+
+        print('\n* * * Running E+ Simulation (bulk harvesting, no callbacks) * * *\n')
+        self.simulation_success = self.api.runtime.run_energyplus(self.state, ['-w', weather_file_path, '-d',
+                                                                               output_dir, run_idf_path])
+        if self.simulation_success != 0:
+            print('\n* * * Simulation FAILED * * *\n')
+            return self.simulation_success
+
+        print('\n* * * Simulation Done * * *')
+        self.timestep_per_hour = self.timestep_input
+        self.timestep_period = 60 // self.timestep_input
+        self.timestep_params_initialized = True
+        time, values = bulk.read_sqlite(os.path.join(output_dir, 'eplusout.sql'), requests,
+                                        default_year=idf.get_run_period(idf_text)[0].year)
+        bulk.load_into(self, time, values, requests)
+        self.bulk_harvested = True
+        return self.simulation_success
@@ -0,0 +1,186 @@
+"""
+Callback-free bulk harvesting of observation-only simulations.
+
+When a simulation does not actuate anything, the Python callbacks of EmsPy are only there to copy the ToC metrics into
+lists, one Python round-trip per metric per timestep. Instead, the ToC variables, meters and weather metrics can be
+requested from EnergyPlus itself as zone timestep outputs in its SQLite output file (eplusout.sql): EnergyPlus runs
+without any Python callback, and the results are loaded at once (vectorized) into the same BcaEnv data lists, timing
+lists and default dataframes, see BcaEnv.run_env_bulk().
+
+Only the run period is loaded (no sizing periods or warmup days). HVAC variables reported at the zone timestep are
+averaged by EnergyPlus over the system timesteps, where callbacks read their most recent value.
+"""
+
+import sqlite3
+
+import numpy as np
+
+from eplus_drl import idf
+
+# weather metrics of EmsPy available as Output:Variable (key 'Environment'), metric -> (variable name, conversion)
+weather_output_variables = {
+    'outdoor_dry_bulb': ('Site Outdoor Air Drybulb Temperature', None),
+    'outdoor_dew_point': ('Site Outdoor Air Dewpoint Temperature', None),
+    'outdoor_relative_humidity': ('Site Outdoor Air Relative Humidity', None),
+    'outdoor_barometric_pressure': ('Site Outdoor Air Barometric Pressure', None),
+    'wind_speed': ('Site Wind Speed', None),
+    'wind_direction': ('Site Wind Direction', None),
+    'sky_temperature': ('Site Sky Temperature', None),
+    'horizontal_ir': ('Site Horizontal Infrared Radiation Rate per Area', None),
+    'beam_solar': ('Site Direct Solar Radiation Rate per Area', None),
+    'diffuse_solar': ('Site Diffuse Solar Radiation Rate per Area', None),
+    'liquid_precipitation': ('Site Precipitation Depth', None),
+    'is_raining': ('Site Rain Status', None),
+    'is_snowing': ('Site Snow on Ground Status', None),
+    'sun_is_up': ('Site Solar Altitude Angle', lambda altitude: (altitude > 0).astype(float)),
+}
+
+
+class OutputRequest:
+    """One ToC metric requested as EnergyPlus zone timestep output."""
+
+    def __init__(self, metric: str, ems_type: str, name: str, key: str = None, conversion=None):
+        self.metric = metric
+        self.ems_type = ems_type
+        self.name = name  # variable or meter name
+        self.key = key  # variable key, None for meters
+        self.conversion = conversion
+
+    def idf_object(self) -> tuple:
+        if self.key is None:
+            return 'Output:Meter', [self.name, 'Timestep']
+        return 'Output:Variable', [self.key, self.name, 'Timestep']
+
+
+def output_requests(bca, actuators: list = None) -> list:
+    """
+    Returns the OutputRequest of every ToC metric of a BcaEnv.
+
+    :param actuators: ToC actuators controlled by compiled Erl controllers (see eplus_drl.erl), reported as EMS output
+    variables. Bulk harvesting has no actuation otherwise.
+    """
+    if actuators is None and bca.tc_actuator:
+        raise ValueError(f'ERROR: Bulk harvesting runs without callbacks and can not actuate, remove the actuators '
+                         f'{list(bca.tc_actuator)} from the ToC or run with run_env().')
+    if bca.tc_intvar:
+        print(f'*NOTE: Internal variables {list(bca.tc_intvar)} are only available through the API, they are not '
+              f'harvested in bulk.')
+    requests = []
+    for metric, (name, key) in (bca.tc_var or {}).items():
+        requests.append(OutputRequest(metric, 'var', name, key))
+    for metric, name in (bca.tc_meter or {}).items():
+        requests.append(OutputRequest(metric, 'meter', name))
+    for metric, weather_metric in (bca.tc_weather or {}).items():
+        if weather_metric not in weather_output_variables:
+            raise ValueError(f'ERROR: The weather metric [{weather_metric}] has no EnergyPlus output variable, it '
+                             f'can not be harvested in bulk.')
+        name, conversion = weather_output_variables[weather_metric]
+        requests.append(OutputRequest(metric, 'weather', name, 'Environment', conversion))
+    for actuator in actuators or []:
+        requests.append(OutputRequest(actuator, 'actuator', f'{actuator} Erl Value', 'EMS'))
+    return requests
+
+
+def add_output_requests(idf_text: str, requests: list) -> str:
+    """Returns .idf text with the zone timestep outputs of the requests, and the SQLite output, appended."""
+
+    new_objects = [request.idf_object() for request in requests]
+    if not idf.get_idf_objects(idf_text, 'Output:SQLite'):
+        new_objects.append(('Output:SQLite', ['Simple']))
+    return idf.append_idf_objects(idf_text, new_objects)
+
+
+def read_sqlite(sql_path: str, requests: list, default_year: int = 2017):
+    """
+    Reads the zone timestep values of the requests over the run period(s) from an EnergyPlus SQLite output file.
+
+    :param sql_path: path to eplusout.sql
+    :param requests: list of OutputRequest, see output_requests()
+    :param default_year: calendar year of the timestamps if the file has none
+    :return: (time, values) with time a dict of 'year', 'month', 'day', 'hour', 'minute' (end of the timestep),
+    'simulation_days' and 'day_type' arrays, and values a [n_timesteps, n_requests] float array
+    """
+    connection = sqlite3.connect(f'file:{sql_path}?mode=ro', uri=True)
+    try:
+        dictionary = connection.execute(
+            "SELECT ReportDataDictionaryIndex, IsMeter, KeyValue, Name FROM ReportDataDictionary "
+            "WHERE ReportingFrequency = 'Zone Timestep'").fetchall()
+        lookup = {(bool(is_meter), (key or '').upper(), name.upper()): index
+                  for index, is_meter, key, name in dictionary}
+        dictionary_indexes = []
+        for request in requests:
+            index = lookup.get((request.key is None, (request.key or '').upper(), request.name.upper()))
+            if index is None:
+                raise ValueError(f'ERROR: [{request.metric}] ({request.name}, {request.key}) is not in the SQLite '
+                                 f'output [{sql_path}], check its name/key in the .rdd/.mdd files.')
+            dictionary_indexes.append(index)
+
+        # run period timesteps, no sizing periods or warmup days
+        times = connection.execute(
+            "SELECT t.TimeIndex, t.Year, t.Month, t.Day, t.Hour, t.Minute, t.SimulationDays, t.DayType FROM Time t "
+            "JOIN EnvironmentPeriods e ON t.EnvironmentPeriodIndex = e.EnvironmentPeriodIndex "
+            "WHERE e.EnvironmentType = 3 AND t.IntervalType = -1 AND (t.WarmupFlag = 0 OR t.WarmupFlag IS NULL) "
+            "ORDER BY t.TimeIndex").fetchall()
+        placeholders = ','.join('?' * len(dictionary_indexes))
+        data = np.array(connection.execute(
+            f"SELECT TimeIndex, ReportDataDictionaryIndex, Value FROM ReportData "
+            f"WHERE ReportDataDictionaryIndex IN ({placeholders})", dictionary_indexes).fetchall(), dtype=float)
+    finally:
+        connection.close()
+
+    columns = np.nan_to_num(np.array([row[:7] for row in times], dtype=float).reshape(-1, 7)).astype(np.int64)
+    time_indexes = columns[:, 0]
+    time = {'year': np.where(columns[:, 1] > 0, columns[:, 1], default_year), 'month': columns[:, 2],
+            'day': columns[:, 3], 'hour': columns[:, 4], 'minute': columns[:, 5], 'simulation_days': columns[:, 6],
+            'day_type': np.array([row[7] or '' for row in times], dtype=object)}
+
+    # scatter the (time index, dictionary index, value) rows into one column per dictionary index
+    unique_indexes = sorted(set(dictionary_indexes))
+    column_lookup = np.full(max(unique_indexes) + 1, -1)
+    column_lookup[unique_indexes] = np.arange(len(unique_indexes))
+    unique_values = np.full((len(time_indexes), len(unique_indexes)), np.nan)
+    if len(data) and len(time_indexes):
+        rows = np.searchsorted(time_indexes, data[:, 0].astype(np.int64))
+        in_period = time_indexes[np.minimum(rows, len(time_indexes) - 1)] == data[:, 0]  # other environments out
+        unique_values[rows[in_period], column_lookup[data[in_period, 1].astype(np.int64)]] = data[in_period, 2]
+    values = unique_values[:, column_lookup[dictionary_indexes]]
+    for j, request in enumerate(requests):
+        if request.conversion is not None:
+            values[:, j] = request.conversion(values[:, j])
+    return time, values
+
+
+def load_into(bca, time: dict, values: np.ndarray, requests: list):
+    """
+    Fills the timing lists and the data lists of the requested metrics of a BcaEnv, as its callbacks would have.
+    """
+    import pandas as pd  # imported lazily, like the dataframes of the simulation
+
+    period = bca.timestep_period
+    minute = time['minute']
+    if np.any(minute % period):
+        raise ValueError(f'ERROR: The SQLite output timesteps do not match the timestep period of [{period}] minutes, '
+                         f'check the Timestep of the .idf model.')
+    # the SQLite timestamp is the end of the timestep (hour 24 minute 0 at the end of a day), as t_datetimes
+    datetimes = pd.to_datetime(pd.DataFrame({'year': time['year'], 'month': time['month'], 'day': time['day']})) + \
+        pd.to_timedelta(time['hour'] * 60 + minute, unit='min')
+    ends_hour = minute == 0
+    n = len(minute)
+
+    bca.t_datetimes = list(datetimes.dt.to_pydatetime())
+    bca.t_years = time['year'].tolist()
+    bca.t_months = time['month'].tolist()
+    bca.t_days = time['day'].tolist()
+    bca.t_hours = np.where(ends_hour, time['hour'] - 1, time['hour']).tolist()  # hour of the timestep start, 0-23
+    bca.t_minutes = np.where(ends_hour, 60, minute).tolist()  # end minute of the timestep, 1-60
+    bca.t_current_times = (np.array(bca.t_hours) + np.array(bca.t_minutes) / 60).tolist()
+    bca.t_cumulative_time = ((time['simulation_days'] - 1) * 24 + np.array(bca.t_current_times)).tolist()
+    bca.t_holiday_index = [int(day_type[len('SpecialDay'):]) if day_type.startswith('SpecialDay')
+                           else int(day_type == 'Holiday') for day_type in time['day_type']]
+    bca.timesteps_zone_num = (((minute + 59) % 60) // period + 1).tolist()
+    bca.timestep_zone_num_current = bca.timesteps_zone_num[-1] if n else 0
+    bca.timestep_total_count = n
+    bca.callback_calling_points = ['bulk'] * n
+    for j, request in enumerate(requests):
+        setattr(bca, 'data_' + request.ems_type + '_' + request.metric, values[:, j].tolist())
+        bca.ems_current_data_dict[request.metric] = values[-1, j] if n else None
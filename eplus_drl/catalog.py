@@ -0,0 +1,276 @@
+"""
+Embedded SQLite catalog of experiments, simulation runs and training episodes.
+
+Every experiment (e.g. one training with main.py, or one evaluation) is registered with its parameters and the hash
+of its config, and every BcaEnv simulation run/episode with the hashes of its .idf model and .epw weather file,
+simulated period, timings, KPIs and artifact paths (models, plots, CSVs). Time series of a run are stored next to the
+database as columnar side files (one .npy file per metric, memory mappable), referenced from the catalog, so that
+queries over thousands of runs never read the raw outputs:
+
+    catalog = ExperimentCatalog('Catalog')
+    experiment_id = catalog.create_experiment('a2c_lr_sweep', config)
+    catalog.register_run(experiment_id, sim, weather_file_path, kpis={'mean_ppd': 12.3}, wall_time=95.2)
+
+    catalog.query('''
+        SELECT p.value AS learning_rate, MIN(k.value) AS best_mean_ppd
+        FROM runs r
+        JOIN params p ON p.experiment_id = r.experiment_id AND p.name = 'learning_rate'
+        JOIN kpis k ON k.run_id = r.id AND k.name = 'mean_ppd'
+        WHERE strftime('%m', r.period_begin) = '12'
+        GROUP BY p.value''')
+
+Several processes can register runs at the same time, each opens its own connection (WAL journal).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+import numpy as np
+
+_schema = """
+CREATE TABLE IF NOT EXISTS experiments (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    config_hash TEXT,
+    config TEXT,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS params (
+    experiment_id INTEGER REFERENCES experiments(id),
+    name TEXT,
+    value
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    experiment_id INTEGER REFERENCES experiments(id),
+    kind TEXT,
+    episode INTEGER,
+    idf_path TEXT,
+    idf_hash TEXT,
+    epw_path TEXT,
+    epw_hash TEXT,
+    period_begin TEXT,
+    period_end TEXT,
+    n_timesteps INTEGER,
+    wall_time REAL,
+    created_at REAL,
+    timeseries_path TEXT
+);
+CREATE TABLE IF NOT EXISTS kpis (
+    run_id INTEGER REFERENCES runs(id),
+    name TEXT,
+    value REAL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    experiment_id INTEGER REFERENCES experiments(id),
+    run_id INTEGER,
+    kind TEXT,
+    path TEXT
+);
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT
+);
+CREATE INDEX IF NOT EXISTS params_name ON params(name, experiment_id);
+CREATE INDEX IF NOT EXISTS runs_experiment ON runs(experiment_id);
+CREATE INDEX IF NOT EXISTS kpis_name ON kpis(name, run_id);
+CREATE INDEX IF NOT EXISTS kpis_run ON kpis(run_id);
+"""
+
+
+def config_hash(config: dict) -> str:
+    """Returns a stable hash of a config dict (key order independent)."""
+
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 hash of a file's content."""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExperimentCatalog:
+    """SQLite catalog of experiments and runs, see module documentation."""
+
+    database_file_name = 'catalog.sqlite'
+
+    def __init__(self, path: str):
+        """
+        :param path: directory of the catalog, holding the database and the time series side files
+        """
+        self.path = path
+        self.database_path = os.path.join(path, self.database_file_name)
+        self.timeseries_dir = os.path.join(path, 'timeseries')
+        os.makedirs(self.timeseries_dir, exist_ok=True)
+        self._connection = None
+        self._pid = None
+        self.connection.executescript(_schema)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """The SQLite connection of this process, (re)opened after a fork."""
+
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.database_path, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        # connections are not sent to other processes
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    def _file_hash(self, path: str) -> str:
+        """Hash of a file, cached by path, size and modification time (weather files are large)."""
+
+        if path is None or not os.path.exists(path):
+            return None
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.connection.execute('SELECT hash FROM file_hashes WHERE path = ? AND size = ? AND mtime = ?',
+                                      (path, stat.st_size, stat.st_mtime)).fetchone()
+        if row is not None:
+            return row[0]
+        digest = file_hash(path)
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+                                    (path, stat.st_size, stat.st_mtime, digest))
+        return digest
+
+    def create_experiment(self, name: str, config: dict, params: dict = None) -> int:
+        """
+        Registers an experiment.
+
+        :param name: name of the experiment
+        :param config: its config dict (e.g. from load_config()), stored as JSON and hashed. Its scalar values are
+        also stored as queryable params.
+        :param params: extra (hyper)parameters to store, e.g. the parameters of a sweep trial
+        :return: experiment id
+        """
+        all_params = {key: value for key, value in config.items() if isinstance(value, (int, float, str, bool))}
+        all_params.update(params or {})
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO experiments (name, config_hash, config, created_at) VALUES (?, ?, ?, ?)',
+                (name, config_hash(config), json.dumps(config, sort_keys=True, default=str), time.time()))
+            experiment_id = cursor.lastrowid
+            self.connection.executemany('INSERT INTO params VALUES (?, ?, ?)',
+                                        [(experiment_id, key, value) for key, value in all_params.items()])
+        return experiment_id
+
+    def register_run(self, experiment_id: int, bca, weather_file_path: str, kpis: dict = None,
+                     wall_time: float = None, episode: int = None, kind: str = 'simulation',
+                     artifacts: dict = None, save_timeseries: bool = True) -> int:
+        """
+        Registers a finished BcaEnv simulation (a training episode, an evaluation run, ...).
+
+        :param experiment_id: id from create_experiment()
+        :param bca: the BcaEnv after run_env()
+        :param weather_file_path: the .epw weather file of the run
+        :param kpis: dict of KPI name -> value
+        :param wall_time: wall time of the run, in seconds
+        :param episode: training episode number, if any
+        :param kind: kind of run, e.g. 'episode', 'evaluation', 'simulation'
+        :param artifacts: dict of artifact kind -> path (e.g. {'csv': 'Dataframes/run.csv'})
+        :param save_timeseries: whether to save the tracked data of all ToC metrics as columnar side files
+        :return: run id
+        """
+        datetimes = bca.t_datetimes
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO runs (experiment_id, kind, episode, idf_path, idf_hash, epw_path, epw_hash, period_begin, '
+                'period_end, n_timesteps, wall_time, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (experiment_id, kind, episode, bca.idf_file, self._file_hash(bca.idf_file), weather_file_path,
+                 self._file_hash(weather_file_path), datetimes[0].isoformat() if datetimes else None,
+                 datetimes[-1].isoformat() if datetimes else None, len(datetimes), wall_time, time.time()))
+            run_id = cursor.lastrowid
+            if kpis:
+                self.connection.executemany('INSERT INTO kpis VALUES (?, ?, ?)',
+                                            [(run_id, name, float(value)) for name, value in kpis.items()])
+            if artifacts:
+                self.connection.executemany('INSERT INTO artifacts VALUES (?, ?, ?, ?)',
+                                            [(experiment_id, run_id, artifact_kind, path)
+                                             for artifact_kind, path in artifacts.items()])
+        if save_timeseries and datetimes:
+            timeseries_path = self._save_timeseries(run_id, bca)
+            with self.connection:
+                self.connection.execute('UPDATE runs SET timeseries_path = ? WHERE id = ?', (timeseries_path, run_id))
+        return run_id
+
+    def add_artifact(self, experiment_id: int, kind: str, path: str, run_id: int = None):
+        """Registers an artifact (model, plot, CSV, log) of an experiment or of one of its runs."""
+
+        with self.connection:
+            self.connection.execute('INSERT INTO artifacts VALUES (?, ?, ?, ?)', (experiment_id, run_id, kind, path))
+
+    def _save_timeseries(self, run_id: int, bca) -> str:
+        """Writes the tracked data of a run, one .npy column file per ToC metric, returns the directory."""
+
+        run_dir = os.path.join(self.timeseries_dir, f'run_{run_id}')
+        os.makedirs(run_dir, exist_ok=True)
+        np.save(os.path.join(run_dir, 't_datetimes.npy'), np.array(bca.t_datetimes, dtype='datetime64[s]'))
+        for metric, ems_type in bca.ems_type_dict.items():
+            if ems_type in ('time', 'intvar'):
+                continue  # time stored once above, internal variables are static
+            data = getattr(bca, 'data_' + ems_type + '_' + metric, None)
+            if data is None or len(data) != len(bca.t_datetimes):
+                continue
+            np.save(os.path.join(run_dir, metric + '.npy'), np.asarray(data, dtype=float))
+        return os.path.relpath(run_dir, self.path)
+
+    def timeseries(self, run_id: int, metrics: list = None) -> dict:
+        """
+        Returns the time series of a run as dict of metric name -> read-only memory-mapped array.
+
+        :param metrics: metric names to load, leave as None for all (plus 't_datetimes')
+        """
+        row = self.connection.execute('SELECT timeseries_path FROM runs WHERE id = ?', (run_id,)).fetchone()
+        if row is None or row[0] is None:
+            raise KeyError(f'ERROR: Run [{run_id}] has no time series in the catalog [{self.path}].')
+        run_dir = os.path.join(self.path, row[0])
+        if metrics is None:
+            metrics = [file_name[:-4] for file_name in sorted(os.listdir(run_dir)) if file_name.endswith('.npy')]
+        return {metric: np.load(os.path.join(run_dir, metric + '.npy'), mmap_mode='r') for metric in metrics}
+
+    def query(self, sql: str, parameters: tuple = (), as_dataframe: bool = False):
+        """Runs a read query on the catalog, returns a list of row tuples or a pandas dataframe."""
+
+        if as_dataframe:
+            import pandas as pd
+            return pd.read_sql_query(sql, self.connection, params=parameters)
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def kpi_table(self, kpi_names: list = None, param_names: list = None):
+        """
+        Returns one row per run with its experiment, params and KPIs as columns, as pandas dataframe.
+
+        :param kpi_names: KPIs to include, leave as None for all
+        :param param_names: experiment params to include, leave as None for none
+        """
+        import pandas as pd
+
+        runs = self.query('SELECT id AS run_id, experiment_id, kind, episode, epw_path, period_begin, period_end, '
+                          'wall_time FROM runs', as_dataframe=True)
+        kpis = self.query('SELECT run_id, name, value FROM kpis', as_dataframe=True)
+        if kpi_names is not None:
+            kpis = kpis[kpis['name'].isin(kpi_names)]
+        table = runs.merge(kpis.pivot_table(index='run_id', columns='name', values='value').reset_index(),
+                           on='run_id', how='left')
+        if param_names:
+            params = self.query('SELECT experiment_id, name, value FROM params', as_dataframe=True)
+            params = params[params['name'].isin(param_names)].pivot(index='experiment_id', columns='name',
+                                                                      values='value').reset_index()
+            table = table.merge(params, on='experiment_id', how='left')
+        return table
@@ -0,0 +1,391 @@
+"""
+Distributed rollouts: EnergyPlus episodes run by worker nodes, experience consumed by one learner, over TCP sockets.
+
+The learner runs a RolloutServer, every node runs a RolloutWorker with a number of slots (parallel E+ processes of the
+node). Workers register to the server and send heartbeats, the server assigns episodes to free slots, broadcasts new
+policy weights to all workers and collects the episode experience. Episodes of workers that disconnect or miss their
+heartbeats are reassigned to the other workers.
+
+Messages are length-prefixed binary frames: a fixed header (message type, metadata length, payload length), a small
+JSON metadata, and a payload of raw NumPy array bytes (no pickle), decoded as zero-copy views of the received buffer.
+
+    # learner
+    server = RolloutServer('0.0.0.0', 5555)
+    server.start()
+    server.broadcast_weights(export_weights(policy))
+    server.submit(range(n_episodes))
+    experience = server.get_episode()  # dict with 'episode', 'worker', 'version', metadata and arrays
+
+    # each worker node
+    def run_episode(episode, weights, version):  # module-level, runs in the node's process pool
+        ...
+        return {'states': states, 'actions': actions, 'rewards': rewards}, {'score': score}
+
+    RolloutWorker('learner-host', 5555, run_episode, slots=32).run()
+
+Everything also runs on localhost, see examples/benchmarks/distributed_localhost.py.
+"""
+
+import os
+import json
+import time
+import queue
+import socket
+import struct
+import threading
+import collections
+import multiprocessing
+
+import numpy as np
+
+# message types
+REGISTER = 1  # worker -> server, {'name', 'slots'}
+WELCOME = 2  # server -> worker, {'worker'}
+HEARTBEAT = 3  # worker -> server
+WEIGHTS = 4  # server -> worker, {'version'} + weight arrays
+TASK = 5  # server -> worker, {'episode', 'version'}
+EPISODE = 6  # worker -> server, {'episode', 'version', ...} + experience arrays
+EPISODE_FAILED = 7  # worker -> server, {'episode', 'error'}
+SHUTDOWN = 8  # server -> worker
+
+_header = struct.Struct('!BII')  # message type, metadata length, payload length
+
+
+def encode_message(message_type: int, meta: dict = None, arrays: dict = None) -> bytes:
+    """Encodes a message frame, see module documentation. Arrays are sent as raw bytes with dtype and shape."""
+
+    meta = dict(meta or {})
+    chunks = []
+    if arrays:
+        specs, offset = [], 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            specs.append([name, array.dtype.str, list(array.shape), offset])
+            chunks.append(array.tobytes())
+            offset += array.nbytes
+        meta['_arrays'] = specs
+    meta_bytes = json.dumps(meta).encode()
+    payload = b''.join(chunks)
+    return _header.pack(message_type, len(meta_bytes), len(payload)) + meta_bytes + payload
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytearray:
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        n_bytes = sock.recv_into(view[received:], n - received)
+        if n_bytes == 0:
+            raise ConnectionError('ERROR: Connection closed by the peer.')
+        received += n_bytes
+    return buffer
+
+
+def recv_message(sock: socket.socket):
+    """Receives one message frame, returns (message type, metadata dict, dict of name -> array views)."""
+
+    message_type, meta_length, payload_length = _header.unpack(_recv_exact(sock, _header.size))
+    meta = json.loads(_recv_exact(sock, meta_length).decode()) if meta_length else {}
+    arrays = {}
+    if payload_length:
+        payload = _recv_exact(sock, payload_length)
+        for name, dtype, shape, offset in meta.pop('_arrays'):
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+    return message_type, meta, arrays
+
+
+class _RemoteWorker:
+    """Server side record of a registered worker."""
+
+    def __init__(self, worker_id: int, sock: socket.socket, name: str, slots: int):
+        self.worker_id = worker_id
+        self.sock = sock
+        self.name = name
+        self.slots = slots
+        self.assigned = set()  # episodes running on the worker
+        self.last_seen = time.monotonic()
+        self.weights_version = 0
+        self.send_lock = threading.Lock()
+
+    def send(self, frame: bytes):
+        with self.send_lock:
+            self.sock.sendall(frame)
+
+
+class RolloutServer:
+    """Learner side of the distributed rollouts, see module documentation."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, heartbeat_timeout: float = 30.0,
+                 max_attempts: int = 3):
+        """
+        :param host: interface to listen on, '0.0.0.0' for all
+        :param port: TCP port, 0 for any free port (see the address attribute after start())
+        :param heartbeat_timeout: seconds without any message after which a worker is considered dead, and its
+        episodes reassigned
+        :param max_attempts: times an episode is attempted when it fails on the workers, before it is reported as
+        failed
+        """
+        self.host = host
+        self.port = port
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.address = None
+        self.workers = {}  # worker id -> _RemoteWorker
+        self.pending = collections.deque()  # episodes waiting for a free slot
+        self.attempts = collections.Counter()  # episode -> failed attempts
+        self.version = 0  # weights version
+        self._weights_frame = None  # encoded once, sent to every worker
+        self._results = queue.Queue()
+        self._lock = threading.RLock()
+        self._sock = None
+        self._next_worker_id = 0
+        self._closed = threading.Event()
+
+    def start(self):
+        """Starts listening for workers, in background threads."""
+
+        self._sock = socket.create_server((self.host, self.port))
+        self.address = self._sock.getsockname()[:2]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        threading.Thread(target=self._monitor_loop, daemon=True).start()
+        print(f'\n*NOTE: Rollout server listening on [{self.address[0]}:{self.address[1]}]\n')
+        return self
+
+    def submit(self, episodes):
+        """Queues episodes (ids) to be run by the workers."""
+
+        with self._lock:
+            self.pending.extend(episodes)
+            self._dispatch()
+
+    def broadcast_weights(self, weights: dict):
+        """Sends new policy weights (dict of name -> array) to all workers, and to workers registering later."""
+
+        with self._lock:
+            self.version += 1
+            self._weights_frame = encode_message(WEIGHTS, {'version': self.version}, weights)
+            for worker in list(self.workers.values()):
+                self._send_weights(worker)
+
+    def get_episode(self, timeout: float = None) -> dict:
+        """
+        Returns the experience of the next finished episode, blocks until one is available.
+
+        :return: dict with 'episode', 'worker', 'version' (of the weights used), the worker's metadata and arrays, or
+        with 'episode' and 'error' if the episode failed max_attempts times
+        :raises queue.Empty: if timeout seconds pass without a finished episode
+        """
+        return self._results.get(timeout=timeout)
+
+    @property
+    def n_in_flight(self) -> int:
+        with self._lock:
+            return len(self.pending) + sum(len(worker.assigned) for worker in self.workers.values())
+
+    def close(self):
+        """Sends shutdown to all workers and stops the server."""
+
+        self._closed.set()
+        with self._lock:
+            for worker in list(self.workers.values()):
+                try:
+                    worker.send(encode_message(SHUTDOWN))
+                except OSError:
+                    pass
+                self._drop_worker(worker, None)
+        self._sock.close()
+
+    def _accept_loop(self):
+        while not self._closed.is_set():
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                return  # server closed
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._worker_loop, args=(sock,), daemon=True).start()
+
+    def _worker_loop(self, sock: socket.socket):
+        """Reader thread of one worker connection."""
+
+        worker = None
+        try:
+            message_type, meta, _ = recv_message(sock)
+            if message_type != REGISTER:
+                raise ConnectionError(f'ERROR: Expected worker registration, got message type [{message_type}].')
+            with self._lock:
+                worker = _RemoteWorker(self._next_worker_id, sock, meta.get('name', ''), int(meta.get('slots', 1)))
+                self._next_worker_id += 1
+                self.workers[worker.worker_id] = worker
+                worker.send(encode_message(WELCOME, {'worker': worker.worker_id}))
+                print(f'*NOTE: Worker [{worker.worker_id}] [{worker.name}] registered with [{worker.slots}] slots.')
+                self._dispatch()
+            while True:
+                message_type, meta, arrays = recv_message(sock)
+                worker.last_seen = time.monotonic()
+                if message_type == EPISODE:
+                    self._on_episode(worker, meta, arrays)
+                elif message_type == EPISODE_FAILED:
+                    self._on_episode_failed(worker, meta)
+        except (OSError, ConnectionError, ValueError) as e:
+            if worker is None:
+                sock.close()
+            elif not self._closed.is_set():
+                with self._lock:
+                    self._drop_worker(worker, e)
+
+    def _monitor_loop(self):
+        """Drops workers that missed their heartbeats."""
+
+        while not self._closed.wait(min(1.0, self.heartbeat_timeout / 4)):
+            now = time.monotonic()
+            with self._lock:
+                for worker in list(self.workers.values()):
+                    if now - worker.last_seen > self.heartbeat_timeout:
+                        self._drop_worker(worker, f'no heartbeat for [{now - worker.last_seen:.1f}]s')
+
+    def _on_episode(self, worker: _RemoteWorker, meta: dict, arrays: dict):
+        with self._lock:
+            if meta['episode'] not in worker.assigned:
+                return  # already reassigned
+            worker.assigned.discard(meta['episode'])
+            self._results.put(dict(meta, worker=worker.worker_id, **arrays))
+            self._dispatch()
+
+    def _on_episode_failed(self, worker: _RemoteWorker, meta: dict):
+        with self._lock:
+            episode = meta['episode']
+            if episode not in worker.assigned:
+                return
+            worker.assigned.discard(episode)
+            self.attempts[episode] += 1
+            if self.attempts[episode] < self.max_attempts:
+                self.pending.appendleft(episode)
+            else:
+                self._results.put({'episode': episode, 'worker': worker.worker_id, 'error': meta.get('error')})
+            self._dispatch()
+
+    def _drop_worker(self, worker: _RemoteWorker, reason):
+        """Removes a worker and puts its running episodes back in front of the queue (lock held)."""
+
+        if self.workers.pop(worker.worker_id, None) is None:
+            return
+        self.pending.extendleft(sorted(worker.assigned, reverse=True))
+        if reason is not None:
+            print(f'\n*NOTE: Worker [{worker.worker_id}] [{worker.name}] lost ({reason}), reassigning its '
+                  f'[{len(worker.assigned)}] episodes.\n')
+        worker.assigned.clear()
+        try:
+            worker.sock.close()
+        except OSError:
+            pass
+        self._dispatch()
+
+    def _send_weights(self, worker: _RemoteWorker):
+        if self._weights_frame is not None and worker.weights_version != self.version:
+            worker.send(self._weights_frame)
+            worker.weights_version = self.version
+
+    def _dispatch(self):
+        """Assigns pending episodes to the free slots of the workers (lock held)."""
+
+        for worker in list(self.workers.values()):
+            if worker.worker_id not in self.workers:
+                continue  # dropped meanwhile
+            try:
+                while self.pending and len(worker.assigned) < worker.slots:
+                    self._send_weights(worker)
+                    episode = self.pending.popleft()
+                    worker.assigned.add(episode)
+                    worker.send(encode_message(TASK, {'episode': episode, 'version': self.version}))
+            except OSError as e:
+                self._drop_worker(worker, e)
+
+
+class RolloutWorker:
+    """Worker node side of the distributed rollouts, runs the assigned episodes in a local process pool."""
+
+    def __init__(self, host: str, port: int, episode_function, slots: int = None, heartbeat_interval: float = 5.0,
+                 name: str = None, mp_context=None, maxtasksperchild: int = 3):
+        """
+        :param host: host of the RolloutServer
+        :param port: port of the RolloutServer
+        :param episode_function: module-level function(episode, weights, version) -> (dict of name -> array, dict of
+        JSON-serializable metadata), runs one episode with the given weights
+        :param slots: number of episodes run in parallel on this node, defaults to the CPU count
+        :param heartbeat_interval: seconds between heartbeats, well below the server's heartbeat_timeout
+        :param name: name of the worker reported to the server, defaults to hostname:pid
+        :param mp_context: multiprocessing context of the pool, e.g. eplus_drl.workers.get_worker_context()
+        :param maxtasksperchild: episodes per process before it is replaced (E+ does not free all memory)
+        """
+        self.host = host
+        self.port = port
+        self.episode_function = episode_function
+        self.slots = slots if slots is not None else os.cpu_count() or 1
+        self.heartbeat_interval = heartbeat_interval
+        self.name = name if name is not None else f'{socket.gethostname()}:{os.getpid()}'
+        self.mp_context = mp_context if mp_context is not None else multiprocessing
+        self.maxtasksperchild = maxtasksperchild
+        self.worker_id = None
+        self.weights = None
+        self.version = 0
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _send(self, message_type: int, meta: dict = None, arrays: dict = None):
+        frame = encode_message(message_type, meta, arrays)
+        with self._send_lock:
+            self._sock.sendall(frame)
+
+    def _heartbeat_loop(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            try:
+                self._send(HEARTBEAT)
+            except OSError:
+                return
+
+    def _on_result(self, episode: int, version: int, result):
+        arrays, meta = result
+        try:
+            self._send(EPISODE, dict(meta or {}, episode=episode, version=version), arrays)
+        except OSError:
+            pass  # connection lost, the server reassigns the episode
+
+    def _on_error(self, episode: int, error):
+        try:
+            self._send(EPISODE_FAILED, {'episode': episode, 'error': repr(error)})
+        except OSError:
+            pass
+
+    def run(self):
+        """Connects to the server and runs episodes until the server shuts down or the connection is lost."""
+
+        self._sock = socket.create_connection((self.host, self.port))
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._send(REGISTER, {'name': self.name, 'slots': self.slots})
+        message_type, meta, _ = recv_message(self._sock)
+        self.worker_id = meta['worker']
+        threading.Thread(target=self._heartbeat_loop, daemon=True).start()
+
+        try:
+            with self.mp_context.Pool(processes=self.slots, maxtasksperchild=self.maxtasksperchild) as pool:
+                while True:
+                    try:
+                        message_type, meta, arrays = recv_message(self._sock)
+                    except (OSError, ConnectionError):
+                        break
+                    if message_type == WEIGHTS:
+                        self.weights, self.version = arrays, meta['version']
+                    elif message_type == TASK:
+                        episode, version = meta['episode'], self.version
+                        pool.apply_async(self.episode_function, args=(episode, self.weights, version),
+                                         callback=lambda result, e=episode, v=version: self._on_result(e, v, result),
+                                         error_callback=lambda error, e=episode: self._on_error(e, error))
+                    elif message_type == SHUTDOWN:
+                        break
+                pool.terminate()
+        finally:
+            self._stopped.set()
+            self._sock.close()
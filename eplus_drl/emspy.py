@@ -8,14 +8,49 @@ OpenStudio SDK documentation http://nrel.github.io/OpenStudio-user-documentation
 Unmet Hours help forum https://unmethours.com/questions/
 """
 
+import os
 import sys
+import time
 import operator
 import datetime
+import threading
 
-import pandas as pd
 import numpy as np
 from tempfile import mkdtemp
 
+_energyplus_api = None  # EnergyPlusAPI, loaded once per process and shared by all instances, see _load_energyplus_api()
+_energyplus_path = None  # E+ installation the API was loaded from
+_energyplus_api_lock = threading.Lock()  # BcaEnv instances may be created on several threads, see eplus_drl.threaded
+# simulations running in this process (several states can run on threads, see eplus_drl.threaded), E+ callbacks are
+# only cleared once the last one finished, clear_callbacks() clears the callbacks of all states
+_running_simulations = 0
+_running_simulations_lock = threading.Lock()
+
+
+def _load_energyplus_api(ep_path: str):
+    """
+    Imports pyenergyplus from the E+ installation & returns the process-wide EnergyPlusAPI instance, created once.
+
+    Worker processes forked from a process that already imported pyenergyplus (see eplus_drl.workers) pay no import
+    cost at all. Otherwise, the E+ path is only added to sys.path the first time.
+
+    A process can only load one E+ installation, requesting another one raises an error.
+    """
+    global _energyplus_api, _energyplus_path
+    with _energyplus_api_lock:
+        if _energyplus_api is None:
+            if 'pyenergyplus.api' not in sys.modules and ep_path not in sys.path:
+                sys.path.insert(0, ep_path)  # set path to E+
+            import pyenergyplus
+            from pyenergyplus.api import EnergyPlusAPI
+            _energyplus_api = EnergyPlusAPI()
+            _energyplus_path = os.path.realpath(os.path.dirname(os.path.dirname(pyenergyplus.__file__)))
+        if os.path.realpath(ep_path) != _energyplus_path:
+            raise ValueError(f'ERROR: This process already loaded the EnergyPlus API from [{_energyplus_path}], it '
+                             f'cannot use the installation at [{ep_path}] too. Use the same ep_path for all '
+                             f'simulations of a process.')
+        return _energyplus_api
+
 
 
 class EmsPy:
@@ -92,13 +127,8 @@ class EmsPy:
         """
 
         self.ep_path = ep_path
-        sys.path.insert(0, ep_path)  # set path to E+
-        import pyenergyplus.api
-        from pyenergyplus.api import EnergyPlusAPI
-        
-
-        self.pyapi = pyenergyplus.api
-        self.api = EnergyPlusAPI()  # instantiation of Python EMS API
+        self.api = _load_energyplus_api(ep_path)  # Python EMS API, shared by all instances of the process
+        self.pyapi = sys.modules['pyenergyplus.api']
 
         # instance important
         self.state = self._new_state()
@@ -171,8 +201,20 @@ class EmsPy:
         self.rewards_cnt = None
 
         # simulation data
-        self._actuators_used_set = set()  # keep track of what EMS actuators are actually actuated
+        self._actuators_used_set = set()  # keep track of what EMS actuators are actually actuated, after the run
+        # actuator plan, handles are bound once at runtime, see _set_ems_handles()
+        self._actuator_names = list(tc_actuator) if tc_actuator else []  # ToC order
+        self._actuator_index = {name: i for i, name in enumerate(self._actuator_names)}
+        self._actuator_handles = []
+        self._actuation_orders = {}  # calling point -> ToC indexes of the setpoint vector returned by actuation fxn
+        # setpoint history, one column per actuator (ToC order) with its own count, exposed as data_setpoint_ views
+        self._setpoint_history = np.full((24 * 7 * timesteps, len(self._actuator_names)), np.nan)  # grows x2
+        self._setpoint_counts = np.zeros(len(self._actuator_names), dtype=int)
         self.simulation_success = 1  # 1 fail, 0 success
+        # CPU time of the simulation thread during run_simulation(), and its part spent in the Python callbacks
+        self.simulation_cpu_time = 0.0
+        self.callback_cpu_time = 0.0
+        self.simulation_wall_time = 0.0
 
         #print('\n*NOTE: Simulation emspy class and instance created!')
 
@@ -185,6 +227,15 @@ class EmsPy:
         return di
 
 
+    def __getattr__(self, name: str):
+        """Returns data_setpoint_ attributes, views of the setpoints of an actuator tracked so far."""
+
+        actuator_index = self.__dict__.get('_actuator_index', {})
+        if name.startswith('data_setpoint_') and name[len('data_setpoint_'):] in actuator_index:
+            i = actuator_index[name[len('data_setpoint_'):]]
+            return self._setpoint_history[:self._setpoint_counts[i], i]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
     def _init_ems_handles_and_data(self):
         """
         Creates and initializes the necessary instance attributes for all EMS sensors/actuators given by the user.
@@ -193,7 +244,8 @@ class EmsPy:
         internal variable, meter, and actuator as outlined by the user in their respective EMS Table of Content(s).
         All of these attributes need to be initialized for later use, using the 'variable name' of the object in the
         first element of each ToC element. 'handle_' and 'data_' will be prefixed to the given name to further specify
-        the created attribute. 'setpoint_' will prefix actuators to track their user input setpoints.
+        the created attribute. 'setpoint_' will prefix actuators to track their user input setpoints, their 'data_'
+        attributes are views of the setpoint history, see __getattr__().
 
         This will also update the EMS dictionary which tracks which EMS variable types are in use and how many for each
         category. This dictionary attribute is used elsewhere for quick data fetching.
@@ -211,7 +263,6 @@ class EmsPy:
                     setattr(self, 'data_' + ems_type + '_' + ems_name, [])  # init as empty list
                     if ems_type == 'actuator':  # handle associated actuator setpoints
                         setpoint_name = 'setpoint_' + ems_name
-                        setattr(self, 'data_' + setpoint_name, [])
                         self.ems_type_dict[setpoint_name] = 'setpoint'
                         self.ems_names_master_list.append(setpoint_name)
                     self.ems_type_dict[ems_name] = ems_type
@@ -271,7 +322,7 @@ class EmsPy:
             try:  # multi obj rewards
                 self.rewards_cnt = len(reward)
                 self.rewards_multi = True
-                self.rewards = [[] for _ in range(self.rewards_cnt)]
+                self.rewards = []  # one row [r1, r2, ...] per timestep
             except TypeError:  # catch single reward, no length
                 self.rewards_cnt = 1
                 self.rewards = []
@@ -287,6 +338,7 @@ class EmsPy:
             if ems_tc is not None:
                 for name, handle_inputs in ems_tc.items():
                     setattr(self, 'handle_' + ems_type + '_' + name, self._get_handle(ems_type, handle_inputs))
+        self._actuator_handles = [getattr(self, 'handle_actuator_' + name) for name in self._actuator_names]
         print('\n*NOTE: Got all EMS handles.\n')
 
     def _get_handle(self, ems_type: str, ems_obj_details):
@@ -417,24 +469,17 @@ class EmsPy:
     def _update_reward(self, reward):
         """ Updates attributes related to the reward. Works for single-obj(scalar) and multi-obj(vector) reward fxns."""
 
-        # handle single vs multi reward together
+        # type checked once, at the first reward, not at every timestep
+        if not self.rewards:
+            for reward_i in (reward if self.rewards_multi else [reward]):
+                if not np.isscalar(reward_i):
+                    raise TypeError(f'ERROR: Reward returned from the observation function, [{reward_i}] must be of'
+                                    f' type float or int.')
         if self.rewards_multi:
-            rewards = []  # init for multi
-        else:
-            reward = [reward]  # need to make single val iterable
-
-        for reward_i in reward:
-            if not np.isscalar(reward_i):
-                raise TypeError(f'ERROR: Reward returned from the observation function, [{reward_i}] must be of'
-                                f' type float or int.')
-            else:
-                if self.rewards_multi:
-                    rewards.append(reward_i)  # [[r11, r12, r13], [r21, r22, r23], ...]
-                else:
-                    rewards = reward_i  # single reward
+            reward = list(reward)  # [[r11, r12, r13], [r21, r22, r23], ...]
         # reward data update
-        self.rewards.append(rewards)
-        self.reward_current = rewards
+        self.rewards.append(reward)
+        self.reward_current = reward
 
     def _get_weather(self, weather_metrics: list, when: str, hour: int, zone_ts: int) -> list:
         """
@@ -482,40 +527,68 @@ class EmsPy:
         else:
             return weather_data
 
-    def _actuate(self, actuator_handle: str, actuator_val):
-        """Sets value of a specific actuator in running simulation, or relinquishes control back to EnergyPlus."""
-
-        # use None to relinquish control
-        # TODO should I handle out-of-range actuator values??? (can this be managed with auto internal var lookup?)
-        if actuator_val is None:
-            self.api.exchange.reset_actuator(self.state, actuator_handle)  # return actuator control to EnergyPlus
-        else:
-            self.api.exchange.set_actuator_value(self.state, actuator_handle, actuator_val)
-
-    def _actuate_from_list(self, calling_point: str, actuator_setpoint_dict: dict):
+    def _actuate_from_list(self, calling_point: str, actuator_setpoints):
         """
-        This iterates through list of actuator name and value setpoint pairs to be set in simulation.
+        This sets the actuator setpoints returned by an actuation function in the simulation and tracks them.
 
-        CAUTION: Actuation functions written by user must return an actuator_name(key)-value pair dictionary
+        CAUTION: Actuation functions written by user must return either an actuator_name(key)-value pair dictionary,
+        or a vector (list, NumPy array) of setpoints in the actuation order declared for the calling point (ToC order by
+        default). The vector form skips all per-actuator name lookups and is preferred for many actuators.
 
-        :param calling_point: only used for error output message to user
-        :param actuator_setpoint_dict: dict of actuator name keys (str) & associated setpoint val. A setpoint of None
-        returns control back to EnergyPlus from EMS
+        :param calling_point: the calling point of the actuation function, selects the declared actuation order
+        :param actuator_setpoints: dict of actuator name keys (str) & associated setpoint val, or vector of setpoints.
+        A setpoint of None (dict) or NaN (vector) returns control back to EnergyPlus from EMS
         """
-        if actuator_setpoint_dict is not None:  # in case some 'actuation functions' does not actually act
-            for actuator_name, actuator_setpoint in actuator_setpoint_dict.items():
-                if actuator_name not in self.tc_actuator:  # TODO only do this once, @ the proper place and point
+        if actuator_setpoints is None:  # in case some 'actuation functions' does not actually act
+            print(f'\n*NOTE: No actuators/values defined for actuation function at calling point [{calling_point}],'
+                  f' timestep [{self.timestep_zone_num_current}]\n')
+            return
+
+        state = self.state
+        set_actuator_value = self.api.exchange.set_actuator_value
+        reset_actuator = self.api.exchange.reset_actuator
+        handles = self._actuator_handles
+
+        if isinstance(actuator_setpoints, dict):
+            order = []
+            setpoints = []
+            for actuator_name, actuator_setpoint in actuator_setpoints.items():
+                try:
+                    i = self._actuator_index[actuator_name]
+                except KeyError:
                     raise Exception(f'ERROR: Either this actuator [{actuator_name}] is not tracked, or misspelled.'
                                     f' Check your Actuator ToC.')
-                # actuate and update data tracking
-                actuator_handle = getattr(self, 'handle_actuator_' + actuator_name)
-                self._actuate(actuator_handle, actuator_setpoint)
-                self._actuators_used_set.add(actuator_name)  # to keep track of what actuators from TC are actually used
-                # update SETPOINT value of actuators
-                getattr(self, 'data_setpoint_' + actuator_name).append(actuator_setpoint)
+                if actuator_setpoint is None:
+                    reset_actuator(state, handles[i])  # return actuator control to EnergyPlus
+                    actuator_setpoint = np.nan
+                else:
+                    set_actuator_value(state, handles[i], actuator_setpoint)
+                order.append(i)
+                setpoints.append(actuator_setpoint)
+            if not order:
+                return
         else:
-            print(f'\n*NOTE: No actuators/values defined for actuation function at calling point [{calling_point}],'
-                  f' timestep [{self.timestep_zone_num_current}]\n')
+            order = self._actuation_orders[calling_point]
+            setpoints = np.asarray(actuator_setpoints, dtype=float).ravel()
+            if setpoints.shape[0] != len(order):
+                raise ValueError(f'ERROR: The actuation function at calling point [{calling_point}] returned '
+                                 f'[{setpoints.shape[0]}] setpoints, but its actuation order has [{len(order)}] '
+                                 f'actuators.')
+            for i, actuator_setpoint in zip(order.tolist(), setpoints.tolist()):
+                if actuator_setpoint != actuator_setpoint:  # NaN
+                    reset_actuator(state, handles[i])
+                else:
+                    set_actuator_value(state, handles[i], actuator_setpoint)
+            if not len(order):
+                return
+
+        # track setpoints, one write to the history for all actuators set, each in the next row of its column
+        rows = self._setpoint_counts[order]
+        if rows.max() == self._setpoint_history.shape[0]:  # grow preallocated history if full
+            self._setpoint_history = np.concatenate((self._setpoint_history,
+                                                     np.full_like(self._setpoint_history, np.nan)))
+        self._setpoint_history[rows, order] = setpoints
+        self._setpoint_counts[order] = rows + 1
 
     def _enclosing_callback(self, calling_point: str, observation_fxn, actuation_fxn,
                             update_state: bool = False,
@@ -548,6 +621,14 @@ class EmsPy:
 
             :param state_arg: NOT USED by this class - passed to and used internally by EnergyPlus simulation
             """
+            start_cpu_time = time.thread_time()
+            try:
+                _callback_body(state_arg)
+            finally:
+                self.callback_cpu_time += time.thread_time() - start_cpu_time
+
+        def _callback_body(state_arg):
+            """Body of _callback_function(), timed by it."""
 
             # CALLBACK INIT
             # get EMS handles ONCE
@@ -642,7 +723,22 @@ class EmsPy:
             else:
                 # unpack observation & actuation fxns and callback fxn arguments
                 observation_fxn, actuation_fxn, update_state, update_observation_freq, update_act_freq, \
-                observation_fxn_kwargs, actuation_fxn_kwargs = self.calling_point_callback_dict[calling_key]
+                observation_fxn_kwargs, actuation_fxn_kwargs, actuation_order = \
+                    self.calling_point_callback_dict[calling_key]
+
+                # verify actuator names ONCE, vector setpoints are then written by index with no name lookups
+                if actuation_order is None:
+                    actuation_order = self._actuator_names
+                for actuator_name in actuation_order:
+                    if actuator_name not in self._actuator_index:
+                        raise Exception(f'ERROR: Either this actuator [{actuator_name}] in the actuation order of '
+                                        f'calling point [{calling_key}] is not tracked, or misspelled. Check your '
+                                        f'Actuator ToC.')
+                if len(set(actuation_order)) != len(actuation_order):
+                    raise ValueError(f'ERROR: The actuation order of calling point [{calling_key}] lists an actuator '
+                                     f'more than once.')
+                self._actuation_orders[calling_key] = np.array([self._actuator_index[name]
+                                                                for name in actuation_order], dtype=int)
 
                 # verify only one EMS update per timestep is advised
                 if update_state:
@@ -678,6 +774,8 @@ class EmsPy:
         Creates default dataframes for each EMS data list, for each EMS category (and rewards if included in sim).
         """
 
+        import pandas as pd  # imported lazily, only needed once the simulation is done
+
         if not self.ems_num_dict:
             return  # no ems dicts created, very unlikely
         for ems_type in self.ems_num_dict:
@@ -702,9 +800,6 @@ class EmsPy:
                     col_names.append('reward' + str(n + 1))
             self.df_reward = pd.DataFrame(self.rewards, columns=col_names)
 
-            # TODO figure out why these are here at the start
-            # self.df_reward = self.df_reward.dropna()  # drop NA vals
-
             len_rewards = len(self.rewards)
             len_datetimes = len(self.t_datetimes)
             if len_rewards != len_datetimes:  # IF reward returned less frequently than state updates
@@ -783,11 +878,11 @@ class EmsPy:
                     else:
                         # normal ems types
                         ems_type = self._get_ems_type(ems_name)
-                        if ems_type == 'setpoint':  # actuator setpoints
-                            data_list_name = 'data_' + ems_name  # setpoint is redundant, user must input themselves
+                        if ems_type == 'setpoint':  # actuator setpoints, most recent one, NaN if not set yet
+                            setpoints = getattr(self, 'data_' + ems_name)
+                            data_i = setpoints[-1] if setpoints.size else np.nan
                         else:  # all other
-                            data_list_name = 'data_' + ems_type + '_' + ems_name
-                        data_i = getattr(self, data_list_name)[-1]
+                            data_i = getattr(self, 'data_' + ems_type + '_' + ems_name)[-1]
 
                     # append to dict list
                     self.df_custom_dict[df_name][0][ems_name].append(data_i)
@@ -795,6 +890,8 @@ class EmsPy:
     def _create_custom_dataframes(self):
         """Creates custom dataframes for specifically tracked ems data list, for each ems category."""
 
+        import pandas as pd  # imported lazily, only needed once the simulation is done
+
         if not self.df_custom_dict:
             print('*NOTE: No custom dataframes created.')
             return  # no ems dicts created
@@ -817,6 +914,8 @@ class EmsPy:
 
         # (1) remove data of unused actuators, if applicable
         if self.tc_actuator:
+            self._actuators_used_set = {actuator_name for actuator_name, count
+                                        in zip(self._actuator_names, self._setpoint_counts) if count}
             unused_actuators = []
             for actuator_name in self.tc_actuator:
                 if actuator_name not in self._actuators_used_set:
@@ -873,24 +972,37 @@ class EmsPy:
         # check valid input by user
         self._user_input_check()
 
-        # create callback function(s) and link with calling point(s), if applicable
-        if self.calling_point_callback_dict:
-            self._init_calling_points_and_callback_functions()
-
-        # RUN SIMULATION
-        
-        
-        print('\n* * * Running E+ Simulation * * *\n')
-        self.simulation_success = self.api.runtime.run_energyplus(self.state, ['-w', weather_file, '-d', output_dir,
-                                                                               self.idf_file])  # cmd line args
-        
+        global _running_simulations
+        self.simulation_success = 1
+        with _running_simulations_lock:
+            _running_simulations += 1
+        try:
+            # create callback function(s) and link with calling point(s), if applicable
+            if self.calling_point_callback_dict:
+                self._init_calling_points_and_callback_functions()
+
+            # RUN SIMULATION
+            print('\n* * * Running E+ Simulation * * *\n')
+            start_cpu_time, start_time = time.thread_time(), time.perf_counter()
+            try:
+                self.simulation_success = self.api.runtime.run_energyplus(self.state, ['-w', weather_file, '-d',
+                                                                                       output_dir, self.idf_file])
+            finally:
+                self.simulation_cpu_time += time.thread_time() - start_cpu_time
+                self.simulation_wall_time += time.perf_counter() - start_time
+        finally:
+            with _running_simulations_lock:
+                _running_simulations -= 1
+                if _running_simulations == 0:
+                    # cleanup after the last run, under the lock so that no other state registers callbacks meanwhile
+                    self.api.runtime.clear_callbacks()
+
         if self.simulation_success != 0:
             print('\n* * * Simulation FAILED * * *\n')
             
         # simulation successful
         else:
             print('\n* * * Simulation Done * * *')
-            self.api.runtime.clear_callbacks() #Cleanup after succesfull run
             self._post_process_data()
             # create default and custom ems pandas df's after simulation complete
             if self.default_dfs_tracked:
@@ -0,0 +1,127 @@
+"""
+Randomized short-window episodes, by rewriting the RunPeriod of the .idf model per episode.
+
+Simulating the whole weather file period per episode makes every policy update wait for weeks of simulated time. An
+EpisodeSampler instead draws a random window of a few days within the period of the weather file for each episode, and
+writes a variant of the model with its RunPeriod set to that window. Variants are cached by window, so each one is only
+written once per work directory.
+
+EnergyPlus repeats the first day of a RunPeriod until the building state converges (warmup), up to 25 days by default,
+which would dominate short episodes: the sampled models also cap the maximum number of warmup days of the Building
+object to the episode length (or max_warmup_days).
+"""
+
+import os
+import datetime
+
+import numpy as np
+
+from eplus_drl import idf
+
+
+def get_weather_period(weather_file_path: str, year: int = 2017) -> tuple:
+    """
+    Returns the (begin, end) dates of the data of an .epw weather file, from its first and last data rows.
+
+    :param year: calendar year used for the dates, the year column of .epw files is not continuous (typical years)
+    :return: tuple of datetime.date
+    """
+    with open(weather_file_path, 'r', errors='replace') as weather_file:
+        lines = [line for line in weather_file.read().splitlines() if line.strip()]
+    for i, line in enumerate(lines):
+        if line.upper().startswith('DATA PERIODS'):
+            first, last = lines[i + 1].split(','), lines[-1].split(',')
+            break
+    else:
+        raise ValueError(f'ERROR: The weather file [{weather_file_path}] has no DATA PERIODS header, is it an .epw '
+                         f'file?')
+    begin = datetime.date(year, int(first[1]), int(first[2]))
+    end = datetime.date(year, int(last[1]), int(last[2]))
+    if end < begin:
+        raise ValueError(f'ERROR: The weather file [{weather_file_path}] wraps over the end of the year, '
+                         f'[{begin:%m/%d}] to [{end:%m/%d}], this is not supported.')
+    return begin, end
+
+
+def set_warmup_days(idf_text: str, max_warmup_days: int) -> str:
+    """
+    Returns .idf text with the Maximum (and Minimum, if larger) Number of Warmup Days of the Building object capped.
+    """
+    buildings = idf.get_idf_objects(idf_text, 'Building')
+    if not buildings:
+        raise ValueError('ERROR: The .idf file has no Building object.')
+    building = buildings[0]
+    fields = {}
+    if len(building.spans) > 6 and int(float(building.get(6, 25))) > max_warmup_days:  # E+ default of 25 days
+        fields[6] = max_warmup_days
+    if len(building.spans) > 7 and int(float(building.get(7, 1))) > max_warmup_days:
+        fields[7] = max_warmup_days
+    if len(building.spans) <= 6:
+        print('*NOTE: The Building object has no Maximum Number of Warmup Days field, warmup days are not capped.')
+    return idf.set_idf_fields(idf_text, building, fields)
+
+
+class EpisodeSampler:
+    """
+    Draws a random window of episode_days consecutive days within the weather file period per episode, and returns the
+    .idf model variant simulating it, e.g.:
+
+        sampler = EpisodeSampler(idf_path, weather_path, episode_days=7, seed=0)
+        idf_path, begin, end = sampler.sample(episode)
+        sim = BcaEnv(ep_path, idf_path, ...)
+
+    The window of an episode only depends on (seed, episode), so that workers sampling different episodes in parallel
+    are reproducible and need no shared random state.
+    """
+
+    def __init__(self, idf_path: str, weather_file_path: str, episode_days: int = 7, seed: int = None,
+                 max_warmup_days: int = None, work_dir: str = None):
+        """
+        :param idf_path: the .idf model, its RunPeriod calendar (year, day of week of the start day) is kept
+        :param weather_file_path: the .epw weather file, windows are drawn within its data period
+        :param episode_days: number of days simulated per episode
+        :param seed: seed of the windows, leave as None for different windows every run
+        :param max_warmup_days: cap of the warmup days of the sampled models, defaults to episode_days
+        :param work_dir: directory of the rewritten models (the cache), defaults to 'episode_models' next to the .idf
+        model, shared by all workers
+        """
+        self.idf_path = idf_path
+        self.weather_file_path = weather_file_path
+        self.episode_days = episode_days
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().entropy % 2 ** 32)
+        self.max_warmup_days = max_warmup_days if max_warmup_days is not None else episode_days
+        self.work_dir = work_dir if work_dir is not None else \
+            os.path.join(os.path.dirname(os.path.abspath(idf_path)), 'episode_models')
+
+        self.idf_text = idf.read_idf(idf_path)
+        year = idf.get_run_period(self.idf_text)[0].year
+        self.weather_begin, self.weather_end = get_weather_period(weather_file_path, year)
+        self.n_windows = (self.weather_end - self.weather_begin).days + 2 - episode_days
+        if episode_days < 1 or self.n_windows < 1:
+            raise ValueError(f'ERROR: Episodes of [{episode_days}] days do not fit in the weather file period '
+                             f'[{self.weather_begin:%m/%d}] to [{self.weather_end:%m/%d}].')
+        self._cache = {}  # (begin, end) -> path of the rewritten model
+
+    def window(self, episode: int) -> tuple:
+        """Returns the (begin, end) dates (inclusive) of the window of an episode."""
+
+        rng = np.random.default_rng([self.seed, episode])
+        begin = self.weather_begin + datetime.timedelta(days=int(rng.integers(self.n_windows)))
+        return begin, begin + datetime.timedelta(days=self.episode_days - 1)
+
+    def model_path(self, begin: datetime.date, end: datetime.date) -> str:
+        """Returns the path of the model variant simulating begin to end, writing it if it is not cached yet."""
+
+        if (begin, end) in self._cache:
+            return self._cache[(begin, end)]
+        idf_text = set_warmup_days(idf.set_run_period(self.idf_text, begin, end), self.max_warmup_days)
+        idf_path = idf.write_idf_variant(idf_text, self.idf_path, self.work_dir,
+                                         f'{begin:%m%d}_{end:%m%d}_w{self.max_warmup_days}')
+        self._cache[(begin, end)] = idf_path
+        return idf_path
+
+    def sample(self, episode: int) -> tuple:
+        """Returns (idf_path, begin, end) of the model variant of an episode, see window()."""
+
+        begin, end = self.window(episode)
+        return self.model_path(begin, end), begin, end
@@ -0,0 +1,322 @@
+"""
+Compiler of simple controllers to native EnergyPlus EMS (Erl) programs.
+
+Rule-based baselines and small exported policies (linear, decision tree, lookup table) do not need Python at every
+timestep: expressed against the BcaEnv ToC names, they are compiled to EnergyManagementSystem:Sensor, :Actuator,
+:Program and :ProgramCallingManager objects injected into the .idf model, and run inside EnergyPlus at native speed.
+
+    controllers = [
+        LinearController('fan_mass_flow_act', {'zn0_temp': 0.4, 'oa_db': -0.05}, bias=-7.5, low=0, high=2.18),
+        LookupTableController('deck_temp_act', 'oa_db', breakpoints=[0, 10], values=[22, 20, 18]),
+    ]
+    sim.run_env_erl(controllers, weather_file_path)
+    sim.get_df()
+
+The ToC metrics and the actuated values are harvested from the outputs into the usual dataframes, see
+BcaEnv.run_env_erl() and eplus_drl.bulk. Erl names are the ToC names, they must not clash with EMS objects already in
+the model.
+"""
+
+import re
+
+from eplus_drl import idf
+from eplus_drl.bulk import weather_output_variables
+
+# EmsPy callback calling points -> EMS calling points
+ems_calling_points = {
+    'callback_end_zone_sizing': 'EndOfZoneSizing',
+    'callback_end_system_sizing': 'EndOfSystemSizing',
+    'callback_begin_new_environment': 'BeginNewEnvironment',
+    'callback_after_new_environment_warmup_complete': 'AfterNewEnvironmentWarmUpIsComplete',
+    'callback_begin_zone_timestep_before_set_current_weather': 'BeginZoneTimestepBeforeSetCurrentWeather',
+    'callback_begin_zone_timestep_before_init_heat_balance': 'BeginZoneTimestepBeforeInitHeatBalance',
+    'callback_begin_zone_timestep_after_init_heat_balance': 'BeginZoneTimestepAfterInitHeatBalance',
+    'callback_begin_system_timestep_before_predictor': 'BeginTimestepBeforePredictor',
+    'callback_after_predictor_before_hvac_managers': 'AfterPredictorBeforeHVACManagers',
+    'callback_after_predictor_after_hvac_managers': 'AfterPredictorAfterHVACManagers',
+    'callback_inside_system_iteration_loop': 'InsideHVACSystemIterationLoop',
+    'callback_end_system_timestep_before_hvac_reporting': 'EndOfSystemTimestepBeforeHVACReporting',
+    'callback_end_system_timestep_after_hvac_reporting': 'EndOfSystemTimestepAfterHVACReporting',
+    'callback_end_zone_timestep_before_zone_reporting': 'EndOfZoneTimestepBeforeZoneReporting',
+    'callback_end_zone_timestep_after_zone_reporting': 'EndOfZoneTimestepAfterZoneReporting',
+}
+
+# EmsPy timing and weather metrics available as Erl built-in variables
+erl_builtin_variables = {
+    't_years': 'Year',
+    't_months': 'Month',
+    't_days': 'DayOfMonth',
+    't_hours': 'Hour',
+    't_minutes': 'Minute',
+    't_current_times': 'CurrentTime',
+    't_holiday_index': 'Holiday',
+    'sun_is_up': 'SunIsUp',
+    'is_raining': 'IsRaining',
+}
+
+_operators = {'<': '<', '<=': '<=', '>': '>', '>=': '>=', '==': '==', '!=': '<>', '<>': '<>'}
+_erl_name = re.compile(r'^[A-Za-z][A-Za-z0-9_]*$')
+_max_if_depth = 5  # nested IF blocks allowed by Erl
+_max_elseif = 199  # ELSEIF blocks allowed by Erl in one IF block
+
+
+def _number(value) -> str:
+    """Erl numeric literal, Null releases the actuator back to EnergyPlus."""
+
+    if value is None:
+        return 'Null'
+    return f'{float(value):.10g}'
+
+
+class ErlController:
+    """A controller of one actuator, compiled to Erl program lines."""
+
+    def __init__(self, actuator: str):
+        """
+        :param actuator: ToC name of the actuator it controls
+        """
+        self.actuator = actuator
+
+    def metrics(self) -> list:
+        """ToC (or timing) metric names read by the controller."""
+        raise NotImplementedError
+
+    def lines(self, names: dict) -> list:
+        """
+        Erl program lines setting the actuator.
+
+        :param names: dict of metric name -> Erl variable name (sensor or built-in variable)
+        """
+        raise NotImplementedError
+
+
+class LinearController(ErlController):
+    """actuator = clip(bias + sum(weight * metric), low, high)."""
+
+    def __init__(self, actuator: str, weights: dict, bias: float = 0.0, low: float = None, high: float = None):
+        """
+        :param weights: dict of metric name -> weight
+        :param bias: constant term
+        :param low: lower bound of the actuated value, if any
+        :param high: upper bound of the actuated value, if any
+        """
+        super().__init__(actuator)
+        self.weights = dict(weights)
+        self.bias = bias
+        self.low = low
+        self.high = high
+
+    def metrics(self) -> list:
+        return list(self.weights)
+
+    def lines(self, names: dict) -> list:
+        # one term per line, Erl program lines are kept short
+        lines = [f'SET {self.actuator} = {_number(self.bias)}']
+        for metric, weight in self.weights.items():
+            sign = '-' if weight < 0 else '+'
+            lines.append(f'SET {self.actuator} = {self.actuator} {sign} {_number(abs(weight))} * {names[metric]}')
+        if self.low is not None:
+            lines.append(f'SET {self.actuator} = @Max {self.actuator} {_number(self.low)}')
+        if self.high is not None:
+            lines.append(f'SET {self.actuator} = @Min {self.actuator} {_number(self.high)}')
+        return lines
+
+
+class RuleController(ErlController):
+    """
+    Ordered rules, the value of the first rule whose conditions all hold is actuated:
+
+        RuleController('heating_setpoint_act', [
+            ([('t_hours', '>=', 7), ('t_hours', '<', 18)], 21.0),  # occupied
+            ([('oa_db', '<', -5)], 18.0),
+        ], default=16.0)
+
+    A value of None releases the actuator back to EnergyPlus (Erl Null) for that rule.
+    """
+
+    def __init__(self, actuator: str, rules: list, default=None):
+        """
+        :param rules: list of (conditions, value), conditions being a list of (metric, operator, threshold) with
+        operator one of <, <=, >, >=, ==, !=
+        :param default: value actuated when no rule holds
+        """
+        super().__init__(actuator)
+        for conditions, _ in rules:
+            for metric, operator, threshold in conditions:
+                if operator not in _operators:
+                    raise ValueError(f'ERROR: Invalid operator [{operator}] in the rule on [{metric}], must be one of '
+                                     f'{list(_operators)}.')
+        if len(rules) > _max_elseif + 1:
+            raise ValueError(f'ERROR: [{actuator}] has {len(rules)} rules, Erl allows at most {_max_elseif + 1}.')
+        self.rules = rules
+        self.default = default
+
+    def metrics(self) -> list:
+        return list(dict.fromkeys(metric for conditions, _ in self.rules for metric, _, _ in conditions))
+
+    def lines(self, names: dict) -> list:
+        lines = []
+        for i, (conditions, value) in enumerate(self.rules):
+            condition = ' && '.join(f'({names[metric]} {_operators[operator]} {_number(threshold)})'
+                                    for metric, operator, threshold in conditions) or '1 == 1'
+            lines.append(f'{"IF" if i == 0 else "ELSEIF"} {condition}')
+            lines.append(f'SET {self.actuator} = {_number(value)}')
+        if not lines:
+            return [f'SET {self.actuator} = {_number(self.default)}']
+        lines += ['ELSE', f'SET {self.actuator} = {_number(self.default)}', 'ENDIF']
+        return lines
+
+
+class DecisionTreeController(RuleController):
+    """
+    Decision tree, given as nested dicts {'metric': name, 'threshold': t, 'left': subtree, 'right': subtree} with
+    metric <= threshold going left, and leaf values (numbers) as leaves. Compiled to one rule per leaf.
+    """
+
+    def __init__(self, actuator: str, tree):
+        rules = []
+
+        def visit(node, conditions):
+            if isinstance(node, dict):
+                visit(node['left'], conditions + [(node['metric'], '<=', node['threshold'])])
+                visit(node['right'], conditions + [(node['metric'], '>', node['threshold'])])
+            else:
+                rules.append((conditions, node))
+
+        visit(tree, [])
+        super().__init__(actuator, rules[:-1], default=rules[-1][1])  # last leaf as the ELSE branch
+        self.tree = tree
+
+    @classmethod
+    def from_sklearn(cls, actuator: str, estimator, features: list, values: list = None):
+        """
+        Builds the controller from a fitted scikit-learn DecisionTreeRegressor/Classifier.
+
+        :param features: metric names of the estimator's input features, in order
+        :param values: actuated value of each class, for classifiers (default: the class labels)
+        """
+        tree = estimator.tree_
+
+        def node(i):
+            if tree.children_left[i] == tree.children_right[i]:  # leaf
+                leaf = tree.value[i]
+                if leaf.shape[-1] > 1:  # classifier, most likely class
+                    label = int(leaf[0].argmax())
+                    return values[label] if values is not None else float(estimator.classes_[label])
+                return float(leaf.ravel()[0])
+            return {'metric': features[tree.feature[i]], 'threshold': float(tree.threshold[i]),
+                    'left': node(tree.children_left[i]), 'right': node(tree.children_right[i])}
+
+        return cls(actuator, node(0))
+
+
+class LookupTableController(RuleController):
+    """
+    Piecewise-constant lookup table on one metric: values[i] is actuated for breakpoints[i-1] <= metric <
+    breakpoints[i], so there is one more value than breakpoints.
+    """
+
+    def __init__(self, actuator: str, metric: str, breakpoints: list, values: list):
+        if len(values) != len(breakpoints) + 1:
+            raise ValueError(f'ERROR: A lookup table with {len(breakpoints)} breakpoints needs '
+                             f'{len(breakpoints) + 1} values, got {len(values)}.')
+        if list(breakpoints) != sorted(breakpoints):
+            raise ValueError('ERROR: The breakpoints of a lookup table must be sorted.')
+        rules = [([(metric, '<', breakpoint)], value) for breakpoint, value in zip(breakpoints, values)]
+        super().__init__(actuator, rules, default=values[-1])
+
+
+def compile_erl(bca, controllers: list, calling_point: str = 'callback_begin_zone_timestep_before_init_heat_balance',
+                program_name: str = 'eplus_drl_controller', report_actuators: bool = True) -> list:
+    """
+    Compiles controllers to EMS objects, against the ToC of a BcaEnv.
+
+    :param bca: the BcaEnv whose ToC names the controllers use
+    :param controllers: list of ErlController, at most one per actuator
+    :param calling_point: EmsPy calling point (see EmsPy.available_calling_points) or EMS calling point name
+    :param program_name: name of the EMS program
+    :param report_actuators: also report every actuated value as EMS output variable '<actuator> Erl Value',
+    harvested by BcaEnv.run_env_erl()
+    :return: list of (object_type, [values]), see idf.append_idf_objects()
+    """
+    actuators = [controller.actuator for controller in controllers]
+    if len(set(actuators)) != len(actuators):
+        raise ValueError(f'ERROR: Each actuator can only be controlled by one controller, got {actuators}.')
+    ems_calling_point = ems_calling_points.get(calling_point, calling_point)
+    if ems_calling_point not in ems_calling_points.values():
+        raise ValueError(f'ERROR: Invalid calling point [{calling_point}], must be one of '
+                         f'{list(ems_calling_points)}.')
+
+    objects = []
+    names = {}
+    for metric in dict.fromkeys(metric for controller in controllers for metric in controller.metrics()):
+        ems_type = bca.ems_type_dict.get(metric)
+        weather_metric = bca.tc_weather[metric] if ems_type == 'weather' else None
+        if metric in erl_builtin_variables:
+            names[metric] = erl_builtin_variables[metric]
+        elif weather_metric in erl_builtin_variables:
+            names[metric] = erl_builtin_variables[weather_metric]
+        elif weather_metric in weather_output_variables:
+            objects.append(('EnergyManagementSystem:Sensor',
+                            [metric, 'Environment', weather_output_variables[weather_metric][0]]))
+            names[metric] = metric
+        elif ems_type == 'var':
+            name, key = bca.tc_var[metric]
+            objects.append(('EnergyManagementSystem:Sensor', [metric, key, name]))
+            names[metric] = metric
+        elif ems_type == 'meter':
+            objects.append(('EnergyManagementSystem:Sensor', [metric, '', bca.tc_meter[metric]]))
+            names[metric] = metric
+        elif ems_type == 'intvar':
+            name, key = bca.tc_intvar[metric]
+            objects.append(('EnergyManagementSystem:InternalVariable', [metric, key, name]))
+            names[metric] = metric
+        else:
+            raise ValueError(f'ERROR: [{metric}] is not a ToC variable, meter, internal variable or weather metric, '
+                             f'nor one of the timing metrics {list(erl_builtin_variables)[:7]}, it can not be read '
+                             f'by Erl.')
+        if not _erl_name.match(names[metric]):
+            raise ValueError(f'ERROR: [{metric}] is not a valid Erl name (letters, digits and underscores).')
+
+    lines = []
+    for controller in controllers:
+        if controller.actuator not in bca.tc_actuator:
+            raise ValueError(f'ERROR: [{controller.actuator}] is not an actuator of the ToC.')
+        if not _erl_name.match(controller.actuator):
+            raise ValueError(f'ERROR: [{controller.actuator}] is not a valid Erl name (letters, digits and '
+                             f'underscores).')
+        component_type, control_type, actuator_key = bca.tc_actuator[controller.actuator]
+        objects.append(('EnergyManagementSystem:Actuator',
+                        [controller.actuator, actuator_key, component_type, control_type]))
+        lines += controller.lines(names)
+        if report_actuators:
+            # actuators can not be reported directly, mirrored into a global variable
+            lines.append(f'SET {controller.actuator}_value = {controller.actuator}')
+            objects.append(('EnergyManagementSystem:GlobalVariable', [f'{controller.actuator}_value']))
+            objects.append(('EnergyManagementSystem:OutputVariable',
+                            [f'{controller.actuator} Erl Value', f'{controller.actuator}_value', 'Averaged',
+                             'ZoneTimestep', program_name, '']))
+    _check_if_depth(lines)
+
+    objects.append(('EnergyManagementSystem:Program', [program_name] + lines))
+    objects.append(('EnergyManagementSystem:ProgramCallingManager',
+                    [f'{program_name}_manager', ems_calling_point, program_name]))
+    return objects
+
+
+def _check_if_depth(lines: list):
+    depth = 0
+    for line in lines:
+        keyword = line.split(' ', 1)[0]
+        if keyword == 'IF':
+            depth += 1
+            if depth > _max_if_depth:
+                raise ValueError(f'ERROR: Erl allows at most {_max_if_depth} nested IF blocks.')
+        elif keyword == 'ENDIF':
+            depth -= 1
+
+
+def inject_erl(idf_text: str, bca, controllers: list, **kwargs) -> str:
+    """Returns .idf text with the compiled controllers appended, see compile_erl() for the arguments."""
+
+    return idf.append_idf_objects(idf_text, compile_erl(bca, controllers, **kwargs))
@@ -0,0 +1,239 @@
+"""
+Parallel evaluation of policies x weather files x building models, with KPIs aggregated into one results table.
+
+Every cell of the cartesian product is one full simulation, run in its own process of a pool with its own BcaEnv. KPIs
+(energy use, mean comfort, comfort violation hours, setpoint tracking error, ...) are computed vectorized over the
+tracked data arrays at the end of each simulation, and each finished cell is appended as one row to a CSV results
+table. Cells already in the results table are skipped, so an interrupted or extended evaluation is simply rerun.
+
+    def make_env(policy_path, idf_path):  # module-level, sent to the pool processes
+        sim = BcaEnv(ep_path, idf_path, 6, tc_vars, tc_intvars, tc_meters, tc_actuators, tc_weather)
+        agent = FrozenPolicyAgent(sim, policy_path)
+        sim.set_calling_point_and_callback_function(...)
+        return sim
+
+    matrix = EvaluationMatrix(make_env, policies=['Models/a.pth', 'Models/b.pth'], weathers=['DNK_Dec.epw'],
+                              idfs=['model.idf'], kpis=[Energy('fan_energy_kwh', 'fan_power'), Mean('ppd', 'ppd')],
+                              results_path='evaluation.csv')
+    results = matrix.run()  # pandas dataframe, one row per cell
+"""
+
+import os
+import csv
+import time
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from eplus_drl.rundirs import run_directories
+
+
+def _tracked_array(bca, metric: str) -> np.ndarray:
+    """Returns all tracked values of an EMS/timing metric of a BcaEnv as float array."""
+
+    ems_type = bca.ems_type_dict[metric]
+    data = getattr(bca, metric) if ems_type == 'time' else getattr(bca, 'data_' + ems_type + '_' + metric)
+    return np.asarray(data, dtype=float)
+
+
+class Kpi:
+    """A key performance indicator, one number computed from the tracked data of a finished simulation."""
+
+    def __init__(self, name: str, metric: str):
+        """
+        :param name: column name of the KPI in the results table
+        :param metric: EMS ToC metric the KPI is computed from
+        """
+        self.name = name
+        self.metric = metric
+
+    def __call__(self, bca) -> float:
+        return float(self.compute(_tracked_array(bca, self.metric), bca.timestep_period / 60, bca))
+
+    def compute(self, x: np.ndarray, timestep_hours: float, bca) -> float:
+        raise NotImplementedError
+
+
+class Energy(Kpi):
+    """Energy use in kWh from a power metric in W, integrated over the timesteps."""
+
+    def compute(self, x, timestep_hours, bca):
+        return x.sum() * timestep_hours / 1000
+
+
+class Mean(Kpi):
+    """Mean of a metric over the simulation, e.g. mean PPD."""
+
+    def compute(self, x, timestep_hours, bca):
+        return x.mean() if x.size else np.nan
+
+
+class ViolationHours(Kpi):
+    """Number of hours a metric is outside of [low, high], e.g. comfort violation hours of a zone temperature."""
+
+    def __init__(self, name: str, metric: str, low: float, high: float):
+        super().__init__(name, metric)
+        self.low = low
+        self.high = high
+
+    def compute(self, x, timestep_hours, bca):
+        return np.count_nonzero((x < self.low) | (x > self.high)) * timestep_hours
+
+
+class TrackingError(Kpi):
+    """Mean absolute error between a metric and its setpoint, a constant or another metric."""
+
+    def __init__(self, name: str, metric: str, setpoint):
+        super().__init__(name, metric)
+        self.setpoint = setpoint
+
+    def compute(self, x, timestep_hours, bca):
+        setpoint = _tracked_array(bca, self.setpoint) if isinstance(self.setpoint, str) else self.setpoint
+        return np.abs(x - setpoint).mean() if x.size else np.nan
+
+
+class Return(Kpi):
+    """Sum of the rewards of a RewardSpec (eplus_drl.reward) over the simulation, e.g. to select checkpoints on."""
+
+    def __init__(self, name: str, reward_spec, objective: int = 0):
+        super().__init__(name, None)
+        self.reward_spec = reward_spec
+        self.objective = objective
+
+    def __call__(self, bca) -> float:
+        return float(self.reward_spec.compile(bca).evaluate()[:, self.objective].sum())
+
+
+def _named_paths(paths) -> dict:
+    """Accepts a dict of name -> path or a list of paths (named by file name without extension)."""
+
+    if isinstance(paths, dict):
+        return dict(paths)
+    return {os.path.splitext(os.path.basename(path))[0]: path for path in paths}
+
+
+def _run_cell(env_factory, kpis: list, cell: tuple, policy_path: str, idf_path: str, weather_file_path: str,
+              catalog=None, experiment_id: int = None) -> dict:
+    """Process-pool task: simulates one cell and returns its row of the results table (or its error)."""
+
+    start_time = time.time()
+    row = {'policy': cell[0], 'weather': cell[1], 'idf': cell[2]}
+    try:
+        env = env_factory(policy_path, idf_path)
+        with run_directories().run_dir('evaluation') as run_dir:
+            if env.run_env(weather_file_path, os.path.join(run_dir, 'out')) != 0:
+                raise RuntimeError(f'ERROR: Simulation failed, see the error file kept in '
+                                   f'[{run_directories().keep_dir}].')
+        for kpi in kpis:
+            row[kpi.name] = kpi(env)
+        row['n_timesteps'] = len(env.t_datetimes)
+        row['wall_time'] = time.time() - start_time
+        if catalog is not None:
+            catalog.register_run(experiment_id, env, weather_file_path, kpis={kpi.name: row[kpi.name] for kpi in kpis},
+                                 wall_time=row['wall_time'], kind='evaluation', artifacts={'policy': policy_path})
+    except Exception as e:
+        return {'cell': cell, 'error': repr(e)}
+    return row
+
+
+def _star_run_cell(args):
+    return _run_cell(*args)
+
+
+class EvaluationMatrix:
+    """Evaluates every combination of policy, weather file and building model in parallel, see module documentation."""
+
+    cell_columns = ['policy', 'weather', 'idf']
+
+    def __init__(self, env_factory, policies, weathers, idfs, kpis: list, results_path: str,
+                 processes: int = None, mp_context=None, catalog=None):
+        """
+        :param env_factory: module-level function(policy_path, idf_path) -> BcaEnv with its calling points and
+        callback functions set, see module documentation
+        :param policies: list of policy (checkpoint) paths, or dict of name -> path
+        :param weathers: list of .epw weather file paths, or dict of name -> path
+        :param idfs: list of .idf model paths, or dict of name -> path
+        :param kpis: list of Kpi computed for every cell
+        :param results_path: CSV results table, one row per cell, appended as cells finish
+        :param processes: number of parallel simulations, defaults to the CPU count
+        :param mp_context: multiprocessing context of the pool, e.g. eplus_drl.workers.get_worker_context()
+        :param catalog: optional eplus_drl.catalog.ExperimentCatalog, every evaluated cell is also registered in it
+        """
+        self.env_factory = env_factory
+        self.policies = _named_paths(policies)
+        self.weathers = _named_paths(weathers)
+        self.idfs = _named_paths(idfs)
+        self.kpis = kpis
+        self.results_path = results_path
+        self.processes = processes if processes is not None else os.cpu_count() or 1
+        self.mp_context = mp_context if mp_context is not None else multiprocessing
+        self.columns = self.cell_columns + [kpi.name for kpi in kpis] + ['n_timesteps', 'wall_time']
+        self.catalog = catalog
+        self.errors = {}  # cell -> error of the last run
+
+    def cells(self) -> list:
+        """Returns all cells of the matrix as (policy, weather, idf) name tuples."""
+
+        return list(itertools.product(self.policies, self.weathers, self.idfs))
+
+    def finished_cells(self) -> set:
+        """Returns the cells already in the results table."""
+
+        if not os.path.exists(self.results_path):
+            return set()
+        with open(self.results_path, 'r', newline='') as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames != self.columns:
+                raise ValueError(f'ERROR: The columns of the results table [{self.results_path}] {reader.fieldnames} '
+                                 f'do not match the KPIs of this evaluation {self.columns}, use another results path.')
+            return {tuple(row[column] for column in self.cell_columns) for row in reader}
+
+    def _append_row(self, row: dict):
+        new_file = not os.path.exists(self.results_path)
+        with open(self.results_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def run(self):
+        """
+        Simulates all cells not yet in the results table, appending each to the table as soon as it finishes.
+
+        :return: the full results table, as pandas dataframe
+        """
+        finished = self.finished_cells()
+        pending = [cell for cell in self.cells() if cell not in finished]
+        print(f'\n*NOTE: Evaluation matrix of [{len(self.cells())}] cells, [{len(finished)}] already finished, running '
+              f'[{len(pending)}] in [{self.processes}] processes.\n')
+        if os.path.dirname(self.results_path):
+            os.makedirs(os.path.dirname(self.results_path), exist_ok=True)
+
+        self.errors = {}
+        if pending:
+            experiment_id = None
+            if self.catalog is not None:
+                experiment_id = self.catalog.create_experiment('evaluation_matrix', {
+                    'policies': self.policies, 'weathers': self.weathers, 'idfs': self.idfs,
+                    'results_path': self.results_path})
+            tasks = [(self.env_factory, self.kpis, cell, self.policies[cell[0]], self.idfs[cell[2]],
+                      self.weathers[cell[1]], self.catalog, experiment_id) for cell in pending]
+            # one task per process, EnergyPlus does not free all memory between runs in the same process
+            with self.mp_context.Pool(processes=min(self.processes, len(pending)), maxtasksperchild=1) as pool:
+                for row in pool.imap_unordered(_star_run_cell, tasks):
+                    if 'error' in row:
+                        self.errors[row['cell']] = row['error']
+                        print(f'\n*NOTE: Evaluation cell {row["cell"]} failed: {row["error"]}\n')
+                    else:
+                        self._append_row(row)
+        return self.results()
+
+    def results(self):
+        """Returns the results table as pandas dataframe."""
+
+        import pandas as pd
+
+        if not os.path.exists(self.results_path):
+            return pd.DataFrame(columns=self.columns)
+        return pd.read_csv(self.results_path, dtype={column: str for column in self.cell_columns})
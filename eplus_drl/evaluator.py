@@ -0,0 +1,359 @@
+"""
+Continuous evaluation of published checkpoints, in the background of a training run, on held-out weather.
+
+The training scores of the examples come from stochastic rollouts on the training weather, and the best model is
+selected from a noisy moving average of them. Instead, the learner publishes a checkpoint (policy weights and running
+normalizer statistics, as one .npz file) every few updates, and a CheckpointEvaluator watches the checkpoint directory
+and simulates each new checkpoint with a deterministic (argmax) agent on held-out weather files, in its own processes
+pinned to a reserved slice of the cores, so that evaluation never blocks experience harvesting or learning:
+
+    # learner
+    publish_checkpoint('Models/checkpoints', n_updates, export_weights(policy), normalizer_stats)
+
+    # main process
+    evaluator = CheckpointEvaluator(make_env, 'Models/checkpoints', weathers=['DNK_Dec.epw'], idf_path=dec_idf,
+                                    kpis=kpis, results_path='evaluation.csv', select_kpi='score', cores=[6, 7],
+                                    best_path='Models/model_best.npz')
+    evaluator.start()
+    ...  # training
+    evaluator.stop()  # finishes the evaluation of the last checkpoint
+    version, score, path = evaluator.best()
+
+Only the newest checkpoint is evaluated: older checkpoints not started yet are skipped, and the running evaluation is
+cancelled when a newer checkpoint is published (except after max_cancellations consecutive cancellations, so that
+something gets evaluated when checkpoints are published faster than they are evaluated). Cancelled evaluation
+processes are terminated, everything they allocated is in one run directory of the evaluator which is then deleted.
+
+The results table has the columns of eplus_drl.evaluation.EvaluationMatrix (one row per checkpoint x weather), and the
+score of a checkpoint is the mean of its select_kpi over the weather files. The best checkpoint is copied to best_path.
+"""
+
+import os
+import re
+import csv
+import time
+import shutil
+import threading
+import multiprocessing
+
+import numpy as np
+
+from eplus_drl.evaluation import EvaluationMatrix, _named_paths, _run_cell
+from eplus_drl.rundirs import run_directories
+
+_checkpoint_pattern = re.compile(r'^checkpoint_(\d+)\.npz$')
+_normalizer_prefix = 'normalizer.'
+
+
+def publish_checkpoint(checkpoint_dir: str, version: int, weights: dict, normalizer_stats: dict = None) -> str:
+    """
+    Writes a checkpoint for the evaluator, atomically so that it is never read half written.
+
+    :param checkpoint_dir: directory watched by the CheckpointEvaluator
+    :param version: increasing number of the checkpoint, e.g. the number of updates of the learner
+    :param weights: dict of parameter name -> array, see eplus_drl.inference.export_weights()
+    :param normalizer_stats: running observation statistics used with the weights, see RunningNormalizer.get_stats()
+    :return: path of the checkpoint
+    """
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    arrays = dict(weights)
+    if normalizer_stats is not None:
+        arrays.update({_normalizer_prefix + key: np.asarray(value) for key, value in normalizer_stats.items()})
+    path = os.path.join(checkpoint_dir, f'checkpoint_{version:08d}.npz')
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temporary_path, path)
+    return path
+
+
+def load_checkpoint(path: str) -> tuple:
+    """Loads a checkpoint written by publish_checkpoint(), returns (weights, normalizer_stats or None)."""
+
+    with np.load(path) as data:
+        weights = {name: data[name] for name in data.files if not name.startswith(_normalizer_prefix)}
+        stats = {name[len(_normalizer_prefix):]: data[name] for name in data.files
+                 if name.startswith(_normalizer_prefix)}
+    if stats:
+        stats['count'] = float(stats['count'])
+    return weights, stats or None
+
+
+def list_checkpoints(checkpoint_dir: str) -> list:
+    """Returns the published checkpoints of a directory, as list of (version, path) sorted by version."""
+
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    checkpoints = []
+    for name in os.listdir(checkpoint_dir):
+        match = _checkpoint_pattern.match(name)
+        if match:
+            checkpoints.append((int(match.group(1)), os.path.join(checkpoint_dir, name)))
+    return sorted(checkpoints)
+
+
+def _checkpoint_version(name: str) -> int:
+    match = _checkpoint_pattern.match(name + '.npz')
+    return int(match.group(1)) if match else None
+
+
+def _evaluate_cell(env_factory, kpis: list, cell: tuple, checkpoint_path: str, idf_path: str, weather_file_path: str,
+                   run_root: str, cores: list, sender):
+    """Evaluation process: simulates one cell in run_root, on the reserved cores, and sends its row (or error)."""
+
+    # everything this process allocates is in run_root, deleted by the evaluator even if the process is terminated
+    os.environ['EPLUS_DRL_RUN_ROOT'] = run_root
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    sender.send(_run_cell(env_factory, kpis, cell, checkpoint_path, idf_path, weather_file_path))
+    sender.close()
+
+
+class CheckpointEvaluator:
+    """Evaluates the newest published checkpoints in the background, see module documentation."""
+
+    def __init__(self, env_factory, checkpoint_dir: str, weathers, idf_path: str, kpis: list, results_path: str,
+                 select_kpi: str, maximize: bool = True, processes: int = None, cores: list = None, mp_context=None,
+                 poll_interval: float = 5.0, max_cancellations: int = 3, best_path: str = None):
+        """
+        :param env_factory: module-level function(checkpoint_path, idf_path) -> BcaEnv with a deterministic agent of
+        the checkpoint (see load_checkpoint()), as the env_factory of EvaluationMatrix
+        :param checkpoint_dir: directory the checkpoints are published to, see publish_checkpoint()
+        :param weathers: list of held-out .epw weather file paths, or dict of name -> path
+        :param idf_path: the .idf model of the evaluation, its RunPeriod must be covered by the weather files
+        :param kpis: list of eplus_drl.evaluation.Kpi computed for every checkpoint x weather
+        :param results_path: CSV results table, one row per checkpoint x weather, evaluations already in it are kept
+        for the checkpoints still in checkpoint_dir. Use a checkpoint directory and results table per training run,
+        checkpoint versions restart at every run
+        :param select_kpi: name of the KPI the checkpoints are selected on, averaged over the weather files
+        :param maximize: whether higher values of select_kpi are better
+        :param processes: number of parallel evaluation simulations, defaults to the number of cores, or 1
+        :param cores: CPU ids reserved for the evaluation processes (Linux), None to not pin them
+        :param mp_context: multiprocessing context of the processes, e.g. eplus_drl.workers.get_worker_context()
+        :param poll_interval: seconds between two scans of the checkpoint directory
+        :param max_cancellations: maximum number of consecutive evaluations cancelled for a newer checkpoint
+        :param best_path: the best checkpoint is copied to this path, if given
+        """
+        if select_kpi not in [kpi.name for kpi in kpis]:
+            raise ValueError(f'ERROR: The selection KPI [{select_kpi}] is not one of the KPIs '
+                             f'{[kpi.name for kpi in kpis]}.')
+        self.env_factory = env_factory
+        self.checkpoint_dir = checkpoint_dir
+        self.weathers = _named_paths(weathers)
+        self.idf_path = idf_path
+        self.idf_name = os.path.splitext(os.path.basename(idf_path))[0]
+        self.kpis = kpis
+        self.results_path = results_path
+        self.select_kpi = select_kpi
+        self.maximize = maximize
+        self.cores = list(cores) if cores else None
+        self.processes = processes if processes is not None else len(self.cores) if self.cores else 1
+        self.mp_context = mp_context if mp_context is not None else multiprocessing
+        self.poll_interval = poll_interval
+        self.max_cancellations = max_cancellations
+        self.best_path = best_path
+        self.columns = EvaluationMatrix.cell_columns + [kpi.name for kpi in kpis] + ['n_timesteps', 'wall_time']
+
+        self.scores = {}  # version -> score of the fully evaluated checkpoints
+        self.errors = {}  # cell -> error
+        self.best_version = None
+        self.last_version = -1  # newest checkpoint started (or evaluated in the results table)
+        self.n_cancelled = 0
+        self._cancellations = 0  # consecutive
+        self._current = None  # (version, path) of the checkpoint being evaluated
+        self._pending = []  # cells of the current checkpoint not started yet
+        self._running = {}  # cell -> (process, receiver, run_root)
+        self._rows = {}  # cell -> row, of the current checkpoint
+        self._thread = None
+        self._stop = threading.Event()
+        self._load_results()
+
+    def _load_results(self):
+        # only rows of checkpoints published in checkpoint_dir, a table left by another run cannot skip (or be the best
+        # over) the checkpoints of this run
+        if not os.path.exists(self.results_path):
+            return
+        published = set(version for version, _ in list_checkpoints(self.checkpoint_dir))
+        rows = {}
+        with open(self.results_path, 'r', newline='') as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames != self.columns:
+                raise ValueError(f'ERROR: The columns of the results table [{self.results_path}] {reader.fieldnames} '
+                                 f'do not match the KPIs of this evaluation {self.columns}, use another results path.')
+            for row in reader:
+                version = _checkpoint_version(row['policy'])
+                if version in published and row['idf'] == self.idf_name:
+                    rows.setdefault(version, {})[row['weather']] = float(row[self.select_kpi])
+        for version, values in rows.items():
+            self.last_version = max(self.last_version, version)
+            if set(values) >= set(self.weathers):
+                self._score(version, [values[weather] for weather in self.weathers])
+
+    def _score(self, version: int, values: list) -> bool:
+        """Records the score of a checkpoint, returns whether it is the best one so far."""
+
+        self.scores[version] = float(np.mean(values))
+        best = self.best()
+        if best is None or version == best[0] or self._better(self.scores[version], best[1]):
+            self.best_version = version
+            return True
+        return False
+
+    def _better(self, score: float, reference: float) -> bool:
+        return score > reference if self.maximize else score < reference
+
+    def best(self) -> tuple:
+        """Returns (version, score, checkpoint path) of the best evaluated checkpoint, or None."""
+
+        if self.best_version is None:
+            return None
+        path = os.path.join(self.checkpoint_dir, f'checkpoint_{self.best_version:08d}.npz')
+        return self.best_version, self.scores[self.best_version], path
+
+    def _append_row(self, row: dict):
+        if os.path.dirname(self.results_path):
+            os.makedirs(os.path.dirname(self.results_path), exist_ok=True)
+        new_file = not os.path.exists(self.results_path)
+        with open(self.results_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def _start_checkpoint(self, version: int, path: str):
+        self._current = (version, path)
+        self.last_version = version
+        name = os.path.splitext(os.path.basename(path))[0]
+        self._pending = [(name, weather, self.idf_name) for weather in self.weathers]
+        self._rows = {}
+
+    def _launch(self):
+        while self._pending and len(self._running) < self.processes:
+            cell = self._pending.pop(0)
+            run_root = run_directories().allocate('evaluator')
+            receiver, sender = self.mp_context.Pipe(duplex=False)
+            process = self.mp_context.Process(
+                target=_evaluate_cell, name=f'evaluator-{cell[0]}-{cell[1]}',
+                args=(self.env_factory, self.kpis, cell, self._current[1], self.idf_path, self.weathers[cell[1]],
+                      run_root, self.cores, sender), daemon=True)
+            process.start()
+            sender.close()  # only the evaluation process writes, the receiver sees EOF if it dies
+            self._running[cell] = (process, receiver, run_root)
+
+    def _release(self, cell: tuple, terminate: bool = False):
+        process, receiver, run_root = self._running.pop(cell)
+        if terminate and process.is_alive():
+            process.terminate()
+        process.join()
+        receiver.close()
+        run_directories().release(run_root, failed=False)  # failed runs kept their own artifacts
+
+    def _collect(self):
+        for cell in list(self._running):
+            process, receiver, _ = self._running[cell]
+            try:
+                if not receiver.poll():
+                    continue
+                row = receiver.recv()
+            except EOFError:
+                row = {'cell': cell, 'error': f'evaluation process died (exit code {process.exitcode})'}
+            self._release(cell)
+            if 'error' in row:
+                self.errors[cell] = row['error']
+                print(f'\n*NOTE: Evaluation of checkpoint [{cell[0]}] on [{cell[1]}] failed: {row["error"]}\n')
+            else:
+                self._append_row(row)
+                self._rows[cell] = row
+        if self._current is not None and not self._pending and not self._running:
+            self._finish_checkpoint()
+
+    def _finish_checkpoint(self):
+        version, path = self._current
+        self._current = None
+        self._cancellations = 0
+        if len(self._rows) < len(self.weathers):
+            return  # failed on some weather, not scored
+        if self._score(version, [row[self.select_kpi] for row in self._rows.values()]):
+            print(f'*NOTE: Checkpoint [{version}] is the best so far, {self.select_kpi}: {self.scores[version]:.4g}.')
+            if self.best_path is not None:
+                # copied under a temporary name and renamed, the best checkpoint may be read meanwhile
+                temporary_path = f'{self.best_path}.{os.getpid()}.tmp'
+                shutil.copyfile(path, temporary_path)
+                os.replace(temporary_path, self.best_path)
+
+    def _cancel(self):
+        version = self._current[0]
+        for cell in list(self._running):
+            self._release(cell, terminate=True)
+        self._pending = []
+        self._current = None
+        self.n_cancelled += 1
+        print(f'*NOTE: Evaluation of checkpoint [{version}] cancelled, a newer checkpoint was published.')
+
+    def poll(self, final: bool = False):
+        """
+        Collects the finished evaluations, and starts the evaluation of the newest checkpoint if there is one.
+
+        :param final: cancel the running evaluation for a newer checkpoint regardless of max_cancellations
+        """
+        self._collect()
+        checkpoints = [(version, path) for version, path in list_checkpoints(self.checkpoint_dir)
+                       if version > self.last_version]
+        if checkpoints:
+            if self._current is not None and (final or self._cancellations < self.max_cancellations):
+                self._cancel()
+                self._cancellations += 1
+            if self._current is None:
+                self._start_checkpoint(*checkpoints[-1])
+        self._launch()
+
+    def busy(self) -> bool:
+        """Returns whether a checkpoint is being evaluated."""
+
+        return self._current is not None
+
+    def _loop(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f'\n*NOTE: Checkpoint evaluator error: {e!r}\n')
+
+    def start(self):
+        """Starts watching the checkpoint directory on a background thread."""
+
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='CheckpointEvaluator', daemon=True)
+        self._thread.start()
+
+    def stop(self, finish: bool = True) -> tuple:
+        """
+        Stops watching the checkpoint directory.
+
+        :param finish: wait for the evaluation of the newest checkpoint (e.g. the final model), otherwise cancel the
+        running evaluation
+        :return: best(), once stopped
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if finish:
+            self.poll(final=True)
+            while self.busy():
+                time.sleep(min(self.poll_interval, 0.5))
+                self.poll(final=True)
+        elif self.busy():
+            self._cancel()
+        return self.best()
+
+    def results(self):
+        """Returns the results table as pandas dataframe."""
+
+        import pandas as pd
+
+        if not os.path.exists(self.results_path):
+            return pd.DataFrame(columns=self.columns)
+        return pd.read_csv(self.results_path, dtype={column: str for column in EvaluationMatrix.cell_columns})
@@ -0,0 +1,160 @@
+"""
+Multi-fidelity training: simulate early episodes at a coarse timestep, and later ones at full resolution.
+
+The simulation cost of an episode is roughly proportional to its number of timesteps (and Python callbacks): at 2
+timesteps per hour an episode runs ~3x faster than at 6. A FidelitySchedule gives the Timestep (timesteps per hour) of
+each episode, e.g. '0:2,200:6' for 2/hour from episode 0 and 6/hour from episode 200, and a FidelityController writes
+(and caches) the model variant of each level with its Timestep object rewritten.
+
+Everything tied to the timestep is converted from the base (finest, by default) level, so that an agent sees the same
+problem at every fidelity:
+    - BcaEnv timesteps: the model variant and its timesteps per hour are returned together, see model()
+    - update frequencies (in timesteps), so that observations/actions keep the same period in time
+    - rewards, scaled by the simulated time of a timestep, so that episode returns stay comparable
+    - discount factor, gamma ** (base timesteps per timestep), so that the horizon in time stays the same
+    - running normalizer statistics, sample counts weighted by the simulated time of a timestep
+
+speedup_report() compares the throughput of each level from the episode records of eplus_drl.telemetry.
+"""
+
+import os
+
+from eplus_drl import idf
+
+available_timesteps = [1, 2, 3, 4, 5, 6, 10, 12, 15, 20, 30, 60]
+
+
+class FidelitySchedule:
+    """Timesteps per hour by episode: a list of (first episode, timesteps per hour) levels."""
+
+    def __init__(self, levels: list):
+        """
+        :param levels: list of (first episode, timesteps per hour), the first level must start at episode 0
+        """
+        self.levels = sorted((int(episode), int(timesteps)) for episode, timesteps in levels)
+        if not self.levels or self.levels[0][0] != 0:
+            raise ValueError(f'ERROR: The fidelity schedule {levels} must have a level starting at episode 0.')
+        for _, timesteps in self.levels:
+            if timesteps not in available_timesteps:
+                raise ValueError(f'ERROR: [{timesteps}] timesteps per hour is not a valid EnergyPlus Timestep, '
+                                 f'available timesteps are {available_timesteps}.')
+
+    @staticmethod
+    def from_string(schedule: str):
+        """Parses a schedule written as 'episode:timesteps,...', e.g. '0:2,200:6' (config files)."""
+
+        try:
+            levels = [level.split(':') for level in schedule.split(',') if level.strip()]
+            return FidelitySchedule([(episode, timesteps) for episode, timesteps in levels])
+        except ValueError as e:
+            if str(e).startswith('ERROR'):
+                raise
+            raise ValueError(f'ERROR: The fidelity schedule [{schedule}] must be written as "episode:timesteps,...", '
+                             f'e.g. "0:2,200:6".')
+
+    def timesteps(self, episode: int) -> int:
+        """Returns the timesteps per hour of an episode."""
+
+        return [timesteps for first_episode, timesteps in self.levels if first_episode <= episode][-1]
+
+
+class FidelityController:
+    """
+    Returns the model variant of each episode of a FidelitySchedule, and converts timestep dependent parameters
+    between fidelity levels, see module documentation, e.g.:
+
+        fidelity = FidelityController(idf_path, FidelitySchedule.from_string('0:2,200:6'))
+        idf_path, timesteps = fidelity.model(episode)
+        sim = BcaEnv(ep_path, idf_path, timesteps, ...)
+        sim.set_calling_point_and_callback_function(..., update_observation_frequency=fidelity.frequency(1, timesteps))
+    """
+
+    def __init__(self, idf_path: str, schedule: FidelitySchedule, base_timesteps: int = None, work_dir: str = None):
+        """
+        :param idf_path: the .idf model
+        :param schedule: FidelitySchedule of the training run
+        :param base_timesteps: timesteps per hour the frequencies, rewards, discount factor and normalizer statistics
+        are defined at, defaults to the finest level of the schedule
+        :param work_dir: directory of the model variants, defaults to 'fidelity_models' next to the .idf model
+        """
+        self.idf_path = idf_path
+        self.schedule = schedule
+        self.base_timesteps = base_timesteps if base_timesteps is not None else \
+            max(timesteps for _, timesteps in schedule.levels)
+        self.work_dir = work_dir if work_dir is not None else \
+            os.path.join(os.path.dirname(os.path.abspath(idf_path)), 'fidelity_models')
+        self.idf_text = idf.read_idf(idf_path)
+        self.model_timesteps = idf.get_timestep(self.idf_text)
+
+    def model(self, episode: int) -> tuple:
+        """Returns (idf_path, timesteps per hour) of the model of an episode, writing the variant if not cached."""
+
+        timesteps = self.schedule.timesteps(episode)
+        if timesteps == self.model_timesteps:
+            return self.idf_path, timesteps
+        idf_path = idf.write_idf_variant(idf.set_timestep(self.idf_text, timesteps), self.idf_path, self.work_dir,
+                                         f'ts{timesteps}')
+        return idf_path, timesteps
+
+    def step_scale(self, timesteps: int) -> float:
+        """Returns the number of base timesteps simulated by one timestep at the given fidelity."""
+
+        return self.base_timesteps / timesteps
+
+    def frequency(self, base_frequency: int, timesteps: int) -> int:
+        """Converts an update frequency in base timesteps to timesteps at the given fidelity (at least 1)."""
+
+        return max(1, round(base_frequency / self.step_scale(timesteps)))
+
+    def reward_scale(self, timesteps: int) -> float:
+        """Returns the factor of the rewards at the given fidelity, for the same returns per simulated time."""
+
+        return self.step_scale(timesteps)
+
+    def discount(self, gamma: float, timesteps: int) -> float:
+        """Converts a per base timestep discount factor to the per timestep discount factor at the given fidelity."""
+
+        return gamma ** self.step_scale(timesteps)
+
+    def scale_stats(self, stats: dict, timesteps: int) -> dict:
+        """
+        Weights running normalizer statistics (see RunningNormalizer.get_stats()) gathered at the given fidelity by
+        the simulated time of their samples, before they are merged with the statistics of other levels.
+        """
+        if stats is None:
+            return None
+        scale = self.step_scale(timesteps)
+        return {'count': stats['count'] * scale, 'mean': stats['mean'], 'm2': stats['m2'] * scale}
+
+
+def speedup_report(records: list) -> list:
+    """
+    Compares the throughput of the fidelity levels of a training run.
+
+    :param records: episode records, see eplus_drl.telemetry.EpisodeTelemetry
+    :return: list of dicts, one per level (finest first), with its timesteps per hour, number of episodes, simulated
+    hours, wall time, throughput (simulated hours per wall second) and speedup relative to the finest level
+    """
+    rows = []
+    levels = sorted(set(record['timesteps_per_hour'] for record in records if record.get('timesteps_per_hour')),
+                    reverse=True)
+    for timesteps in levels:
+        level_records = [record for record in records if record.get('timesteps_per_hour') == timesteps]
+        wall_time = sum(record['wall_time'] for record in level_records)
+        simulated_hours = sum(record['simulated_hours'] for record in level_records)
+        rows.append({'timesteps_per_hour': timesteps, 'episodes': len(level_records),
+                     'simulated_hours': simulated_hours, 'wall_time': wall_time,
+                     'throughput': simulated_hours / wall_time if wall_time > 0 else 0.0})
+    for row in rows:
+        row['speedup'] = row['throughput'] / rows[0]['throughput'] if rows[0]['throughput'] > 0 else float('nan')
+    return rows
+
+
+def format_speedup_report(rows: list) -> str:
+    """Formats the rows of speedup_report() as a text table."""
+
+    lines = [f"{'steps/h':>8} {'episodes':>8} {'sim h':>9} {'wall s':>9} {'sim h/s':>8} {'speedup':>8}"]
+    for row in rows:
+        lines.append(f"{row['timesteps_per_hour']:>8} {row['episodes']:>8} {row['simulated_hours']:>9.1f} "
+                     f"{row['wall_time']:>9.1f} {row['throughput']:>8.2f} {row['speedup']:>7.2f}x")
+    return '\n'.join(lines)
@@ -0,0 +1,240 @@
+"""
+Gymnasium-style reset()/step() interface to a BcaEnv simulation, by running it on a dedicated thread.
+
+EnergyPlus drives the simulation and calls the agent back (observation/actuation functions), which forces agents to
+keep their state between callbacks and does not fit RL libraries, which call env.step(action) themselves. BcaGymEnv
+inverts the control: the simulation runs on its own thread, and at each callback it hands the observation over to the
+caller's thread and parks until step() hands an action back:
+
+    env = BcaGymEnv(make_env, weather_path, observe=lambda sim: pipeline.observe().copy(),
+                    actuate=lambda action: {'fan_mass_flow_act': action * 0.218}, reward=reward_fn)
+    observation, info = env.reset()
+    while True:
+        observation, reward, terminated, truncated, info = env.step(agent.act(observation))
+        if terminated or truncated:
+            break
+    env.close()
+
+The handoff is two locks used as binary semaphores, one per direction, and a single slot for the observation/action:
+nothing is allocated per step. Gymnasium is not required, the spaces can be given to be used by RL libraries.
+"""
+
+import time
+import threading
+import traceback
+
+from eplus_drl import EmsPy
+from eplus_drl.rundirs import run_directories
+
+# E+ kind of simulation of the weather file run periods, see api.exchange.kind_of_sim(), design days are skipped
+_run_period_weather = 3
+
+
+class BcaGymEnv:
+    """
+    reset()/step() environment of BcaEnv simulations, one simulation (episode) per reset(), see module documentation.
+
+    step() returns (observation, reward, terminated, truncated, info) where reward is given by the reward function
+    at the callback following the action, terminated is True once the simulation ended (the observation and reward are
+    then those at the end of the run), and truncated is True after max_steps steps.
+    """
+
+    def __init__(self, make_env, weather_file_path: str, observe, actuate, reward=None,
+                 calling_point: str = EmsPy.available_calling_points[7], frequency: int = 1, max_steps: int = None,
+                 observation_space=None, action_space=None, record_latency: bool = False):
+        """
+        :param make_env: function returning a new BcaEnv for an episode (one E+ state per simulation), without the
+        calling point used by this environment
+        :param weather_file_path: the .epw weather file
+        :param observe: function(sim) returning the observation at a callback, e.g. from an ObservationPipeline. It
+        must return a new array (or a copy) if observations are kept by the agent
+        :param actuate: function(action) returning the setpoints of the actuation function (dict or vector)
+        :param reward: function(sim) returning the reward at a callback, or None for a reward of 0
+        :param calling_point: the calling point of the agent's callback
+        :param frequency: number of zone timesteps per step
+        :param max_steps: number of steps after which episodes are truncated (the simulation is stopped)
+        :param observation_space: e.g. a gymnasium.spaces.Box, only stored
+        :param action_space: e.g. a gymnasium.spaces.Discrete, only stored
+        :param record_latency: record the handoff latency of every step, see latency_samples
+        """
+        self.make_env = make_env
+        self.weather_file_path = weather_file_path
+        self.observe = observe
+        self.actuate = actuate
+        self.reward = reward
+        self.calling_point = calling_point
+        self.frequency = frequency
+        self.max_steps = max_steps
+        self.observation_space = observation_space
+        self.action_space = action_space
+        self.record_latency = record_latency
+
+        self.sim = None
+        self.episode = -1
+        self.n_steps = 0
+        self._thread = None
+        # handoff, each lock is held (acquired) until it is the turn of its side
+        self._agent_turn = threading.Lock()
+        self._sim_turn = threading.Lock()
+        self._agent_turn.acquire()
+        self._sim_turn.acquire()
+        # single slot
+        self._observation = None
+        self._reward = 0.0
+        self._action = None
+        self._done = False
+        self._stopping = False
+        self._error = None
+        self._run_dir = None
+        # handoff latency, nanoseconds from the release by one side to the wake-up of the other
+        self._released_ns = 0
+        self.latency_samples = {'to_agent': [], 'to_sim': []}
+
+    def _callback(self):
+        """Actuation function of the simulation: hands the observation over and parks until the next action."""
+
+        if self._stopping:
+            return None
+        sim = self.sim
+        kind_of_sim = getattr(sim.api.exchange, 'kind_of_sim', None)
+        if kind_of_sim is not None and kind_of_sim(sim.state) != _run_period_weather:
+            return None  # sizing periods, not part of the episode
+        try:
+            self._observation = self.observe(sim)
+            self._reward = self.reward(sim) if self.reward is not None else 0.0
+        except BaseException as e:
+            self._error = (e, traceback.format_exc())
+            self._stop_simulation()
+            return None
+        self._released_ns = time.perf_counter_ns()
+        self._agent_turn.release()
+        self._sim_turn.acquire()
+        if self.record_latency:
+            self.latency_samples['to_sim'].append(time.perf_counter_ns() - self._released_ns)
+        if self._stopping:
+            self._stop_simulation()
+            return None
+        try:
+            return self.actuate(self._action)
+        except BaseException as e:
+            self._error = (e, traceback.format_exc())
+            self._stop_simulation()
+            return None
+
+    def _stop_simulation(self):
+        self._stopping = True
+        stop_simulation = getattr(self.sim.api.runtime, 'stop_simulation', None)
+        if stop_simulation is not None:
+            stop_simulation(self.sim.state)
+        # otherwise the simulation runs to its end, with no more handoffs
+
+    def _run(self):
+        """Simulation thread."""
+
+        try:
+            self.sim.run_env(self.weather_file_path, f'{self._run_dir}/out')
+        except BaseException as e:
+            if self._error is None:
+                self._error = (e, traceback.format_exc())
+        finally:
+            self._done = True
+            self._released_ns = time.perf_counter_ns()
+            self._agent_turn.release()
+
+    def _wait_for_simulation(self):
+        """Parks the caller's thread until the next callback, or the end of the simulation."""
+
+        while not self._agent_turn.acquire(timeout=1.0):
+            if not self._thread.is_alive() and not self._done:
+                raise RuntimeError('ERROR: The simulation thread died without ending the episode.')
+        if self.record_latency:
+            self.latency_samples['to_agent'].append(time.perf_counter_ns() - self._released_ns)
+        if self._error is not None:
+            e, trace = self._error
+            self._error = None
+            raise RuntimeError(f'ERROR: The simulation of episode [{self.episode}] failed: {e!r}\n{trace}') from e
+
+    def reset(self, seed: int = None, options: dict = None):
+        """
+        Stops the current simulation, if any, starts a new one and returns (observation, info) at its first callback.
+
+        :param seed: not used, episodes are deterministic given the BcaEnv of make_env()
+        :param options: not used
+        """
+        self.close()
+        self.episode += 1
+        self.n_steps = 0
+        self._done = False
+        self._stopping = False
+        self._error = None
+        # both sides locked, whatever the way the last simulation ended
+        self._agent_turn.acquire(blocking=False)
+        self._sim_turn.acquire(blocking=False)
+        self.sim = self.make_env()
+        self.sim.set_calling_point_and_callback_function(self.calling_point, None, self._callback, True,
+                                                         self.frequency, self.frequency)
+        self._run_dir = run_directories().allocate(f'gym_episode{self.episode}')
+        self._thread = threading.Thread(target=self._run, name=f'BcaGymEnv-{self.episode}', daemon=True)
+        self._thread.start()
+        self._wait_for_simulation()
+        if self._done:
+            raise RuntimeError(f'ERROR: The simulation of episode [{self.episode}] ended before its first step, '
+                               f'see the error file kept in [{run_directories().keep_dir}].')
+        return self._observation, {'episode': self.episode, 'datetime': self.sim.t_datetimes[-1]}
+
+    def step(self, action):
+        """Applies an action until the next callback, returns (observation, reward, terminated, truncated, info)."""
+
+        if self._thread is None or self._done:
+            raise Exception('ERROR: The episode ended, please use reset() first.')
+        self._action = action
+        self.n_steps += 1
+        truncated = self.max_steps is not None and self.n_steps >= self.max_steps
+        if truncated:
+            self._stopping = True  # the simulation is stopped at its next handoff
+        self._released_ns = time.perf_counter_ns()
+        self._sim_turn.release()
+        self._wait_for_simulation()
+        if self._done:
+            self._finish_run()
+            observation = self.observe(self.sim) if self.sim.t_datetimes else self._observation
+            reward = self.reward(self.sim) if self.reward is not None and self.sim.t_datetimes else 0.0
+            return observation, reward, not truncated, truncated, \
+                {'episode': self.episode, 'simulation_success': self.sim.simulation_success}
+        return self._observation, self._reward, False, False, \
+            {'episode': self.episode, 'datetime': self.sim.t_datetimes[-1]}
+
+    def _finish_run(self):
+        self._thread.join()
+        self._thread = None
+        if self._run_dir is not None:
+            run_directories().release(self._run_dir, failed=self.sim.simulation_success != 0 and not self._stopping)
+            self._run_dir = None
+
+    def close(self):
+        """Stops the current simulation, if any, and waits for its thread to end."""
+
+        if self._thread is None:
+            return
+        if not self._done:
+            self._stopping = True
+            self._sim_turn.release()  # wakes the parked callback, which stops the simulation
+            while not self._done:
+                self._agent_turn.acquire(timeout=1.0)
+                if not self._thread.is_alive():
+                    break
+            self._error = None
+        self._finish_run()
+
+    def latency_stats(self) -> dict:
+        """Returns the mean, median and 99th percentile of the recorded handoff latencies, in microseconds."""
+
+        import numpy as np
+
+        stats = {}
+        for direction, samples in self.latency_samples.items():
+            if samples:
+                us = np.asarray(samples) / 1000
+                stats[direction] = {'mean': float(us.mean()), 'p50': float(np.median(us)),
+                                    'p99': float(np.percentile(us, 99)), 'n': len(us)}
+        return stats
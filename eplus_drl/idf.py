@@ -0,0 +1,214 @@
+"""
+Minimal text-level utilities to read and rewrite EnergyPlus .idf building models.
+
+The .idf format is a flat list of objects: 'ObjectType, field1, field2, ... fieldN;' where '!' starts a comment. These
+helpers keep the original file layout (comments, indentation, field notes) untouched and only replace the field values
+that are changed, so rewritten models can still be diffed against and read like the original.
+"""
+
+import os
+import hashlib
+import datetime
+import threading
+
+day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+class IdfObject:
+    """A parsed .idf object, its field values and the character spans of each field in the source text."""
+
+    def __init__(self, object_type: str, values: list, spans: list):
+        self.object_type = object_type
+        self.values = values  # field values, excluding the object type
+        self.spans = spans  # (start, end) character spans of each field value in the source text
+
+    def get(self, field_index: int, default: str = ''):
+        """Returns the value of the field at the given index (0 is the first field after the object type)."""
+
+        if field_index < len(self.values) and self.values[field_index] != '':
+            return self.values[field_index]
+        return default
+
+
+def read_idf(idf_path: str) -> str:
+    """Returns the text of an .idf file."""
+
+    with open(idf_path, 'r') as idf_file:
+        return idf_file.read()
+
+
+def write_idf(idf_text: str, idf_path: str) -> str:
+    """Writes .idf text to a file, creating its directory if needed, and returns the path."""
+
+    folder_path = os.path.dirname(idf_path)
+    if folder_path:
+        os.makedirs(folder_path, exist_ok=True)
+    with open(idf_path, 'w') as idf_file:
+        idf_file.write(idf_text)
+    return idf_path
+
+
+def parse_idf(idf_text: str) -> list:
+    """
+    Parses .idf text into a list of IdfObject, in order of appearance.
+
+    :param idf_text: the complete text of an .idf file
+    :return: list of IdfObject with the values and source spans of their fields
+    """
+    objects = []
+    tokens = []  # (value, start, end) of the object currently being read
+    value_start, value_end = None, None  # span of the non-blank text of the current field
+    blank_start = 0  # start of the current field, used as span of empty fields
+    offset = 0
+    for line in idf_text.splitlines(keepends=True):
+        code = line.split('!', 1)[0]
+        for i, char in enumerate(code):
+            if char == ',' or char == ';':
+                if value_start is None:  # empty field, keep whitespace span so a value can be written in its place
+                    tokens.append(('', blank_start, offset + i))
+                else:
+                    tokens.append((idf_text[value_start:value_end], value_start, value_end))
+                value_start, value_end = None, None
+                blank_start = offset + i + 1
+                if char == ';':
+                    objects.append(IdfObject(tokens[0][0], [t[0] for t in tokens[1:]],
+                                             [(t[1], t[2]) for t in tokens[1:]]))
+                    tokens = []
+            elif not char.isspace():
+                if value_start is None:
+                    value_start = offset + i
+                value_end = offset + i + 1
+        if value_start is None:  # empty fields never span over comments or line breaks
+            blank_start = offset + len(line)
+        offset += len(line)
+    return objects
+
+
+def get_idf_objects(idf_text: str, object_type: str) -> list:
+    """Returns all IdfObject of a given type (case-insensitive), e.g. 'RunPeriod' or 'Timestep'."""
+
+    object_type = object_type.lower()
+    return [obj for obj in parse_idf(idf_text) if obj.object_type.lower() == object_type]
+
+
+def set_idf_fields(idf_text: str, idf_object: IdfObject, field_values: dict) -> str:
+    """
+    Returns .idf text with the given fields of one object replaced, leaving the rest of the text untouched.
+
+    :param idf_text: the text the object was parsed from
+    :param idf_object: the IdfObject to modify, as returned by parse_idf() or get_idf_objects() on idf_text
+    :param field_values: dict of field index (0 is first field after the object type) and new value
+    :return: modified .idf text
+    """
+    # replace from the end of the file backwards so that earlier spans stay valid
+    for field_index in sorted(field_values, reverse=True):
+        if field_index >= len(idf_object.spans):
+            raise IndexError(f'ERROR: The {idf_object.object_type} object only has {len(idf_object.spans)} fields, '
+                             f'field [{field_index}] can not be set.')
+        start, end = idf_object.spans[field_index]
+        value = str(field_values[field_index])
+        if start == end or idf_text[start:end].strip() == '':  # empty field, keep the original indentation
+            value = idf_text[start:end] + value
+        idf_text = idf_text[:start] + value + idf_text[end:]
+    return idf_text
+
+
+def format_idf_object(object_type: str, values: list) -> str:
+    """Formats a new .idf object from its type and field values, one field per line."""
+
+    lines = [object_type + ',']
+    for i, value in enumerate(values):
+        lines.append(f'  {value}' + (';' if i == len(values) - 1 else ','))
+    return '\n'.join(lines) + '\n'
+
+
+def append_idf_objects(idf_text: str, idf_objects: list) -> str:
+    """Returns .idf text with new objects, given as (object_type, [values]), appended at the end of the file."""
+
+    if not idf_text.endswith('\n'):
+        idf_text += '\n'
+    return idf_text + '\n' + '\n'.join(format_idf_object(t, v) for t, v in idf_objects)
+
+
+def get_run_period(idf_text: str, year: int = 2017) -> tuple:
+    """
+    Returns the (begin, end) dates of the first RunPeriod of a model.
+
+    :param idf_text: the text of the .idf file
+    :param year: calendar year used for the dates when the RunPeriod has no Begin Year, only for date arithmetic
+    :return: tuple of datetime.date
+    """
+    run_periods = get_idf_objects(idf_text, 'RunPeriod')
+    if not run_periods:
+        raise ValueError('ERROR: The .idf file has no RunPeriod object.')
+    rp = run_periods[0]
+    begin_year = int(rp.get(3, year))
+    end_year = int(rp.get(6, begin_year))
+    begin = datetime.date(begin_year, int(rp.get(1)), int(rp.get(2)))
+    end = datetime.date(end_year, int(rp.get(4)), int(rp.get(5)))
+    return begin, end
+
+
+def set_run_period(idf_text: str, begin: datetime.date, end: datetime.date) -> str:
+    """
+    Returns .idf text with the first RunPeriod set to run from begin to end (inclusive).
+
+    The 'Day of Week for Start Day' is shifted with the begin date so the simulated calendar (weekdays, schedules)
+    stays the same as in the original run period. Begin/End Year fields are only written if they were set.
+    """
+    run_periods = get_idf_objects(idf_text, 'RunPeriod')
+    if not run_periods:
+        raise ValueError('ERROR: The .idf file has no RunPeriod object.')
+    rp = run_periods[0]
+    original_begin, _ = get_run_period(idf_text, begin.year)
+    fields = {1: begin.month, 2: begin.day, 4: end.month, 5: end.day}
+    if rp.get(3):
+        fields[3] = begin.year
+    if rp.get(6):
+        fields[6] = end.year
+    start_day = rp.get(7)
+    if start_day.capitalize() in day_names:
+        shift = (begin - original_begin.replace(year=begin.year)).days
+        fields[7] = day_names[(day_names.index(start_day.capitalize()) + shift) % 7]
+    return set_idf_fields(idf_text, rp, fields)
+
+
+def idf_variant_path(idf_path: str, out_dir: str, tag: str) -> str:
+    """Returns a stable file path for a rewritten variant of an .idf model, used to cache rewritten models."""
+
+    name, ext = os.path.splitext(os.path.basename(idf_path))
+    return os.path.join(out_dir, f'{name}_{tag}{ext}')
+
+
+def write_idf_variant(idf_text: str, idf_path: str, out_dir: str, tag: str) -> str:
+    """
+    Writes a rewritten variant of an .idf model to out_dir, unless it is already there (cached), and returns its path.
+
+    The hash of the variant text is added to the tag of idf_variant_path(), so that a cached variant is never stale if
+    the model changes. It is written under a temporary name and renamed, several workers may write the same variant at
+    the same time.
+
+    :param idf_text: text of the variant
+    :param idf_path: path of the original .idf model, names the variant
+    """
+    variant_path = idf_variant_path(idf_path, out_dir, f'{tag}_{hashlib.sha1(idf_text.encode()).hexdigest()[:8]}')
+    if not os.path.exists(variant_path):
+        temporary_path = write_idf(idf_text, f'{variant_path}.{os.getpid()}.{threading.get_ident()}.tmp')
+        os.replace(temporary_path, variant_path)
+    return variant_path
+
+
+def get_timestep(idf_text: str) -> int:
+    """Returns the Number of Timesteps per Hour of the Timestep object of a model (EnergyPlus default of 6 if none)."""
+
+    timesteps = get_idf_objects(idf_text, 'Timestep')
+    return int(timesteps[0].get(0, 6)) if timesteps else 6
+
+
+def set_timestep(idf_text: str, timesteps_per_hour: int) -> str:
+    """Returns .idf text with the Number of Timesteps per Hour of the Timestep object set, appended if missing."""
+
+    timesteps = get_idf_objects(idf_text, 'Timestep')
+    if not timesteps:
+        return append_idf_objects(idf_text, [('Timestep', [timesteps_per_hour])])
+    return set_idf_fields(idf_text, timesteps[0], {0: timesteps_per_hour})
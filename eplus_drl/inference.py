@@ -0,0 +1,140 @@
+"""
+Lightweight NumPy inference of exported (frozen) MLP policies, for acting inside the EnergyPlus callbacks.
+
+Acting through torch (tensor creation, per-op dispatch, conversion back to NumPy and np.random.choice) costs far more
+than the actual math of a small MLP, on the critical path of the simulation. The weights of a torch module are
+exported once to NumPy arrays (optionally to an .npz file, loadable without torch), and NumpyPolicy runs the forward
+pass into preallocated buffers and samples the action by inverse CDF on a pre-drawn stream of uniform numbers.
+
+    weights = export_weights(policy, 'Models/policy.npz')  # torch module -> dict of arrays
+    numpy_policy = NumpyPolicy(weights, layers=['fc1', 'fc2'], activation='elu')
+    action = numpy_policy.act(state)
+"""
+
+import numpy as np
+
+
+def export_weights(module, path: str = None) -> dict:
+    """
+    Exports the parameters (state_dict) of a torch module to frozen NumPy arrays.
+
+    :param module: torch module, e.g. the Policy of the A2C example
+    :param path: optional .npz file to save the weights to
+    :return: dict of parameter name (e.g. 'fc1.weight') -> NumPy array
+    """
+    weights = {name: tensor.detach().cpu().numpy().copy() for name, tensor in module.state_dict().items()}
+    if path is not None:
+        np.savez(path, **weights)
+    return weights
+
+
+def load_weights(path: str) -> dict:
+    """Loads weights saved by export_weights(), as dict of parameter name -> NumPy array."""
+
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+class NumpyPolicy:
+    """Stochastic (or greedy) MLP policy over discrete actions, running on NumPy with preallocated buffers."""
+
+    activations = ['elu', 'relu', 'tanh']
+
+    def __init__(self, weights: dict, layers: list, activation: str = 'elu', seed: int = None,
+                 n_uniforms: int = 4096, dtype=np.float32):
+        """
+        :param weights: dict of parameter name -> array, as returned by export_weights()/load_weights()
+        :param layers: names of the linear layers (torch nn.Linear, weight [out, in]) from the input to the action
+        logits, e.g. ['fc1', 'fc2']. The activation is applied after every layer but the last.
+        :param activation: activation of the hidden layers, one of NumpyPolicy.activations
+        :param seed: seed of the random generator used to sample actions
+        :param n_uniforms: number of uniform numbers drawn at once for sampling
+        :param dtype: float type of the forward pass, float32 as torch
+        """
+        if activation not in self.activations:
+            raise ValueError(f'ERROR: Activation [{activation}] is not supported, use one of {self.activations}.')
+        self.activation = activation
+        self.dtype = dtype
+        # weights transposed to [in, out], so that x @ w maps a row vector
+        self.weights = [np.ascontiguousarray(weights[layer + '.weight'].T, dtype=dtype) for layer in layers]
+        self.biases = [np.ascontiguousarray(weights[layer + '.bias'], dtype=dtype) for layer in layers]
+        self.input_size = self.weights[0].shape[0]
+        self.action_size = self.weights[-1].shape[1]
+
+        # preallocated buffers, one per layer output, plus a scratch buffer per hidden layer for the activation
+        self._x = np.empty(self.input_size, dtype=dtype)
+        self._outputs = [np.empty(w.shape[1], dtype=dtype) for w in self.weights]
+        self._scratch = [np.empty(w.shape[1], dtype=dtype) for w in self.weights[:-1]]
+        self._cdf = np.empty(self.action_size, dtype=np.float64)
+
+        self.rng = np.random.default_rng(seed)
+        self.n_uniforms = n_uniforms
+        self._uniforms = self.rng.random(n_uniforms)
+        self._uniform_index = 0
+
+    def _activate(self, h: np.ndarray, scratch: np.ndarray):
+        if self.activation == 'elu':  # h if h > 0 else exp(h) - 1, in place
+            np.minimum(h, 0, out=scratch)
+            np.expm1(scratch, out=scratch)
+            np.maximum(h, 0, out=h)
+            h += scratch
+        elif self.activation == 'relu':
+            np.maximum(h, 0, out=h)
+        else:
+            np.tanh(h, out=h)
+
+    def logits(self, state) -> np.ndarray:
+        """
+        Forward pass, returns the action logits (unnormalized log probabilities).
+
+        Returns a view of an internal buffer, overwritten at the next call, copy it to keep it.
+        """
+        x = self._x
+        x[:] = np.ravel(state)
+        n_layers = len(self.weights)
+        for i in range(n_layers):
+            h = self._outputs[i]
+            np.dot(x, self.weights[i], out=h)
+            h += self.biases[i]
+            if i < n_layers - 1:
+                self._activate(h, self._scratch[i])
+            x = h
+        return x
+
+    def probabilities(self, state) -> np.ndarray:
+        """Returns the action probabilities (softmax of the logits), as new array."""
+
+        logits = self.logits(state).astype(np.float64)
+        probs = np.exp(logits - logits.max())
+        return probs / probs.sum()
+
+    def _uniform(self) -> float:
+        if self._uniform_index == self.n_uniforms:
+            self.rng.random(out=self._uniforms)
+            self._uniform_index = 0
+        u = self._uniforms[self._uniform_index]
+        self._uniform_index += 1
+        return u
+
+    def act(self, state, deterministic: bool = False, return_probabilities: bool = False):
+        """
+        Returns the action for a (preprocessed) state, sampled from the softmax of the logits, or the most likely
+        action if deterministic.
+
+        If return_probabilities, returns (action, action probabilities as new array) from the same forward pass, e.g.
+        to record the log-probability of the action taken by this (behaviour) policy.
+        """
+        logits = self.logits(state)
+        if deterministic and not return_probabilities:
+            return int(np.argmax(logits))
+        # inverse CDF on the unnormalized softmax, the normalization is folded into the uniform draw
+        cdf = self._cdf
+        np.subtract(logits, logits.max(), out=cdf)
+        np.exp(cdf, out=cdf)
+        probs = cdf / cdf.sum() if return_probabilities else None
+        if deterministic:
+            action = int(np.argmax(logits))
+        else:
+            np.cumsum(cdf, out=cdf)
+            action = min(int(np.searchsorted(cdf, self._uniform() * cdf[-1], side='right')), self.action_size - 1)
+        return (action, probs) if return_probabilities else action
@@ -0,0 +1,298 @@
+"""
+Observation preprocessing (normalization & embedding) stage, declared next to the EMS ToCs of a BcaEnv.
+
+An ObservationPipeline reads the most recent value of a list of ToC/timing metrics from a BcaEnv, scales them with
+vectorized affine bounds or running mean/variance statistics (Welford), appends cyclical time encodings and stacks the
+last N frames. All work is done in preallocated buffers, no arrays are allocated per timestep.
+
+Running statistics of parallel workers can be synced: each worker sends get_stats(since_sync=True) with its episode
+experience, the learner merges them with merge_stats() and workers load the merged stats back with set_stats().
+"""
+
+import math
+
+import numpy as np
+
+
+class AffineScaler:
+    """Scales each feature from its [low, high] bounds to [0, 1], out = (x - low) / (high - low)."""
+
+    def __init__(self, low, high):
+        low = np.asarray(low, dtype=float)
+        high = np.asarray(high, dtype=float)
+        if np.any(high == low):
+            raise ValueError(f'ERROR: Affine scaling bounds must have high != low, got low {low} and high {high}.')
+        self.offset = low
+        self.scale = 1.0 / (high - low)
+
+    def __call__(self, x: np.ndarray, out: np.ndarray) -> np.ndarray:
+        np.subtract(x, self.offset, out=out)
+        np.multiply(out, self.scale, out=out)
+        return out
+
+
+class RunningNormalizer:
+    """
+    Standardizes each feature with its running mean and variance, updated in place with Welford's algorithm.
+
+    Statistics are (count, mean, m2), m2 being the sum of squared differences from the mean. Statistics gathered since
+    the last sync (set_stats) can be extracted and merged with those of other workers (Chan et al. parallel update).
+    """
+
+    def __init__(self, size: int, epsilon: float = 1e-8, clip: float = None):
+        """
+        :param size: number of features
+        :param epsilon: added to the variance to avoid division by zero
+        :param clip: clip standardized values to [-clip, clip], leave as None for no clipping
+        """
+        self.size = size
+        self.epsilon = epsilon
+        self.clip = clip
+        self.count = 0.0
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+        self._synced_stats = self.get_stats()  # stats at last sync, to extract this worker's share
+        # work buffers
+        self._delta = np.empty(size)
+        self._tmp = np.empty(size)
+        self._std = np.ones(size)
+
+    def update(self, x: np.ndarray):
+        """Updates the running statistics, in place, with one sample."""
+
+        self.count += 1.0
+        np.subtract(x, self.mean, out=self._delta)
+        np.multiply(self._delta, 1.0 / self.count, out=self._tmp)
+        np.add(self.mean, self._tmp, out=self.mean)
+        np.subtract(x, self.mean, out=self._tmp)
+        np.multiply(self._delta, self._tmp, out=self._tmp)
+        np.add(self.m2, self._tmp, out=self.m2)
+
+    def __call__(self, x: np.ndarray, out: np.ndarray) -> np.ndarray:
+        if self.count > 1:
+            np.divide(self.m2, self.count, out=self._std)
+            np.add(self._std, self.epsilon, out=self._std)
+            np.sqrt(self._std, out=self._std)
+        np.subtract(x, self.mean, out=out)
+        np.divide(out, self._std, out=out)
+        if self.clip is not None:
+            np.clip(out, -self.clip, self.clip, out=out)
+        return out
+
+    def get_stats(self, since_sync: bool = False) -> dict:
+        """
+        Returns a copy of the statistics as a dict of 'count', 'mean' and 'm2'.
+
+        :param since_sync: True to only return the statistics of the samples seen since the last set_stats(), which
+        is this worker's share to be merged by the learner, otherwise the complete statistics
+        """
+        stats = {'count': self.count, 'mean': self.mean.copy(), 'm2': self.m2.copy()}
+        if not since_sync:
+            return stats
+        # invert the parallel merge of (synced stats) + (local stats) = (current stats)
+        synced = self._synced_stats
+        n_local = self.count - synced['count']
+        if n_local <= 0:
+            return {'count': 0.0, 'mean': np.zeros(self.size), 'm2': np.zeros(self.size)}
+        mean_local = (self.count * self.mean - synced['count'] * synced['mean']) / n_local
+        delta = mean_local - synced['mean']
+        m2_local = self.m2 - synced['m2'] - delta ** 2 * synced['count'] * n_local / self.count
+        return {'count': n_local, 'mean': mean_local, 'm2': np.maximum(m2_local, 0.0)}
+
+    def set_stats(self, stats: dict):
+        """Loads statistics (e.g. merged by the learner), in place, and marks them as the last sync point."""
+
+        self.count = float(stats['count'])
+        self.mean[:] = stats['mean']
+        self.m2[:] = stats['m2']
+        self._synced_stats = self.get_stats()
+
+    @staticmethod
+    def merge_stats(stats_list: list) -> dict:
+        """Merges the statistics of several workers/sample sets into one, see get_stats()."""
+
+        count, mean, m2 = 0.0, None, None
+        for stats in stats_list:
+            n = float(stats['count'])
+            if n == 0:
+                continue
+            if mean is None:
+                count, mean, m2 = n, np.array(stats['mean'], dtype=float), np.array(stats['m2'], dtype=float)
+                continue
+            total = count + n
+            delta = stats['mean'] - mean
+            mean = mean + delta * (n / total)
+            m2 = m2 + stats['m2'] + delta ** 2 * (count * n / total)
+            count = total
+        if mean is None:
+            raise ValueError('ERROR: There are no statistics to merge, all have a count of 0.')
+        return {'count': count, 'mean': mean, 'm2': m2}
+
+
+class ObservationPipeline:
+    """
+    Builds the (normalized, embedded, frame-stacked) observation vector of an agent from a BcaEnv at each timestep.
+
+    Declare it next to the ToCs, e.g.:
+
+        observation_features = ['t_hours', 'zn0_temp', 'oa_db']
+        observation_bounds = {'t_hours': (0, 24), 'zn0_temp': (18, 35), 'oa_db': (-10, 10)}
+        ...
+        self.pipeline = ObservationPipeline(self.sim, observation_features, observation_bounds)
+        ...
+        state = self.pipeline.observe()  # in the observation function
+
+    The returned array is a view of the pipeline's internal buffer, valid until the next call to observe(). Pass
+    out= (e.g. a row of a preallocated experience array) to write the observation directly where it is stored.
+    """
+
+    time_encodings_available = ['hour_of_day', 'day_of_week', 'day_of_year']
+
+    def __init__(self, bca, features: list, bounds: dict = None, normalization: str = 'bounds',
+                 time_encodings: list = None, frame_stack: int = 1, update_stats: bool = True, clip: float = None):
+        """
+        :param bca: the BcaEnv (or EmsPy) instance the observations are read from
+        :param features: ordered list of EMS ToC names and/or timing metrics (e.g. 't_hours') to observe
+        :param bounds: dict of feature name and (low, high) bounds for 'bounds' normalization. Bounds may also be the
+        name of another ToC metric, e.g. an internal variable holding a design/autosized value from the IDF, whose
+        value is read once at the first observation. Features without bounds are passed through unscaled.
+        :param normalization: 'bounds' for affine scaling to [0, 1], 'running' for running mean/variance
+        standardization, or None
+        :param time_encodings: list of cyclical (sin, cos) time encodings appended to the features, see
+        time_encodings_available
+        :param frame_stack: number of most recent frames stacked (oldest first) in the observation
+        :param update_stats: whether running statistics are updated at each observation (False to freeze them for
+        evaluation)
+        :param clip: clip 'running' standardized values to [-clip, clip]
+        """
+        if normalization not in ('bounds', 'running', None):
+            raise ValueError(f'ERROR: Normalization [{normalization}] must be "bounds", "running" or None.')
+        time_encodings = time_encodings if time_encodings is not None else []
+        for encoding in time_encodings:
+            if encoding not in self.time_encodings_available:
+                raise ValueError(f'ERROR: Time encoding [{encoding}] is not available, see '
+                                 f'{self.time_encodings_available}.')
+        for feature in features:
+            if feature not in bca.ems_type_dict:
+                raise ValueError(f'ERROR: The observation feature [{feature}] is not a metric of your EMS ToCs or an '
+                                 f'available timing metric.')
+
+        self.bca = bca
+        self.features = list(features)
+        self.bounds = bounds if bounds is not None else {}
+        self.normalization = normalization
+        self.time_encodings = time_encodings
+        self.frame_stack = frame_stack
+        self.update_stats = update_stats
+
+        self.n_features = len(self.features)
+        self.frame_size = self.n_features + 2 * len(self.time_encodings)
+        self.size = self.frame_size * frame_stack
+
+        # preallocated buffers
+        self.raw = np.zeros(self.n_features)
+        # frames are written twice, at i and i + frame_stack, so the last frame_stack frames are always contiguous
+        self._frames = np.zeros((2 * frame_stack, self.frame_size))
+        self._frame_i = 0
+        self._frames_seen = 0
+
+        self._data_lists = None  # bound at first observation, see _bind()
+        self.scaler = None
+        self.normalizer = RunningNormalizer(self.n_features, clip=clip) if normalization == 'running' else None
+
+    def _data_list(self, metric: str) -> list:
+        """Returns the data list attribute of the BcaEnv holding the tracked values of a metric."""
+
+        ems_type = self.bca.ems_type_dict[metric]
+        if ems_type == 'time':
+            return getattr(self.bca, metric)
+        return getattr(self.bca, 'data_' + ems_type + '_' + metric)
+
+    def _bind(self):
+        """Binds the data lists of all features once, and resolves the bounds of 'bounds' normalization."""
+
+        self._data_lists = [self._data_list(feature) for feature in self.features]
+        if self.normalization == 'bounds':
+            low, high = np.zeros(self.n_features), np.ones(self.n_features)
+            for i, feature in enumerate(self.features):
+                if feature in self.bounds:
+                    low[i], high[i] = [bound if not isinstance(bound, str) else self._data_list(bound)[-1]
+                                       for bound in self.bounds[feature]]
+            self.scaler = AffineScaler(low, high)
+
+    def reset(self):
+        """Clears stacked frames, e.g. before a new episode. Running statistics are kept."""
+
+        self._frames[:] = 0.0
+        self._frame_i = 0
+        self._frames_seen = 0
+
+    def observe(self, out: np.ndarray = None) -> np.ndarray:
+        """
+        Reads the most recent values of the features and returns the preprocessed observation.
+
+        :param out: optional array of size self.size to write the observation into
+        :return: the observation vector (a view of the internal buffer if out is None)
+        """
+        if self._data_lists is None:
+            self._bind()
+        raw = self.raw
+        for i, data_list in enumerate(self._data_lists):
+            raw[i] = data_list[-1]
+
+        stack = self.frame_stack
+        frame = self._frames[self._frame_i]  # frames are written at i and mirrored at i + frame_stack
+        features = frame[:self.n_features]
+        if self.normalization == 'bounds':
+            self.scaler(raw, features)
+        elif self.normalization == 'running':
+            if self.update_stats:
+                self.normalizer.update(raw)
+            self.normalizer(raw, features)
+        else:
+            features[:] = raw
+
+        if self.time_encodings:
+            self._encode_time(frame[self.n_features:])
+
+        if stack > 1:
+            i = self._frame_i
+            if self._frames_seen == 0:  # first frame of the episode, fill the stack with it
+                self._frames[:] = frame
+            else:
+                self._frames[i + stack] = frame
+            self._frames_seen += 1
+            self._frame_i = (i + 1) % stack
+            observation = self._frames[i + 1:i + 1 + stack].reshape(-1)  # oldest to newest frame
+        else:
+            observation = frame
+
+        if out is not None:
+            out[:] = observation.reshape(out.shape)
+            return out
+        return observation
+
+    def _encode_time(self, out: np.ndarray):
+        """Writes the (sin, cos) pairs of the cyclical time encodings of the current timestep to out."""
+
+        dt = self.bca.t_datetimes[-1]
+        for i, encoding in enumerate(self.time_encodings):
+            if encoding == 'hour_of_day':
+                angle = 2 * math.pi * (dt.hour + dt.minute / 60) / 24
+            elif encoding == 'day_of_week':
+                angle = 2 * math.pi * dt.weekday() / 7
+            else:  # day_of_year
+                angle = 2 * math.pi * (dt.timetuple().tm_yday - 1) / 365
+            out[2 * i] = math.sin(angle)
+            out[2 * i + 1] = math.cos(angle)
+
+    def get_stats(self, since_sync: bool = False) -> dict:
+        """Returns the running normalizer statistics, see RunningNormalizer.get_stats(), or None if not used."""
+
+        return self.normalizer.get_stats(since_sync) if self.normalizer is not None else None
+
+    def set_stats(self, stats: dict):
+        """Loads running normalizer statistics, e.g. merged by the learner from all workers."""
+
+        if self.normalizer is not None and stats is not None:
+            self.normalizer.set_stats(stats)
@@ -0,0 +1,171 @@
+"""
+Declarative reward specification over named EMS ToC metrics.
+
+A RewardSpec is a list of weighted terms (deviation from a target, comfort band violation, energy penalty, linear
+term) over ToC metrics, each assigned to an objective. Declared once next to the ToCs, it is compiled for a BcaEnv
+and then evaluated either:
+    - per step, compiled.step(), reading only the most recent value of each metric (fast path for callbacks), or
+    - in bulk, compiled.evaluate(), as NumPy expressions over the full tracked data at the end of the episode, which
+      is all that is needed for on-policy episodic training.
+
+    reward_spec = RewardSpec([
+        Deviation('zn0_temp', target=21, scale=17),
+        Penalty('air_loop_fan_electric_power', scale=3045.81),
+    ])
+    reward = reward_spec.compile(sim)
+    ...
+    rewards = reward.evaluate()  # [n_steps, n_objectives] float array, after the simulation
+"""
+
+import numpy as np
+
+
+class RewardTerm:
+    """A weighted reward term over one ToC metric, the reward of an objective is the sum of its terms."""
+
+    def __init__(self, metric: str, weight: float = 1.0, scale: float = 1.0, objective: int = 0):
+        """
+        :param metric: EMS ToC (or timing) metric name
+        :param weight: weight of the term in its objective
+        :param scale: the metric values are divided by scale (normalization)
+        :param objective: index of the objective the term contributes to, for multi-objective rewards
+        """
+        self.metric = metric
+        self.factor = weight / scale
+        self.objective = objective
+
+    def value(self, x: float) -> float:
+        """Term value for one metric value, per step."""
+        raise NotImplementedError
+
+    def values(self, x: np.ndarray) -> np.ndarray:
+        """Term values for an array of metric values, in bulk."""
+        raise NotImplementedError
+
+
+class Linear(RewardTerm):
+    """weight * x / scale"""
+
+    def value(self, x):
+        return self.factor * x
+
+    def values(self, x):
+        return self.factor * x
+
+
+class Penalty(RewardTerm):
+    """-weight * x / scale, e.g. energy or power use."""
+
+    def value(self, x):
+        return -self.factor * x
+
+    def values(self, x):
+        return -self.factor * x
+
+
+class Deviation(RewardTerm):
+    """-weight * |x - target| / scale, e.g. setpoint tracking."""
+
+    def __init__(self, metric: str, target: float, weight: float = 1.0, scale: float = 1.0, objective: int = 0):
+        super().__init__(metric, weight, scale, objective)
+        self.target = target
+
+    def value(self, x):
+        return -self.factor * abs(x - self.target)
+
+    def values(self, x):
+        return -self.factor * np.abs(x - self.target)
+
+
+class ComfortBand(RewardTerm):
+    """-weight * (distance of x outside of [low, high]) / scale, 0 inside the comfort band."""
+
+    def __init__(self, metric: str, low: float, high: float, weight: float = 1.0, scale: float = 1.0,
+                 objective: int = 0):
+        super().__init__(metric, weight, scale, objective)
+        self.low = low
+        self.high = high
+
+    def value(self, x):
+        if x < self.low:
+            return -self.factor * (self.low - x)
+        if x > self.high:
+            return -self.factor * (x - self.high)
+        return 0.0
+
+    def values(self, x):
+        return -self.factor * (np.maximum(self.low - x, 0.0) + np.maximum(x - self.high, 0.0))
+
+
+class RewardSpec:
+    """Declarative reward of weighted terms over ToC metrics, see module documentation."""
+
+    def __init__(self, terms: list):
+        if not terms:
+            raise ValueError('ERROR: A reward specification needs at least one term.')
+        self.terms = terms
+        self.n_objectives = max(term.objective for term in terms) + 1
+
+    def compile(self, bca) -> 'CompiledReward':
+        """Binds the spec to the tracked data of a BcaEnv (or EmsPy) instance."""
+
+        return CompiledReward(self, bca)
+
+
+class CompiledReward:
+    """A RewardSpec bound to the data lists of a BcaEnv, created by RewardSpec.compile()."""
+
+    def __init__(self, spec: RewardSpec, bca):
+        for term in spec.terms:
+            if term.metric not in bca.ems_type_dict:
+                raise ValueError(f'ERROR: The reward metric [{term.metric}] is not a metric of your EMS ToCs or an '
+                                 f'available timing metric.')
+        self.spec = spec
+        self.bca = bca
+        self.n_objectives = spec.n_objectives
+        self._data_lists = None  # bound at first use, data attributes may be replaced before the simulation runs
+        self._step_reward = [0.0] * self.n_objectives
+
+    def _data_list(self, metric: str) -> list:
+        ems_type = self.bca.ems_type_dict[metric]
+        if ems_type == 'time':
+            return getattr(self.bca, metric)
+        return getattr(self.bca, 'data_' + ems_type + '_' + metric)
+
+    def _bind(self):
+        self._data_lists = [(self._data_list(term.metric), term.value, term.objective) for term in self.spec.terms]
+
+    def step(self):
+        """
+        Returns the reward of the most recent timestep, a float (single objective) or a list (multi-objective).
+
+        This is the per step fast path, to return from an observation function.
+        """
+        if self._data_lists is None:
+            self._bind()
+        reward = self._step_reward
+        for i in range(self.n_objectives):
+            reward[i] = 0.0
+        for data_list, value, objective in self._data_lists:
+            reward[objective] += value(data_list[-1])
+        return reward[0] if self.n_objectives == 1 else list(reward)
+
+    def evaluate(self, rows=None) -> np.ndarray:
+        """
+        Returns the rewards of all tracked timesteps at once, computed in bulk over the full data arrays.
+
+        :param rows: optional indexes (or slice) of the tracked timesteps to return rewards for, e.g. only the steps
+        where the agent acted
+        :return: [n_steps, n_objectives] float array
+        """
+        arrays = {}
+        rewards = None
+        for term in self.spec.terms:
+            if term.metric not in arrays:
+                x = np.asarray(self._data_list(term.metric), dtype=float)
+                arrays[term.metric] = x if rows is None else x[rows]
+            values = term.values(arrays[term.metric])
+            if rewards is None:
+                rewards = np.zeros((values.shape[0], self.n_objectives))
+            rewards[:, term.objective] += values
+        return rewards
@@ -0,0 +1,231 @@
+"""
+RAM-backed run directories for EnergyPlus simulations, and the lifecycle of their outputs.
+
+Every simulation writes its outputs (and in the examples, a copy of the EnergyPlus installation) into a temporary run
+directory, which is deleted after the run. On disk this is a lot of I/O for files that are mostly never read. A
+RunDirectoryManager allocates the run directories on a tmpfs (/dev/shm by default) instead, within a quota, keeps
+selected artifacts (e.g. the .err file) of each run in a persistent directory, and deletes run directories on a
+background thread so that the next run does not wait for it.
+
+Each manager allocates under its own base directory, and each run gets its own directory in it, so concurrent workers
+(processes or threads) never share outputs. A default manager per process is returned by run_directories(), configured
+from environment variables so that worker processes inherit the configuration of the main process:
+
+    EPLUS_DRL_RUN_ROOT        root directory of the run directories, default /dev/shm if available
+    EPLUS_DRL_RUN_QUOTA_MB    maximum size of the run directories of a process on the root, default 4096
+    EPLUS_DRL_KEEP            comma separated file patterns kept from every run, default none
+    EPLUS_DRL_KEEP_FAILED     comma separated file patterns kept from failed runs, default *.err
+    EPLUS_DRL_KEEP_DIR        directory of the kept artifacts, default run_artifacts in the working directory
+"""
+
+import os
+import glob
+import queue
+import shutil
+import tempfile
+import threading
+import contextlib
+import multiprocessing.util
+
+default_root = '/dev/shm'
+
+
+def _directory_size(path: str) -> int:
+    """Returns the total size in bytes of the files in a directory tree."""
+
+    size = 0
+    for folder, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(folder, file)).st_size
+            except OSError:  # deleted meanwhile
+                pass
+    return size
+
+
+class RunDirectoryManager:
+    """
+    Allocates isolated run directories on a tmpfs, within a quota, and cleans them up asynchronously, e.g.:
+
+        manager = RunDirectoryManager(keep_failed=['*.err'])
+        with manager.run_dir('episode_3') as run_dir:
+            success = sim.run_env(weather_path, os.path.join(run_dir, 'out'))
+            manager.mark_failed(run_dir, not success)
+
+    If the quota of the root is exceeded (after waiting for the pending cleanups), or the root is not available, run
+    directories are allocated in the regular temporary directory (on disk) instead, with a note.
+    """
+
+    def __init__(self, root: str = None, quota_mb: float = 4096, min_free_mb: float = 256, keep: list = None,
+                 keep_failed: list = None, keep_dir: str = None, async_cleanup: bool = True):
+        """
+        :param root: tmpfs directory to allocate the run directories in, defaults to /dev/shm if it is writable
+        :param quota_mb: maximum total size of the live run directories of this manager on the root, in MB
+        :param min_free_mb: new run directories fall back to disk if the root has less free space (in MB)
+        :param keep: file name patterns (glob, searched in the whole run directory) of artifacts kept from every run
+        :param keep_failed: file name patterns of artifacts kept from failed runs, see mark_failed()
+        :param keep_dir: directory the kept artifacts are moved to, one sub directory per run, defaults to
+        'run_artifacts' in the current working directory
+        :param async_cleanup: delete released run directories on a background thread
+        """
+        if root is None:
+            root = default_root if os.path.isdir(default_root) and os.access(default_root, os.W_OK) else None
+        elif not os.path.isdir(root):
+            print(f'*NOTE: The run directory root [{root}] does not exist, using the temporary directory instead.')
+            root = None
+        self.root = root
+        self.quota_bytes = quota_mb * 1024 ** 2
+        self.min_free_bytes = min_free_mb * 1024 ** 2
+        self.keep = list(keep or [])
+        self.keep_failed = list(keep_failed or [])
+        self.keep_dir = os.path.abspath(keep_dir if keep_dir is not None else 'run_artifacts')
+        self.async_cleanup = async_cleanup
+        self.pid = os.getpid()
+
+        # base directories of this manager, isolated from other processes/managers
+        self.base_dir = tempfile.mkdtemp(prefix=f'eplus_drl_{self.pid}_', dir=root) if root is not None else None
+        self.fallback_dir = None  # on disk, created on first fallback
+        self._failed = set()
+        self._live = set()
+        self._lock = threading.Lock()
+        self._cleanup_queue = queue.Queue()
+        self._cleanup_thread = None
+        self.n_allocated = 0
+        self.n_fallbacks = 0
+        # at exit of the process, also of multiprocessing workers (which skip atexit)
+        multiprocessing.util.Finalize(self, RunDirectoryManager.close, args=(self,), exitpriority=10)
+
+    def _on_root(self, path: str) -> bool:
+        return self.base_dir is not None and path.startswith(self.base_dir + os.sep)
+
+    def usage(self) -> int:
+        """Returns the total size in bytes of the live run directories of this manager on the root."""
+
+        with self._lock:
+            live = [path for path in self._live if self._on_root(path)]
+        return sum(_directory_size(path) for path in live)
+
+    def _fits_quota(self) -> bool:
+        if self.base_dir is None:
+            return False
+        return self.usage() < self.quota_bytes and shutil.disk_usage(self.base_dir).free > self.min_free_bytes
+
+    def allocate(self, tag: str = 'run') -> str:
+        """Returns the path of a new, empty run directory, see release()."""
+
+        if not self._fits_quota():
+            self.flush()  # released directories may still be in the cleanup queue
+        if self._fits_quota():
+            parent = self.base_dir
+        else:
+            if self.base_dir is not None:
+                print(f'*NOTE: The run directory quota or free space on [{self.root}] is exceeded, allocating [{tag}] on '
+                      f'disk.')
+                self.n_fallbacks += 1
+            if self.fallback_dir is None:
+                self.fallback_dir = tempfile.mkdtemp(prefix=f'eplus_drl_{self.pid}_')
+            parent = self.fallback_dir
+        path = tempfile.mkdtemp(prefix=f'{tag}_', dir=parent)
+        with self._lock:
+            self._live.add(path)
+        self.n_allocated += 1
+        return path
+
+    def mark_failed(self, path: str, failed: bool = True):
+        """Marks the run of a run directory as failed, its keep_failed artifacts are kept at release()."""
+
+        with self._lock:
+            if failed:
+                self._failed.add(path)
+            else:
+                self._failed.discard(path)
+
+    def release(self, path: str, failed: bool = None) -> list:
+        """
+        Moves the artifacts to keep out of a run directory, then deletes it (in the background if async_cleanup).
+
+        :param failed: whether the run failed, defaults to what was set with mark_failed()
+        :return: list of the paths of the kept artifacts
+        """
+        with self._lock:
+            failed = path in self._failed if failed is None else failed
+            self._failed.discard(path)
+            self._live.discard(path)
+        patterns = self.keep + (self.keep_failed if failed else [])
+        kept = []
+        for pattern in patterns:
+            for artifact in glob.glob(os.path.join(path, '**', pattern), recursive=True):
+                destination = os.path.join(self.keep_dir, os.path.basename(path),
+                                           os.path.relpath(artifact, path))
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.move(artifact, destination)
+                kept.append(destination)
+        if self.async_cleanup:
+            if self._cleanup_thread is None or not self._cleanup_thread.is_alive():
+                self._cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
+                self._cleanup_thread.start()
+            self._cleanup_queue.put(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+        return kept
+
+    def _cleanup_loop(self):
+        while True:
+            path = self._cleanup_queue.get()
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+            finally:
+                self._cleanup_queue.task_done()
+
+    def flush(self):
+        """Waits until all released run directories are deleted."""
+
+        self._cleanup_queue.join()
+
+    @contextlib.contextmanager
+    def run_dir(self, tag: str = 'run'):
+        """Context manager of a run directory, released at exit, as failed if an exception was raised."""
+
+        path = self.allocate(tag)
+        failed = None
+        try:
+            yield path
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.release(path, failed)
+
+    def close(self):
+        """Releases all live run directories and deletes the base directories of this manager."""
+
+        if os.getpid() != self.pid:  # forked copy, the directories belong to the parent process
+            return
+        with self._lock:
+            live = list(self._live)
+        for path in live:
+            self.release(path)
+        self.flush()
+        for base_dir in (self.base_dir, self.fallback_dir):
+            if base_dir is not None:
+                shutil.rmtree(base_dir, ignore_errors=True)
+
+
+_process_manager = None
+
+
+def _patterns(variable: str, default: str) -> list:
+    return [pattern.strip() for pattern in os.environ.get(variable, default).split(',') if pattern.strip()]
+
+
+def run_directories() -> RunDirectoryManager:
+    """Returns the default RunDirectoryManager of the current process, configured from the environment variables."""
+
+    global _process_manager
+    if _process_manager is None or _process_manager.pid != os.getpid():
+        _process_manager = RunDirectoryManager(root=os.environ.get('EPLUS_DRL_RUN_ROOT'),
+                                               quota_mb=float(os.environ.get('EPLUS_DRL_RUN_QUOTA_MB', 4096)),
+                                               keep=_patterns('EPLUS_DRL_KEEP', ''),
+                                               keep_failed=_patterns('EPLUS_DRL_KEEP_FAILED', '*.err'),
+                                               keep_dir=os.environ.get('EPLUS_DRL_KEEP_DIR'))
+    return _process_manager
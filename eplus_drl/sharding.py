@@ -0,0 +1,238 @@
+"""
+Parallel run-period sharding for long evaluation simulations.
+
+A long RunPeriod (e.g. a full year) of a frozen control policy is split into contiguous shards (e.g. months), each
+shard is simulated in its own process with its own BcaEnv, starting some overlap (warmup) days before the shard begins
+so the building state (thermal mass, controllers) has settled when the shard's own period starts. The tracked data of
+all shards is then trimmed to their own period and stitched back into one continuous timeline.
+
+The overlap days are simulated by two shards, the difference between both over the overlap window is reported as the
+discontinuity error at each shard boundary.
+"""
+
+import os
+import time
+import datetime
+import multiprocessing
+
+import numpy as np
+
+from eplus_drl import idf
+from eplus_drl import EmsPy
+from eplus_drl.rundirs import run_directories
+
+
+class RunPeriodShard:
+    """One contiguous piece of a RunPeriod, simulated from sim_begin but only kept from begin to end (inclusive)."""
+
+    def __init__(self, index: int, sim_begin: datetime.date, begin: datetime.date, end: datetime.date):
+        self.index = index
+        self.sim_begin = sim_begin
+        self.begin = begin
+        self.end = end
+        self.idf_path = None
+
+    def __repr__(self):
+        return f'RunPeriodShard({self.index}, sim_begin={self.sim_begin}, begin={self.begin}, end={self.end})'
+
+
+def plan_run_period_shards(begin: datetime.date, end: datetime.date, n_shards: int = None,
+                           overlap_days: int = 7) -> list:
+    """
+    Splits the period from begin to end (inclusive) into contiguous shards.
+
+    :param begin: first day of the run period
+    :param end: last day of the run period
+    :param n_shards: number of shards of (almost) equal length, leave as None to shard by calendar month
+    :param overlap_days: number of days each shard is simulated before its own period begins, for warmup. Does not
+    reach before the original run period begin.
+    :return: list of RunPeriodShard in chronological order
+    """
+    if end < begin:
+        raise ValueError(f'ERROR: Run periods wrapping over the end of the year can not be sharded, '
+                         f'begin [{begin}] is after end [{end}].')
+    # shard boundaries, first day of each shard
+    if n_shards is None:
+        starts = [begin]
+        month_start = datetime.date(begin.year, begin.month, 1)
+        while True:
+            month_start = (month_start + datetime.timedelta(days=32)).replace(day=1)
+            if month_start > end:
+                break
+            starts.append(month_start)
+    else:
+        n_days = (end - begin).days + 1
+        if n_shards < 1 or n_shards > n_days:
+            raise ValueError(f'ERROR: The number of shards [{n_shards}] must be between 1 and the number of days of '
+                             f'the run period [{n_days}].')
+        starts = [begin + datetime.timedelta(days=int(d)) for d in np.linspace(0, n_days, n_shards, endpoint=False)]
+
+    shards = []
+    for i, shard_begin in enumerate(starts):
+        shard_end = starts[i + 1] - datetime.timedelta(days=1) if i + 1 < len(starts) else end
+        sim_begin = max(begin, shard_begin - datetime.timedelta(days=overlap_days))
+        shards.append(RunPeriodShard(i, sim_begin, shard_begin, shard_end))
+    return shards
+
+
+def _time_keys(datetimes) -> np.ndarray:
+    """Returns sortable month-day-hour-minute integer keys of datetimes, independent of the simulation year."""
+
+    import pandas as pd
+
+    dt = pd.to_datetime(pd.Series(datetimes))
+    return (dt.dt.month.to_numpy() * 1000000 + dt.dt.day.to_numpy() * 10000 +
+            dt.dt.hour.to_numpy() * 100 + dt.dt.minute.to_numpy())
+
+
+def _date_key(date: datetime.date) -> int:
+    """Returns the time key of midnight of a date, see _time_keys()."""
+
+    return date.month * 1000000 + date.day * 10000
+
+
+def _run_shard(env_factory, idf_path: str, weather_file_path: str, df_names: list):
+    """Process-pool task: builds a BcaEnv for the shard model, runs it and returns its dataframes and wall time."""
+
+    start_time = time.time()
+    env = env_factory(idf_path)
+    with run_directories().run_dir('shard') as run_dir:
+        if env.run_env(weather_file_path, os.path.join(run_dir, 'out')) != 0:
+            raise RuntimeError(f'ERROR: Simulation of shard model [{idf_path}] failed, see the error file kept in '
+                               f'[{run_directories().keep_dir}].')
+    dfs = env.get_df(df_names)
+    return dfs, time.time() - start_time
+
+
+class ShardedEvaluation:
+    """
+    Runs one long evaluation simulation as parallel run-period shards and stitches their data back together.
+
+    The env_factory must be a picklable (module-level) function taking the path of the shard .idf model and returning
+    a BcaEnv with its calling points, callback functions and custom dataframes already set, e.g.:
+
+        def make_env(idf_path):
+            sim = BcaEnv(ep_path, idf_path, 6, tc_vars, tc_intvars, tc_meters, tc_actuators, tc_weather)
+            agent = FrozenPolicyAgent(sim, model_path)
+            sim.set_calling_point_and_callback_function(...)
+            return sim
+
+        evaluation = ShardedEvaluation(make_env, idf_path, weather_path, overlap_days=7)
+        dfs = evaluation.run()
+        print(evaluation.boundary_report)
+    """
+
+    def __init__(self, env_factory, idf_path: str, weather_file_path: str, n_shards: int = None,
+                 overlap_days: int = 7, processes: int = None, work_dir: str = None, df_names: list = None,
+                 mp_context=None):
+        """
+        :param env_factory: module-level function(idf_path) -> BcaEnv, see class documentation
+        :param idf_path: the .idf model with the full RunPeriod to evaluate
+        :param weather_file_path: the .epw weather file, shared by all shards
+        :param n_shards: number of shards of equal length, leave as None to shard by calendar month
+        :param overlap_days: warmup days simulated before each shard's own period, also used to compute the boundary
+        discontinuity error
+        :param processes: number of parallel processes, defaults to the number of shards (capped to the CPU count)
+        :param work_dir: directory for the rewritten shard models, defaults to a temporary directory
+        :param df_names: dataframe names to collect from each shard (see BcaEnv.get_df), leave as None for all
+        :param mp_context: multiprocessing context of the shard processes, e.g. eplus_drl.workers.get_worker_context()
+        """
+        self.env_factory = env_factory
+        self.idf_path = idf_path
+        self.weather_file_path = weather_file_path
+        self.overlap_days = overlap_days
+        self.work_dir = work_dir if work_dir is not None else EmsPy.get_temp_run_dir()
+        self.df_names = df_names
+        self.mp_context = mp_context if mp_context is not None else multiprocessing
+
+        self.idf_text = idf.read_idf(idf_path)
+        begin, end = idf.get_run_period(self.idf_text)
+        self.shards = plan_run_period_shards(begin, end, n_shards, overlap_days)
+        self.processes = processes if processes is not None else min(len(self.shards), os.cpu_count() or 1)
+
+        # results
+        self.shard_dfs = []  # per shard, untrimmed dataframes
+        self.shard_times = []  # per shard, wall time in seconds
+        self.boundary_report = None
+
+    def write_shard_idfs(self) -> list:
+        """Writes one .idf model per shard with its RunPeriod rewritten, returns the list of model paths."""
+
+        for shard in self.shards:
+            shard_text = idf.set_run_period(self.idf_text, shard.sim_begin, shard.end)
+            tag = f'shard{shard.index}_{shard.sim_begin:%m%d}_{shard.end:%m%d}'
+            shard.idf_path = idf.write_idf(shard_text, idf.idf_variant_path(self.idf_path, self.work_dir, tag))
+        return [shard.idf_path for shard in self.shards]
+
+    def run(self) -> dict:
+        """
+        Runs all shards in parallel and returns the stitched dataframes, like BcaEnv.get_df().
+
+        The discontinuity error at each shard boundary is stored in the boundary_report attribute.
+        """
+        self.write_shard_idfs()
+        # one task per process, EnergyPlus does not free all memory between runs in the same process
+        with self.mp_context.Pool(processes=self.processes, maxtasksperchild=1) as pool:
+            results = pool.starmap(_run_shard, [(self.env_factory, shard.idf_path, self.weather_file_path,
+                                                 None if self.df_names is None else list(self.df_names))
+                                                for shard in self.shards])
+        self.shard_dfs = [dfs for dfs, _ in results]
+        self.shard_times = [wall_time for _, wall_time in results]
+        print(f'\n*NOTE: Ran [{len(self.shards)}] shards in [{self.processes}] processes, slowest shard took '
+              f'[{max(self.shard_times):.1f}]s, sum of all shards [{sum(self.shard_times):.1f}]s.\n')
+
+        self.boundary_report = self._boundary_report()
+        return self.stitch()
+
+    def stitch(self) -> dict:
+        """Trims each shard's dataframes to its own period and concatenates them into one continuous timeline."""
+
+        import pandas as pd
+
+        stitched = {}
+        for df_name in self.shard_dfs[0]:
+            pieces = []
+            for shard, dfs in zip(self.shards, self.shard_dfs):
+                df = dfs[df_name]
+                if shard.sim_begin < shard.begin and 'Datetime' in df:
+                    # midnight of the shard's first day is the last timestep of the previous (overlap) day
+                    df = df[_time_keys(df['Datetime']) > _date_key(shard.begin)]
+                pieces.append(df)
+            stitched[df_name] = pd.concat(pieces, ignore_index=True)
+        return stitched
+
+    def _boundary_report(self):
+        """
+        Compares the data of both shards simulating each overlap window.
+
+        :return: dataframe with, per boundary and numeric metric, the mean and max absolute error over the overlap
+        window and the absolute error at the last timestep before the boundary
+        """
+        import pandas as pd
+
+        rows = []
+        for prev_shard, shard, prev_dfs, dfs in zip(self.shards[:-1], self.shards[1:],
+                                                     self.shard_dfs[:-1], self.shard_dfs[1:]):
+            if shard.sim_begin == shard.begin:
+                continue  # no overlap simulated
+            prev_df, df = prev_dfs['all'], dfs['all']
+            lo, hi = _date_key(shard.sim_begin), _date_key(shard.begin)
+            prev_keys, keys = _time_keys(prev_df['Datetime']), _time_keys(df['Datetime'])
+            prev_window = prev_df[(prev_keys > lo) & (prev_keys <= hi)].assign(_key=prev_keys[(prev_keys > lo) &
+                                                                                              (prev_keys <= hi)])
+            window = df[(keys > lo) & (keys <= hi)].assign(_key=keys[(keys > lo) & (keys <= hi)])
+            merged = pd.merge(prev_window, window, on=['_key', 'Timestep'], suffixes=('_prev', '_next'))
+            if merged.empty:
+                continue
+            for column in prev_df.columns:
+                if column in ('Datetime', 'Timestep', 'Calling Point') or \
+                        not pd.api.types.is_numeric_dtype(prev_df[column]):
+                    continue
+                error = np.abs(merged[column + '_prev'].to_numpy(dtype=float) -
+                               merged[column + '_next'].to_numpy(dtype=float))
+                rows.append({'boundary': shard.begin, 'metric': column,
+                             'overlap_mean_abs_error': error.mean(),
+                             'overlap_max_abs_error': error.max(),
+                             'boundary_abs_error': error[-1]})
+        return pd.DataFrame(rows, columns=['boundary', 'metric', 'overlap_mean_abs_error', 'overlap_max_abs_error',
+                                           'boundary_abs_error'])
@@ -0,0 +1,261 @@
+"""
+Hyperparameter sweeps of many trials (e.g. A2C configurations) sharing one pool of EnergyPlus worker processes.
+
+Trials are proposed by random or grid search over a parameter space, and pruned early on partial training by
+asynchronous successive halving (ASHA): when a trial reaches a rung (a number of finished episodes, growing by a factor
+eta), it is only continued if its metric is in the top 1/eta of all trials that reached that rung so far. Decisions
+never wait for other trials, so worker slots stay busy: whenever an episode finishes, the freed slot is given to the
+next episode of any runnable trial, or to a new trial.
+
+The learners live in the sweep (main) process, only episodes run in the pool:
+
+    class MyTrial(SweepTrial):
+        def episode_args(self, episode): ...  # picklable arguments of the episode function, e.g. current weights
+        def update(self, episode, result): ...  # learn from the episode result, return the metric (higher is better)
+
+    space = {'learning_rate': LogUniform(1e-5, 1e-2), 'action_size': [5, 10, 20]}
+    sweep = SweepRunner(run_episode, MyTrial, random_search(space, n_trials=100, seed=0),
+                        AshaScheduler(min_budget=5, max_budget=135, eta=3), processes=32)
+    results = sweep.run()
+"""
+
+import os
+import csv
+import math
+import queue
+import itertools
+import multiprocessing
+
+import numpy as np
+
+
+class Uniform:
+    """Continuous uniform parameter distribution for random search."""
+
+    def __init__(self, low: float, high: float):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng: np.random.Generator):
+        return float(rng.uniform(self.low, self.high))
+
+
+class LogUniform(Uniform):
+    """Log-uniform parameter distribution for random search, e.g. for learning rates."""
+
+    def sample(self, rng: np.random.Generator):
+        return float(math.exp(rng.uniform(math.log(self.low), math.log(self.high))))
+
+
+class IntUniform(Uniform):
+    """Integer uniform parameter distribution (low and high included) for random search."""
+
+    def sample(self, rng: np.random.Generator):
+        return int(rng.integers(self.low, self.high + 1))
+
+
+def random_search(space: dict, n_trials: int, seed: int = None):
+    """
+    Yields n_trials random parameter dicts.
+
+    :param space: dict of parameter name -> list of choices, distribution (Uniform, LogUniform, IntUniform) or
+    constant value
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(n_trials):
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, Uniform):
+                params[name] = values.sample(rng)
+            elif isinstance(values, list):
+                params[name] = values[rng.integers(len(values))]
+            else:
+                params[name] = values
+        yield params
+
+
+def grid_search(space: dict):
+    """Yields the parameter dicts of every combination of the space, of parameter name -> list of choices (or constant)."""
+
+    for name, values in space.items():
+        if isinstance(values, Uniform):
+            raise ValueError(f'ERROR: Parameter [{name}] is a distribution, grid search needs a list of values.')
+    choices = [values if isinstance(values, list) else [values] for values in space.values()]
+    for combination in itertools.product(*choices):
+        yield dict(zip(space.keys(), combination))
+
+
+class AshaScheduler:
+    """Asynchronous successive halving, decides at each rung whether a trial continues, see module documentation."""
+
+    def __init__(self, min_budget: int, max_budget: int, eta: int = 3):
+        """
+        :param min_budget: episodes of the first rung
+        :param max_budget: episodes of a fully trained trial
+        :param eta: reduction factor, only the top 1/eta trials of each rung continue
+        """
+        if not 0 < min_budget <= max_budget or eta < 2:
+            raise ValueError(f'ERROR: ASHA needs 0 < min_budget [{min_budget}] <= max_budget [{max_budget}] and '
+                             f'eta [{eta}] >= 2.')
+        self.max_budget = max_budget
+        self.eta = eta
+        self.rungs = []  # episode budgets of the rungs, below max_budget
+        budget = min_budget
+        while budget < max_budget:
+            self.rungs.append(budget)
+            budget *= eta
+        self.rung_metrics = {budget: [] for budget in self.rungs}
+
+    def next_milestone(self, episodes: int) -> int:
+        """Returns the number of episodes at which the next decision is made for a trial having run episodes."""
+
+        for budget in self.rungs:
+            if budget > episodes:
+                return budget
+        return self.max_budget
+
+    def decide(self, budget: int, metric: float) -> bool:
+        """Records the metric of a trial reaching a rung, returns True if the trial continues."""
+
+        if budget not in self.rung_metrics:
+            return budget < self.max_budget
+        metrics = self.rung_metrics[budget]
+        metrics.append(metric)
+        n_continue = max(1, len(metrics) // self.eta)
+        return metric >= sorted(metrics, reverse=True)[n_continue - 1]
+
+
+class SweepTrial:
+    """One configuration of a sweep, base class to implement for the learner, see module documentation."""
+
+    def __init__(self, trial_id: int, params: dict):
+        self.trial_id = trial_id
+        self.params = params
+        self.status = 'running'  # running, completed, pruned or failed
+        self.episodes_submitted = 0
+        self.episodes_done = 0
+        self.metric = None
+
+    def episode_args(self, episode: int) -> tuple:
+        """Returns the picklable arguments of the episode function for the trial's next episode."""
+        raise NotImplementedError
+
+    def update(self, episode: int, result) -> float:
+        """Updates the learner with the result of an episode, returns the metric to maximize (e.g. average score)."""
+        raise NotImplementedError
+
+
+class SweepRunner:
+    """Runs the trials of a sweep on one shared process pool, see module documentation."""
+
+    def __init__(self, episode_function, trial_factory, param_iterator, scheduler: AshaScheduler,
+                 processes: int = None, episodes_in_flight: int = 1, results_path: str = None,
+                 mp_context=None, maxtasksperchild: int = 3):
+        """
+        :param episode_function: module-level function(*trial.episode_args(episode)) run in the pool, its return
+        value is given to trial.update()
+        :param trial_factory: function(trial_id, params) -> SweepTrial, e.g. the SweepTrial subclass
+        :param param_iterator: iterable of parameter dicts, see random_search() and grid_search()
+        :param scheduler: AshaScheduler deciding which trials continue
+        :param processes: number of worker processes, defaults to the CPU count
+        :param episodes_in_flight: maximum number of episodes of one trial running at the same time
+        :param results_path: optional CSV table of finished trials, one row per trial
+        :param mp_context: multiprocessing context of the pool, e.g. eplus_drl.workers.get_worker_context()
+        :param maxtasksperchild: episodes per worker process before it is replaced (E+ does not free all memory)
+        """
+        self.episode_function = episode_function
+        self.trial_factory = trial_factory
+        self.param_iterator = iter(param_iterator)
+        self.scheduler = scheduler
+        self.processes = processes if processes is not None else os.cpu_count() or 1
+        self.episodes_in_flight = episodes_in_flight
+        self.results_path = results_path
+        self.mp_context = mp_context if mp_context is not None else multiprocessing
+        self.maxtasksperchild = maxtasksperchild
+        self.trials = []
+        self._in_flight = {}  # trial id -> number of its episodes running
+        self._results = queue.Queue()  # (trial, episode, result, error) from the pool's result thread
+
+    def _next_trial(self):
+        """Returns a running trial with an episode to submit, or a new trial, or None."""
+
+        for trial in self.trials:
+            if trial.status == 'running' and self._in_flight[trial.trial_id] < self.episodes_in_flight and \
+                    trial.episodes_submitted < self.scheduler.next_milestone(trial.episodes_done):
+                return trial
+        params = next(self.param_iterator, None)
+        if params is None:
+            return None
+        trial = self.trial_factory(len(self.trials), params)
+        self.trials.append(trial)
+        self._in_flight[trial.trial_id] = 0
+        return trial
+
+    def _submit(self, pool, trial):
+        episode = trial.episodes_submitted
+        trial.episodes_submitted += 1
+        self._in_flight[trial.trial_id] += 1
+        pool.apply_async(self.episode_function, args=trial.episode_args(episode),
+                         callback=lambda result: self._results.put((trial, episode, result, None)),
+                         error_callback=lambda error: self._results.put((trial, episode, None, error)))
+
+    def _on_result(self, trial, episode, result, error):
+        self._in_flight[trial.trial_id] -= 1
+        if trial.status != 'running':
+            return
+        if error is not None:
+            trial.status = 'failed'
+            print(f'\n*NOTE: Trial [{trial.trial_id}] {trial.params} failed at episode [{episode}]: {error!r}\n')
+            self._write_trial(trial)
+            return
+        trial.metric = trial.update(episode, result)
+        trial.episodes_done += 1
+        milestone = self.scheduler.next_milestone(trial.episodes_done - 1)
+        if trial.episodes_done == milestone:
+            if milestone >= self.scheduler.max_budget:
+                trial.status = 'completed'
+            elif not self.scheduler.decide(milestone, trial.metric):
+                trial.status = 'pruned'
+            if trial.status != 'running':
+                print(f'*NOTE: Trial [{trial.trial_id}] {trial.status} after [{trial.episodes_done}] episodes, '
+                      f'metric [{trial.metric:.4f}], params {trial.params}')
+                self._write_trial(trial)
+
+    def _write_trial(self, trial):
+        if self.results_path is None:
+            return
+        row = {'trial_id': trial.trial_id, 'status': trial.status, 'episodes': trial.episodes_done,
+               'metric': trial.metric, **trial.params}
+        if os.path.dirname(self.results_path):
+            os.makedirs(os.path.dirname(self.results_path), exist_ok=True)
+        new_file = not os.path.exists(self.results_path)
+        with open(self.results_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(row.keys()))
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def run(self) -> list:
+        """
+        Runs trials until the parameter iterator is exhausted and all trials are completed, pruned or failed.
+
+        :return: list of rows (dicts) of all trials, best metric first
+        """
+        n_in_flight = 0
+        with self.mp_context.Pool(processes=self.processes, maxtasksperchild=self.maxtasksperchild) as pool:
+            while True:
+                # keep every worker slot busy
+                while n_in_flight < self.processes:
+                    trial = self._next_trial()
+                    if trial is None:
+                        break
+                    self._submit(pool, trial)
+                    n_in_flight += 1
+                if n_in_flight == 0:
+                    break
+                self._on_result(*self._results.get())
+                n_in_flight -= 1
+
+        rows = [{'trial_id': trial.trial_id, 'status': trial.status, 'episodes': trial.episodes_done,
+                 'metric': trial.metric, **trial.params} for trial in self.trials]
+        return sorted(rows, key=lambda row: -math.inf if row['metric'] is None else row['metric'], reverse=True)
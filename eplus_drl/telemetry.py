@@ -0,0 +1,214 @@
+"""
+Per-episode resource telemetry of EnergyPlus worker processes, and leak detection for worker recycling.
+
+Repeated EnergyPlus runs in one process grow its memory, since E+ does not free all its handles between runs. Instead
+of recycling workers after a fixed number of tasks, the memory of each worker is measured around every episode and
+workers are recycled once their RSS grows too fast (or too large), see eplus_drl.workers.RecyclingPool.
+
+    with EpisodeTelemetry(sim, episode=3):
+        sim.run_env(weather_path, output_dir)
+
+records, per episode: the RSS of the process before and after the run, the CPU time of the simulation split between
+EnergyPlus and the Python callbacks, the bytes read and written by the process, the wall time and the simulated hours.
+Records are collected per process (see pop_episode_records()) and sent to the coordinator along with the task results.
+
+Process statistics are read from /proc (Linux), with resource/os fallbacks elsewhere.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+_episode_records = []  # records of the episodes run in this process, not yet sent to the coordinator
+
+
+def _read_proc(path: str) -> dict:
+    values = {}
+    try:
+        with open(path, 'r') as proc_file:
+            for line in proc_file:
+                key, _, value = line.partition(':')
+                values[key.strip()] = value.split()[0] if value.split() else ''
+    except OSError:
+        pass
+    return values
+
+
+def process_stats() -> dict:
+    """
+    Returns resource statistics of the current process: 'rss' (bytes), 'cpu_time' (user + system seconds of all
+    threads), 'read_bytes' and 'write_bytes' (file I/O bytes, 0 if unavailable) and 'time' (perf_counter).
+    """
+    status = _read_proc('/proc/self/status')
+    if 'VmRSS' in status:
+        rss = int(status['VmRSS']) * 1024  # kB
+    else:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)  # peak
+    io = _read_proc('/proc/self/io')
+    times = os.times()
+    return {'rss': rss, 'cpu_time': times.user + times.system,
+            'read_bytes': int(io.get('rchar', 0)), 'write_bytes': int(io.get('wchar', 0)),
+            'time': time.perf_counter()}
+
+
+class EpisodeTelemetry:
+    """
+    Context manager recording the resources of one simulation (episode) of a BcaEnv, see module documentation.
+
+    The record is appended to the episode records of the process, and available as the record attribute.
+    """
+
+    def __init__(self, bca, episode=None):
+        self.bca = bca
+        self.episode = episode
+        self.record = None
+        self._before = None
+
+    def __enter__(self):
+        self._cpu_times = (self.bca.simulation_cpu_time, self.bca.callback_cpu_time)
+        self._before = process_stats()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        after = process_stats()
+        before = self._before
+        simulation_cpu_time = self.bca.simulation_cpu_time - self._cpu_times[0]
+        callback_cpu_time = self.bca.callback_cpu_time - self._cpu_times[1]
+        self.record = {
+            'pid': os.getpid(),
+            'episode': self.episode,
+            'failed': exc_type is not None or self.bca.simulation_success != 0,
+            'rss_before': before['rss'],
+            'rss_after': after['rss'],
+            'rss_growth': after['rss'] - before['rss'],
+            'cpu_time': after['cpu_time'] - before['cpu_time'],
+            'energyplus_cpu_time': simulation_cpu_time - callback_cpu_time,
+            'callback_cpu_time': callback_cpu_time,
+            'read_bytes': after['read_bytes'] - before['read_bytes'],
+            'write_bytes': after['write_bytes'] - before['write_bytes'],
+            'wall_time': after['time'] - before['time'],
+            'end_time': time.time(),  # wall clock, comparable between processes
+            'simulated_hours': self.bca.timestep_total_count * (self.bca.timestep_period or 0) / 60,
+            'timesteps_per_hour': self.bca.timestep_per_hour,
+        }
+        _episode_records.append(self.record)
+        return False
+
+
+def pop_episode_records() -> list:
+    """Returns and clears the episode records of this process not returned yet."""
+
+    records = list(_episode_records)
+    _episode_records.clear()
+    return records
+
+
+class LeakMonitor:
+    """
+    Decides when a worker process should be recycled, from the RSS measured after each of its tasks.
+
+    A worker is recycled when its RSS exceeds rss_limit_mb, or when the trend of its RSS (least squares slope over its
+    last `window` tasks) exceeds growth_limit_mb per task, or after max_tasks tasks.
+    """
+
+    def __init__(self, growth_limit_mb: float = 50, rss_limit_mb: float = None, window: int = 3, max_tasks: int = None):
+        """
+        :param growth_limit_mb: maximum RSS growth trend in MB per task
+        :param rss_limit_mb: maximum RSS of a worker in MB, None for no limit
+        :param window: number of most recent tasks the trend is fitted on, at least 2
+        :param max_tasks: maximum number of tasks per worker regardless of its memory, None for no limit
+        """
+        if window < 2:
+            raise ValueError(f'ERROR: The trend window must be at least 2 tasks, not [{window}].')
+        self.growth_limit_mb = growth_limit_mb
+        self.rss_limit_mb = rss_limit_mb
+        self.window = window
+        self.max_tasks = max_tasks
+        self.rss = {}  # worker -> list of RSS after each task, MB
+
+    def trend(self, worker) -> float:
+        """Returns the RSS growth trend of a worker in MB per task, 0 until it ran window tasks."""
+
+        rss = self.rss.get(worker, [])[-self.window:]
+        if len(rss) < self.window:
+            return 0.0
+        return float(np.polyfit(np.arange(len(rss)), rss, 1)[0])
+
+    def update(self, worker, rss_after: float) -> str:
+        """
+        Records the RSS (bytes) of a worker after a task, returns the reason to recycle it or None.
+        """
+        rss = self.rss.setdefault(worker, [])
+        rss.append(rss_after / 1024 ** 2)
+        if self.rss_limit_mb is not None and rss[-1] > self.rss_limit_mb:
+            return f'RSS {rss[-1]:.0f} MB above {self.rss_limit_mb:.0f} MB'
+        trend = self.trend(worker)
+        if trend > self.growth_limit_mb:
+            return f'RSS growing {trend:.1f} MB/task, above {self.growth_limit_mb:.1f} MB/task'
+        if self.max_tasks is not None and len(rss) >= self.max_tasks:
+            return f'{len(rss)} tasks'
+        return None
+
+    def forget(self, worker):
+        self.rss.pop(worker, None)
+
+
+def throughput_report(records: list, elapsed_time: float = None) -> list:
+    """
+    Summarizes episode records per worker process.
+
+    :param records: episode records, see EpisodeTelemetry
+    :param elapsed_time: elapsed wall time of the whole run in seconds, defaults to the span from the start of the first
+    episode to the end of the last one
+    :return: list of dicts, one per worker pid, with its number of episodes, simulated hours, wall time, throughput
+    (simulated hours per wall second), mean RSS growth per episode (MB), final RSS (MB), E+ and callback CPU shares,
+    and file I/O (MB), plus a last 'all' row over all workers (throughput over the elapsed wall time of the run)
+    """
+    rows = []
+    pids = sorted(set(record['pid'] for record in records))
+    for pid in pids + ['all']:
+        worker_records = [record for record in records if pid == 'all' or record['pid'] == pid]
+        if not worker_records:
+            continue
+        wall_time = sum(record['wall_time'] for record in worker_records)
+        simulated_hours = sum(record['simulated_hours'] for record in worker_records)
+        cpu_time = sum(record['energyplus_cpu_time'] + record['callback_cpu_time'] for record in worker_records)
+        row = {
+            'pid': pid,
+            'episodes': len(worker_records),
+            'failed': sum(record['failed'] for record in worker_records),
+            'simulated_hours': simulated_hours,
+            'wall_time': wall_time,
+            'throughput': simulated_hours / wall_time if wall_time > 0 else 0.0,
+            'mean_rss_growth_mb': float(np.mean([record['rss_growth'] for record in worker_records])) / 1024 ** 2,
+            'final_rss_mb': worker_records[-1]['rss_after'] / 1024 ** 2,
+            'energyplus_cpu_share': sum(r['energyplus_cpu_time'] for r in worker_records) / cpu_time if cpu_time else 0,
+            'callback_cpu_share': sum(r['callback_cpu_time'] for r in worker_records) / cpu_time if cpu_time else 0,
+            'io_mb': sum(record['read_bytes'] + record['write_bytes'] for record in worker_records) / 1024 ** 2,
+        }
+        rows.append(row)
+    if len(rows) > 1:
+        # workers run in parallel, but recycled ones one after the other: elapsed time, not the sum of the workers'
+        if elapsed_time is None:
+            elapsed_time = max(record['end_time'] for record in records) - \
+                min(record['end_time'] - record['wall_time'] for record in records)
+        rows[-1]['wall_time'] = elapsed_time
+        rows[-1]['throughput'] = rows[-1]['simulated_hours'] / elapsed_time if elapsed_time > 0 else 0.0
+        rows[-1]['final_rss_mb'] = float('nan')
+    return rows
+
+
+def format_throughput_report(rows: list) -> str:
+    """Formats the rows of throughput_report() as a text table."""
+
+    lines = [f"{'pid':>8} {'episodes':>8} {'failed':>6} {'sim h':>9} {'wall s':>9} {'sim h/s':>8} {'dRSS MB':>8} "
+             f"{'RSS MB':>8} {'E+ cpu':>7} {'py cpu':>7} {'I/O MB':>8}"]
+    for row in rows:
+        lines.append(f"{row['pid']:>8} {row['episodes']:>8} {row['failed']:>6} {row['simulated_hours']:>9.1f} "
+                     f"{row['wall_time']:>9.1f} {row['throughput']:>8.2f} {row['mean_rss_growth_mb']:>8.1f} "
+                     f"{row['final_rss_mb']:>8.0f} {row['energyplus_cpu_share']:>7.0%} "
+                     f"{row['callback_cpu_share']:>7.0%} {row['io_mb']:>8.1f}")
+    return '\n'.join(lines)
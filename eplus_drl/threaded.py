@@ -0,0 +1,177 @@
+"""
+Several EnergyPlus simulations on threads of one process, sharing one policy.
+
+The E+ API holds the whole simulation in a state object (each EmsPy/BcaEnv creates its own), and runs its C++ code
+without the GIL, so that several states can be simulated concurrently by threads of the same process. Compared to a
+pool of processes, torch, the model and all imports are loaded once, and the observations of all the simulations can
+be batched into a single forward pass of the policy:
+
+    runner = MultiStateRunner(batch_act, n_threads=8)
+    results = runner.run([functools.partial(run_episode, episode) for episode in range(32)])
+
+where batch_act([n, n_features] observations) returns n actions, and run_episode(episode, act) builds a BcaEnv whose
+actuation function calls act(observation), runs it and returns its result.
+
+Python callbacks still take the GIL, the speedup comes from the E+ work in between (and from the batched forward).
+"""
+
+import time
+import queue
+import logging
+import threading
+import traceback
+
+import numpy as np
+
+
+class BatchedPolicy:
+    """
+    Collects the observations of several simulation threads into one batch, for one policy forward pass.
+
+    A thread calling act() waits until every active thread submitted its observation, or at most max_wait seconds
+    (simulations are not in lockstep, e.g. during warmup or at the end of a run), then the last thread to arrive runs
+    batch_act on all the observations waiting and hands every thread its action.
+    """
+
+    def __init__(self, batch_act, n_threads: int, max_wait: float = 0.005, dtype=np.float32):
+        """
+        :param batch_act: function of a [n, ...] array of observations, returning n actions
+        :param n_threads: number of threads sharing the policy
+        :param max_wait: maximum time in seconds a thread waits for the others before a partial batch is run
+        :param dtype: dtype of the observation batch
+        """
+        self.batch_act = batch_act
+        self.n_threads = n_threads
+        self.max_wait = max_wait
+        self.dtype = dtype
+        self.condition = threading.Condition()
+        self.active = n_threads
+        self.observations = None  # [n_threads, ...] buffer, allocated at the first observation
+        self.pending = np.zeros(n_threads, dtype=bool)
+        self.ready = np.zeros(n_threads, dtype=bool)
+        self.actions = [None] * n_threads
+        self.n_forwards = 0
+        self.n_observations = 0
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.n_observations / self.n_forwards if self.n_forwards else 0.0
+
+    def act(self, index: int, observation):
+        """Returns the action of thread [index] for its observation, computed together with the other threads'."""
+
+        with self.condition:
+            if self.observations is None:
+                self.observations = np.zeros((self.n_threads,) + np.shape(observation), dtype=self.dtype)
+            self.observations[index] = observation
+            self.pending[index] = True
+            self.ready[index] = False
+            if self.pending.sum() >= self.active:
+                self._forward()
+            else:
+                deadline = time.perf_counter() + self.max_wait
+                while not self.ready[index]:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._forward()  # partial batch
+                        break
+                    self.condition.wait(remaining)
+            action = self.actions[index]
+        if isinstance(action, Exception):
+            raise action
+        return action
+
+    def leave(self, index: int):
+        """Thread [index] has no more simulation to run, the others no longer wait for it."""
+
+        with self.condition:
+            self.active -= 1
+            if self.pending.any() and self.pending.sum() >= self.active:
+                self._forward()
+
+    def _forward(self):
+        # condition lock held, the simulations of the other threads keep running meanwhile (GIL released by E+)
+        index = np.flatnonzero(self.pending)
+        try:
+            actions = self.batch_act(self.observations[index])
+        except Exception as e:
+            # handed to the waiting threads, which raise it in their callback
+            actions = [e] * len(index)
+            logging.error(f"Error in the batched policy forward: {traceback.format_exc()}")
+        for i, action in zip(index, actions):
+            self.actions[i] = action
+        self.pending[index] = False
+        self.ready[index] = True
+        self.n_forwards += 1
+        self.n_observations += len(index)
+        self.condition.notify_all()
+
+
+class MultiStateRunner:
+    """
+    Runs simulation tasks on n_threads threads of this process, see module documentation.
+
+    A task is a function task(act) that runs one simulation (e.g. builds a BcaEnv and calls run_env()) and returns
+    its result, act(observation) -> action being the batched policy, to call from its actuation function.
+    """
+
+    def __init__(self, batch_act=None, n_threads: int = 4, max_wait: float = 0.005):
+        """
+        :param batch_act: function of a [n, ...] array of observations returning n actions, see BatchedPolicy. Leave
+        as None if the tasks act on their own.
+        :param n_threads: number of simulations running at the same time
+        :param max_wait: maximum time in seconds a thread waits for the others to batch its observation
+        """
+        self.batch_act = batch_act
+        self.n_threads = n_threads
+        self.max_wait = max_wait
+        self.policy = None
+        self.errors = []
+        self.wall_time = None
+
+    def run(self, tasks: list) -> list:
+        """
+        Runs all tasks, n_threads at a time, and returns their results in the order of the tasks (None for the tasks
+        that failed, their tracebacks are kept in self.errors).
+        """
+        tasks = list(tasks)
+        n_threads = min(self.n_threads, len(tasks))
+        if n_threads == 0:
+            return []
+        self.policy = BatchedPolicy(self.batch_act, n_threads, self.max_wait) if self.batch_act is not None else None
+        self.errors = []
+        results = [None] * len(tasks)
+        todo = queue.Queue()
+        for i, task in enumerate(tasks):
+            todo.put((i, task))
+
+        def worker(index):
+            act = (lambda observation: self.policy.act(index, observation)) if self.policy is not None else None
+            try:
+                while True:
+                    try:
+                        i, task = todo.get_nowait()
+                    except queue.Empty:
+                        break
+                    try:
+                        results[i] = task(act)
+                    except Exception:
+                        error_message = f"Task [{i}] failed: {traceback.format_exc()}"
+                        logging.error(error_message)
+                        self.errors.append((i, error_message))
+            finally:
+                if self.policy is not None:
+                    self.policy.leave(index)
+
+        start_time = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(index,), name=f'eplus_state_{index}', daemon=True)
+                   for index in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wall_time = time.perf_counter() - start_time
+        if self.policy is not None:
+            logging.info(f"{len(tasks)} simulations on {n_threads} threads in {self.wall_time:.1f} s, "
+                         f"{self.policy.n_forwards} policy forwards of mean batch size {self.policy.mean_batch_size:.2f}")
+        return results
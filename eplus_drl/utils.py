@@ -13,9 +13,34 @@ def load_config(config_file='config.ini'):
         'number_of_episodes': config.getint('DEFAULT', 'number_of_episodes'),
         'eplus_verbose': config.getint('DEFAULT', 'eplus_verbose'),
         'state_size': tuple(map(int, config['DEFAULT']['state_size'].split(','))),
+        'observation_normalization': config.get('DEFAULT', 'observation_normalization', fallback='bounds'),
         'action_size': config.getint('DEFAULT', 'action_size'),
         'learning_rate': config.getfloat('DEFAULT', 'learning_rate'),
+        'trainer': config.get('DEFAULT', 'trainer', fallback='a2c'),
+        'gamma': config.getfloat('DEFAULT', 'gamma', fallback=0.99),
+        'gae_lambda': config.getfloat('DEFAULT', 'gae_lambda', fallback=0.95),
+        'ppo_epochs': config.getint('DEFAULT', 'ppo_epochs', fallback=10),
+        'ppo_minibatch_size': config.getint('DEFAULT', 'ppo_minibatch_size', fallback=256),
+        'ppo_clip': config.getfloat('DEFAULT', 'ppo_clip', fallback=0.2),
+        'ppo_target_kl': config.getfloat('DEFAULT', 'ppo_target_kl', fallback=0.02),
+        'ppo_entropy_coef': config.getfloat('DEFAULT', 'ppo_entropy_coef', fallback=0.01),
+        'ppo_episodes_per_update': config.getint('DEFAULT', 'ppo_episodes_per_update', fallback=1),
+        'a3c_max_staleness': config.getint('DEFAULT', 'a3c_max_staleness', fallback=8),
+        'a3c_lock_updates': config.getboolean('DEFAULT', 'a3c_lock_updates', fallback=False),
+        'episode_days': config.getint('DEFAULT', 'episode_days', fallback=0),
+        'episode_seed': config.getint('DEFAULT', 'episode_seed', fallback=0),
+        'recycle_rss_growth_mb': config.getfloat('DEFAULT', 'recycle_rss_growth_mb', fallback=50),
+        'recycle_rss_limit_mb': config.getfloat('DEFAULT', 'recycle_rss_limit_mb', fallback=0),
+        'fidelity_schedule': config.get('DEFAULT', 'fidelity_schedule', fallback=''),
+        'eval_every': config.getint('DEFAULT', 'eval_every', fallback=0),
+        'eval_processes': config.getint('DEFAULT', 'eval_processes', fallback=1),
+        'eval_weather_path': config.get('DEFAULT', 'eval_weather_path', fallback=''),
+        'eval_idf_file_name': config.get('DEFAULT', 'eval_idf_file_name', fallback=''),
+        'checkpoint_dir': config.get('DEFAULT', 'checkpoint_dir', fallback='Models/checkpoints'),
         'model_path': config['DEFAULT']['model_path'],
+        'numpy_inference': config.getboolean('DEFAULT', 'numpy_inference', fallback=False),
+        'experience_archive_path': config.get('DEFAULT', 'experience_archive_path', fallback=''),
+        'catalog_path': config.get('DEFAULT', 'catalog_path', fallback=''),
         'queue_size_max' : config.getint('DEFAULT', 'queue_size_max'),
         'show_plots' : config.getboolean('DEFAULT', 'show_plots')
     }
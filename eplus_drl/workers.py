@@ -0,0 +1,203 @@
+"""
+Fast startup of worker processes running EnergyPlus episodes.
+
+Importing torch, numpy and pyenergyplus (and loading the EnergyPlus shared library) takes seconds. With a plain
+process pool (and maxtasksperchild, needed since E+ does not free all memory between runs) this cost is paid again by
+every new worker process. get_worker_context() returns a 'forkserver' multiprocessing context whose server process
+imports these modules once; every worker is then forked, ready, from that preloaded server.
+
+    ctx = get_worker_context(config['ep_path'], preload=['torch', 'eplus_manager'])
+    manager = ctx.Manager()
+    with ctx.Pool(processes=n, maxtasksperchild=3) as pool:
+        ...
+
+RecyclingPool replaces maxtasksperchild by recycling each worker when its own memory grows too fast, from the resource
+telemetry of its tasks (see eplus_drl.telemetry).
+"""
+
+import os
+import sys
+import time
+import queue
+import multiprocessing
+
+default_preload = ['numpy', 'eplus_drl', 'eplus_drl._energyplus_preload']
+
+
+def get_worker_context(ep_path: str, preload: list = None, start_method: str = 'forkserver'):
+    """
+    Returns a multiprocessing context whose worker processes start with E+ and the given modules already imported.
+
+    :param ep_path: absolute path to the EnergyPlus installation, holding the pyenergyplus package
+    :param preload: extra modules (e.g. 'torch', or the modules of your agent/policy) imported once by the fork
+    server, on top of numpy, eplus_drl and the EnergyPlus API
+    :param start_method: 'forkserver' (preloaded, default), or 'fork'/'spawn' to compare, see benchmarks
+    :return: multiprocessing context, use its Pool(), Process(), Manager() and Queue()
+    """
+    # the fork server is started with the sys.path of this process, so it can import pyenergyplus
+    if ep_path not in sys.path:
+        sys.path.insert(0, ep_path)
+    os.environ['EPLUS_DRL_EP_PATH'] = ep_path  # read by eplus_drl._energyplus_preload in the fork server
+
+    ctx = multiprocessing.get_context(start_method)
+    if start_method == 'forkserver':
+        ctx.set_forkserver_preload(default_preload + [module for module in (preload or [])
+                                                      if module not in default_preload])
+    return ctx
+
+
+def worker_startup_time(modules: list) -> dict:
+    """
+    Process task used to measure worker startup: imports the given modules and reports how long it took.
+
+    :return: dict with the pid, import time in seconds and the modules that were already imported before the call
+    """
+    start_time = time.perf_counter()
+    preloaded = [module for module in modules if module in sys.modules]
+    for module in modules:
+        __import__(module)
+    return {'pid': os.getpid(), 'import_time': time.perf_counter() - start_time, 'preloaded': preloaded}
+
+
+def _recycling_worker(worker_id: int, tasks, results, retire, running):
+    """Worker loop of RecyclingPool: runs tasks until a None task or until the coordinator retires the worker."""
+
+    from eplus_drl import telemetry
+
+    while not retire.is_set():
+        task = tasks.get()
+        if task is None:
+            break
+        index, function, args = task
+        running.value = index  # shared memory, still readable by the coordinator if this process dies
+        before = telemetry.process_stats()
+        try:
+            result, error = function(*args), None
+        except Exception as e:
+            result, error = None, f'{type(e).__name__}: {e}'
+        after = telemetry.process_stats()
+        stats = {'pid': os.getpid(), 'rss_before': before['rss'], 'rss_after': after['rss'],
+                 'cpu_time': after['cpu_time'] - before['cpu_time'], 'wall_time': after['time'] - before['time'],
+                 'episodes': telemetry.pop_episode_records()}
+        results.put((worker_id, index, result, error, stats))
+        running.value = -1
+
+
+class RecyclingPool:
+    """
+    Process pool recycling each worker when its memory leaks, instead of after a fixed number of tasks.
+
+    After every task, the worker sends its result along with its RSS and the episode records of the task (see
+    eplus_drl.telemetry.EpisodeTelemetry). The coordinator feeds the RSS to a LeakMonitor, and retires the workers it
+    flags once their current task is done, starting a fresh worker in their place:
+
+        with RecyclingPool(ctx, processes=4, monitor=LeakMonitor(growth_limit_mb=50)) as pool:
+            for result in pool.imap_unordered(run_episode, [(episode,) for episode in range(100)]):
+                ...
+        print(format_throughput_report(throughput_report(pool.episode_records)))
+
+    Functions and arguments must be picklable, as for multiprocessing pools. A task raising an exception (or whose
+    worker died) yields None, its error is kept in the errors attribute as (task index, message).
+    """
+
+    def __init__(self, ctx=None, processes: int = None, monitor=None):
+        """
+        :param ctx: multiprocessing context, e.g. get_worker_context(), defaults to the multiprocessing module
+        :param processes: number of worker processes, defaults to the CPU count
+        :param monitor: eplus_drl.telemetry.LeakMonitor deciding when workers are recycled, defaults to LeakMonitor()
+        """
+        from eplus_drl.telemetry import LeakMonitor
+
+        self.ctx = ctx if ctx is not None else multiprocessing
+        self.processes = processes if processes is not None else (os.cpu_count() or 1)
+        self.monitor = monitor if monitor is not None else LeakMonitor()
+        self._tasks = self.ctx.Queue()
+        self._results = self.ctx.Queue()
+        self._workers = {}  # worker id -> (process, retire event, index of the task it is running or -1)
+        self._next_worker_id = 0
+        self.errors = []
+        self.episode_records = []  # episode records of all tasks, see eplus_drl.telemetry
+        self.task_stats = []  # per task resource statistics of the worker process
+        self.recycled = []  # (worker pid, reason)
+
+    def _start_worker(self):
+        retire = self.ctx.Event()
+        running = self.ctx.Value('l', -1, lock=False)
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        process = self.ctx.Process(target=_recycling_worker,
+                                   args=(worker_id, self._tasks, self._results, retire, running), daemon=True)
+        process.start()
+        self._workers[worker_id] = (process, retire, running)
+
+    def _check_workers(self, n_remaining: int):
+        """Replaces the workers that exited (retired or died), while tasks remain."""
+
+        for worker_id, (process, retire, running) in list(self._workers.items()):
+            if process.is_alive():
+                continue
+            del self._workers[worker_id]
+            self.monitor.forget(worker_id)
+            if running.value != -1:  # died during a task, e.g. out of memory
+                self.errors.append((running.value, f'Worker process {process.pid} died with exit code '
+                                                   f'{process.exitcode}'))
+                yield running.value
+            if n_remaining > 0:
+                self._start_worker()
+
+    def imap_unordered(self, function, tasks):
+        """
+        Runs function(*args) for each args tuple of tasks on the workers, yields the results as they complete.
+        """
+        tasks = list(tasks)
+        for index, args in enumerate(tasks):
+            self._tasks.put((index, function, tuple(args)))
+        while len(self._workers) < min(self.processes, len(tasks)):
+            self._start_worker()
+
+        remaining = set(range(len(tasks)))
+        while remaining:
+            try:
+                worker_id, index, result, error, stats = self._results.get(timeout=1)
+            except queue.Empty:
+                for lost_index in list(self._check_workers(len(remaining))):
+                    if lost_index in remaining:
+                        remaining.discard(lost_index)
+                        yield None
+                continue
+            if index not in remaining:  # already reported lost, its worker died right after sending it
+                continue
+            remaining.discard(index)
+            if error is not None:
+                self.errors.append((index, error))
+            self.episode_records.extend(stats.pop('episodes'))
+            self.task_stats.append(stats)
+            reason = self.monitor.update(worker_id, stats['rss_after'])
+            if reason is not None and worker_id in self._workers and not self._workers[worker_id][1].is_set():
+                self._workers[worker_id][1].set()
+                self.recycled.append((stats['pid'], reason))
+                print(f'*NOTE: Recycling worker process {stats["pid"]}: {reason}.')
+            yield result
+            for lost_index in list(self._check_workers(len(remaining))):
+                if lost_index in remaining:
+                    remaining.discard(lost_index)
+                    yield None
+
+    def close(self):
+        """Stops all workers, once they finished their current task."""
+
+        for _ in self._workers:
+            self._tasks.put(None)
+        for process, _, _ in self._workers.values():
+            process.join()
+        self._workers.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            for process, _, _ in self._workers.values():
+                process.terminate()
+        self.close()
+        return False
@@ -0,0 +1,89 @@
+"""
+Observation-only simulation: Python callbacks at every zone timestep (run_env) versus callback-free bulk harvesting
+from the SQLite output (run_env_bulk), with the ToC of examples/rl_ventilation_control/no_actuation_simulation.py.
+
+Reports the wall time of both runs (simulation plus loading of the data) and the differences between the data of both
+on the timesteps they share (HVAC variables are averaged over the system timesteps in the outputs).
+
+Usage: python bulk_harvesting.py ep_path idf_path epw_path
+"""
+import os
+import sys
+import time
+import numpy as np
+from eplus_drl import BcaEnv
+
+ep_path = sys.argv[1] if len(sys.argv) > 1 else '/usr/local/EnergyPlus-22-1-0'
+idf_path = sys.argv[2] if len(sys.argv) > 2 else '../rl_ventilation_control/BEMFiles/sdu_damper_all_rooms.idf'
+epw_path = sys.argv[3] if len(sys.argv) > 3 else '../rl_ventilation_control/BEMFiles/DNK_Jan_Feb.epw'
+tc_vars = {
+    'zn0_temp': ('Zone Air Temperature', 'Thermal Zone 1'),
+    'air_loop_fan_mass_flow_var': ('Fan Air Mass Flow Rate', 'FANSYSTEMMODEL VAV'),
+    'air_loop_fan_electric_power': ('Fan Electricity Rate', 'FANSYSTEMMODEL VAV'),
+    're_heating_vav_coil_htgrate': ('Heating Coil Heating Rate', 'Changeover Bypass HW Rht Coil'),
+    'pre_heating_coil_htgrate': ('Heating Coil Heating Rate', 'HW Htg Coil'),
+    'vav_mass_flow_rate': ('System Node Mass Flow Rate', 'CHANGEOVER BYPASS HW RHT DAMPER OUTLET NODE'),
+    'vav_damper_position': ('Zone Air Terminal VAV Damper Position', 'CHANGEOVER BYPASS HW RHT'),
+    'vav_outdoor_flow_rate': ('Zone Air Terminal Outdoor Air Volume Flow Rate', 'CHANGEOVER BYPASS HW RHT'),
+    'ppd': ('Zone Thermal Comfort Fanger Model PPD',
+            'THERMAL ZONE 1 189.1-2009 - OFFICE - WHOLEBUILDING - MD OFFICE - CZ4-8 PEOPLE'),
+    'pmv': ('Zone Thermal Comfort Fanger Model PMV',
+            'THERMAL ZONE 1 189.1-2009 - OFFICE - WHOLEBUILDING - MD OFFICE - CZ4-8 PEOPLE'),
+    'deck_temp': ('System Node Temperature', 'Node 30'),
+    'post_deck_temp': ('System Node Temperature', 'Node 13'),
+}
+tc_weather = {
+    'oa_rh': ('outdoor_relative_humidity'),
+    'oa_db': ('outdoor_dry_bulb'),
+    'oa_pa': ('outdoor_barometric_pressure'),
+    'rain': ('is_raining'),
+    'wind_dir': ('wind_direction'),
+    'wind_speed': ('wind_speed'),
+}
+
+
+def make_env():
+    return BcaEnv(ep_path, idf_path, 6, tc_vars, {}, {}, {}, tc_weather)
+
+
+def run_callbacks():
+    sim = make_env()
+    sim.set_calling_point_and_callback_function(BcaEnv.available_calling_points[7], None, None, True, 1, 1)
+    sim.run_env(epw_path, os.path.join(BcaEnv.get_temp_run_dir(), 'out'))
+    return sim, sim.get_df()['all']
+
+
+def run_bulk():
+    sim = make_env()
+    sim.run_env_bulk(epw_path, os.path.join(BcaEnv.get_temp_run_dir(), 'out'))
+    return sim, sim.get_df()['all']
+
+
+def timed(run):
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    stdout = os.dup(1)
+    os.dup2(devnull, 1)
+    try:
+        start_time = time.perf_counter()
+        sim, df = run()
+        wall_time = time.perf_counter() - start_time
+    finally:
+        os.dup2(stdout, 1)
+        os.close(stdout)
+        os.close(devnull)
+    return sim, df, wall_time
+
+
+if __name__ == '__main__':
+    _, df_callbacks, time_callbacks = timed(run_callbacks)
+    _, df_bulk, time_bulk = timed(run_bulk)
+    print(f' callbacks: {len(df_callbacks):7d} rows in {time_callbacks:7.2f} s')
+    print(f'      bulk: {len(df_bulk):7d} rows in {time_bulk:7.2f} s ({time_callbacks / time_bulk:.2f}x faster)\n')
+
+    # callbacks also run during sizing and warmup, compare on the run period timesteps of the bulk data
+    merged = df_bulk.drop_duplicates('Datetime', keep='last').merge(
+        df_callbacks.drop_duplicates('Datetime', keep='last'), on='Datetime', suffixes=('_bulk', '_callbacks'))
+    print(f'{len(merged)} shared timesteps, differences bulk - callbacks:')
+    for metric in list(tc_vars) + list(tc_weather):
+        difference = merged[metric + '_bulk'].to_numpy() - merged[metric + '_callbacks'].to_numpy()
+        print(f'{metric:>28}: mean abs {np.mean(np.abs(difference)):10.4f} | max abs {np.max(np.abs(difference)):10.4f}')
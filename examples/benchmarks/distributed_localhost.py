@@ -0,0 +1,74 @@
+"""
+Localhost test of the distributed rollout protocol (eplus_drl.distributed), with a stub episode instead of EnergyPlus.
+
+Starts a RolloutServer and several RolloutWorker processes on this machine. The learner broadcasts new weights after
+every episode; meanwhile one worker is killed (connection lost) and another frozen (missed heartbeats). Checks that every
+episode is received exactly once despite the dead workers, and reports the episode throughput and payload size.
+
+Usage: python distributed_localhost.py [n_episodes] [n_workers] [slots]
+"""
+import os
+import sys
+import time
+import signal
+import multiprocessing
+import numpy as np
+from eplus_drl.distributed import RolloutServer, RolloutWorker, encode_message, EPISODE
+
+n_episodes = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+slots = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+n_steps, state_size, action_size = 8640, 9, 10  # a 2 month episode at 10 min timesteps
+
+
+def stub_episode(episode, weights, version):
+    # stands in for Energyplus_manager.run_episode() with the received policy weights
+    rng = np.random.default_rng(episode)
+    time.sleep(rng.uniform(0.05, 0.2))
+    states = rng.random((n_steps, state_size), dtype=np.float32)
+    actions = np.eye(action_size, dtype=np.float32)[rng.integers(action_size, size=n_steps)]
+    rewards = -rng.random(n_steps)
+    return {'states': states, 'actions': actions, 'rewards': rewards}, {'pid': os.getpid(),
+                                                                        'weights_sum': float(weights['w'].sum())}
+
+
+def run_worker(port):
+    RolloutWorker('127.0.0.1', port, stub_episode, slots=slots, heartbeat_interval=0.5).run()
+
+
+if __name__ == '__main__':
+    server = RolloutServer('127.0.0.1', 0, heartbeat_timeout=2.0).start()
+    server.broadcast_weights({'w': np.zeros((512, 9), dtype=np.float32)})
+    workers = [multiprocessing.Process(target=run_worker, args=(server.address[1],)) for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+
+    start_time = time.perf_counter()
+    server.submit(range(n_episodes))
+    received = []
+    while len(received) < n_episodes:
+        experience = server.get_episode(timeout=60)
+        if 'error' in experience:
+            raise RuntimeError(experience['error'])
+        received.append(experience['episode'])
+        # learner update, then broadcast the new weights
+        server.broadcast_weights({'w': np.full((512, 9), len(received), dtype=np.float32)})
+        if len(received) == n_episodes // 4 and n_workers > 1:
+            os.kill(workers[0].pid, signal.SIGKILL)  # dies, connection lost
+            os.kill(workers[1].pid, signal.SIGSTOP)  # hangs, heartbeats missed
+            print('Killed one worker and froze another')
+    wall_time = time.perf_counter() - start_time
+
+    assert sorted(received) == list(range(n_episodes)), 'episodes lost or duplicated'
+    payload = len(encode_message(EPISODE, {'episode': 0}, stub_episode(0, {'w': np.zeros(1)}, 0)[0]))
+    print(f'All {n_episodes} episodes received exactly once in {wall_time:.2f} s '
+          f'({n_episodes / wall_time:.1f} episodes/s), last weights version {server.version}, '
+          f'episode payload {payload / 1e6:.2f} MB')
+
+    server.close()
+    if n_workers > 1:
+        os.kill(workers[1].pid, signal.SIGCONT)
+    for worker in workers:
+        worker.join(timeout=5)
+        if worker.is_alive():
+            worker.terminate()
@@ -0,0 +1,49 @@
+"""
+Speedup of coarse simulation timesteps (eplus_drl.fidelity): runs the same observation-only simulation of the
+ventilation model at several Timesteps per hour, and reports the throughput (simulated hours per wall second) and
+speedup of each level relative to the finest one.
+
+Usage: python fidelity_speedup.py ep_path idf_path epw_path [timesteps,...]
+"""
+import os
+import sys
+from eplus_drl import BcaEnv
+from eplus_drl.fidelity import FidelityController, FidelitySchedule, speedup_report, format_speedup_report
+from eplus_drl.telemetry import EpisodeTelemetry
+
+ep_path = sys.argv[1] if len(sys.argv) > 1 else '/usr/local/EnergyPlus-22-1-0'
+idf_path = sys.argv[2] if len(sys.argv) > 2 else '../rl_ventilation_control/BEMFiles/sdu_damper_all_rooms.idf'
+epw_path = sys.argv[3] if len(sys.argv) > 3 else '../rl_ventilation_control/BEMFiles/DNK_Jan_Feb.epw'
+levels = [int(timesteps) for timesteps in (sys.argv[4] if len(sys.argv) > 4 else '6,4,2,1').split(',')]
+tc_vars = {
+    'zn0_temp': ('Zone Air Temperature', 'Thermal Zone 1'),
+    'air_loop_fan_electric_power': ('Fan Electricity Rate', 'FANSYSTEMMODEL VAV'),
+    'ppd': ('Zone Thermal Comfort Fanger Model PPD',
+            'THERMAL ZONE 1 189.1-2009 - OFFICE - WHOLEBUILDING - MD OFFICE - CZ4-8 PEOPLE'),
+}
+tc_weather = {'oa_db': ('outdoor_dry_bulb')}
+
+
+def run_level(fidelity, episode):
+    model_path, timesteps = fidelity.model(episode)
+    sim = BcaEnv(ep_path, model_path, timesteps, tc_vars, {}, {}, {}, tc_weather)
+    sim.set_calling_point_and_callback_function(BcaEnv.available_calling_points[7], None, None, True,
+                                                fidelity.frequency(1, timesteps), fidelity.frequency(1, timesteps))
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    stdout = os.dup(1)
+    os.dup2(devnull, 1)
+    try:
+        with EpisodeTelemetry(sim, episode) as telemetry:
+            sim.run_env(epw_path, os.path.join(BcaEnv.get_temp_run_dir(), 'out'))
+    finally:
+        os.dup2(stdout, 1)
+        os.close(stdout)
+        os.close(devnull)
+    return telemetry.record
+
+
+if __name__ == '__main__':
+    # one level per episode, finest first
+    fidelity = FidelityController(idf_path, FidelitySchedule(list(enumerate(sorted(levels, reverse=True)))))
+    records = [run_level(fidelity, episode) for episode in range(len(levels))]
+    print(format_speedup_report(speedup_report(records)))
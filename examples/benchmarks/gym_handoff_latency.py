@@ -0,0 +1,90 @@
+"""
+Per-step handoff latency of BcaGymEnv (eplus_drl.gym_env): the ventilation model is run once with its agent in the
+actuation callback (run_env), and once driven by env.step() from the main thread, with the same constant action.
+
+Reports the latency of both handoffs of a step in microseconds (simulation thread -> caller at each callback, and
+caller -> simulation thread at each step()), and the wall time per step of both runs.
+
+Usage: python gym_handoff_latency.py ep_path idf_path epw_path
+"""
+import os
+import sys
+import time
+from eplus_drl import BcaEnv
+from eplus_drl.gym_env import BcaGymEnv
+from eplus_drl.rundirs import run_directories
+
+ep_path = sys.argv[1] if len(sys.argv) > 1 else '/usr/local/EnergyPlus-22-1-0'
+idf_path = sys.argv[2] if len(sys.argv) > 2 else '../rl_ventilation_control/BEMFiles/sdu_damper_all_rooms.idf'
+epw_path = sys.argv[3] if len(sys.argv) > 3 else '../rl_ventilation_control/BEMFiles/DNK_Jan_Feb.epw'
+tc_vars = {
+    'zn0_temp': ('Zone Air Temperature', 'Thermal Zone 1'),
+    'air_loop_fan_electric_power': ('Fan Electricity Rate', 'FANSYSTEMMODEL VAV'),
+}
+tc_actuators = {'fan_mass_flow_act': ('Fan', 'Fan Air Mass Flow Rate', 'FANSYSTEMMODEL VAV')}
+
+
+def make_env():
+    return BcaEnv(ep_path, idf_path, 6, tc_vars, {}, {}, tc_actuators, {})
+
+
+def observe(sim):
+    return [sim.data_var_zn0_temp[-1], sim.data_var_air_loop_fan_electric_power[-1]]
+
+
+def actuate(action):
+    return {'fan_mass_flow_act': action}
+
+
+def silenced(run):
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    stdout = os.dup(1)
+    os.dup2(devnull, 1)
+    try:
+        return run()
+    finally:
+        os.dup2(stdout, 1)
+        os.close(stdout)
+        os.close(devnull)
+
+
+def run_callbacks():
+    sim = make_env()
+    steps = []
+
+    def actuation_function():
+        observe(sim)
+        steps.append(None)
+        return actuate(1.0)
+
+    sim.set_calling_point_and_callback_function(BcaEnv.available_calling_points[7], None, actuation_function, True)
+    with run_directories().run_dir('callbacks') as run_dir:
+        start_time = time.perf_counter()
+        sim.run_env(epw_path, os.path.join(run_dir, 'out'))
+        return len(steps), time.perf_counter() - start_time
+
+
+def run_gym():
+    env = BcaGymEnv(make_env, epw_path, observe, actuate, record_latency=True)
+    start_time = time.perf_counter()
+    env.reset()
+    n_steps = 0
+    while True:
+        _, _, terminated, truncated, _ = env.step(1.0)
+        n_steps += 1
+        if terminated or truncated:
+            break
+    wall_time = time.perf_counter() - start_time
+    env.close()
+    return n_steps, wall_time, env.latency_stats()
+
+
+if __name__ == '__main__':
+    silenced(run_callbacks)  # warm-up, the first run also loads the E+ library and pandas
+    callback_steps, callback_time = silenced(run_callbacks)
+    gym_steps, gym_time, latency = silenced(run_gym)
+    print(f'callbacks: {callback_steps:7d} steps, {callback_time / callback_steps * 1e6:8.1f} us/step')
+    print(f'      gym: {gym_steps:7d} steps, {gym_time / gym_steps * 1e6:8.1f} us/step\n')
+    for direction, stats in latency.items():
+        print(f'handoff {direction:>8}: mean {stats["mean"]:7.1f} us | p50 {stats["p50"]:7.1f} us | '
+              f'p99 {stats["p99"]:7.1f} us ({stats["n"]} handoffs)')
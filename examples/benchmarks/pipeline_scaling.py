@@ -0,0 +1,224 @@
+"""
+Parallel scaling of the rollout/learner pipeline of Parallel_A2C/main.py, with a stand-in episode instead of EnergyPlus.
+
+Drives the pipeline functions of main.py themselves: run_eplus_experience_harvesting() runs in the processes of a
+RecyclingPool (waiting for room in the experience queue, a manager Queue bounded by queue_size_max, before running its
+episode), and global_policy_process() runs in one learner process and updates the policy with the experiences. Only
+the simulation and the update are stand-ins: StandInManager replaces Energyplus_manager (a fixed CPU time, then
+n_steps of synthetic experience), and StandInTrainer replaces the trainer (the forward and backward pass of the 512
+unit MLP of the example on the episode, repeated learner_epochs times, in NumPy).
+
+Sweeps the number of harvesting processes (main.py uses number_of_subprocesses - 1) and queue_size_max, and measures:
+    - episodes/s, from the start of the pool to the last update
+    - learner utilization, the share of its time (from its first experience to its last update) spent updating
+    - queue waits: of the workers for room in the queue, of the experiences in the queue, of the learner for them
+    - end-to-end latency, from the end of an episode to the end of the weight update with it
+for strong scaling (n_episodes in total, for every queue depth) and weak scaling (n_episodes per worker, at the largest
+queue depth). Results are written as JSON, and plotted if matplotlib is installed.
+
+Usage: python pipeline_scaling.py [workers,...] [queue_depths,...] [n_episodes] [episode_cpu_seconds] [learner_epochs]
+                                  [output_base]
+"""
+import os
+import sys
+import json
+import time
+import multiprocessing
+import numpy as np
+from eplus_drl.workers import RecyclingPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'rl_ventilation_control',
+                                'Parallel_A2C'))
+import main as pipeline  # Parallel_A2C/main.py
+
+workers_sweep = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '1,2,4,8').split(',')]
+queue_depths = [int(n) for n in (sys.argv[2] if len(sys.argv) > 2 else '1,4,10').split(',')]
+n_episodes = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+episode_cpu_seconds = float(sys.argv[4]) if len(sys.argv) > 4 else 0.5
+learner_epochs = int(sys.argv[5]) if len(sys.argv) > 5 else 4
+output_base = sys.argv[6] if len(sys.argv) > 6 else 'pipeline_scaling'
+n_steps, state_size, action_size = 1008, 9, 10  # a 7 day episode at 10 min timesteps
+
+
+class StandInManager:
+    """Stands in for the Energyplus_manager of run_eplus_experience_harvesting(), with a CPU-bound stub episode."""
+
+    kpis = []
+
+    def __init__(self, episode, control_policy, config, normalizer_stats=None, deterministic=False):
+        self.episode = episode
+        self.config = config
+        self.gamma = config['gamma']
+
+    def run_episode(self):
+        started = time.time()
+        cpu_start = time.process_time()
+        x = np.ones(64)
+        while time.process_time() - cpu_start < episode_cpu_seconds:  # CPU-bound, as EnergyPlus
+            x = np.tanh(x * 1.0001)
+        rng = np.random.default_rng(self.episode)
+        self.states = rng.random((n_steps, state_size), dtype=np.float32)
+        self.actions = np.eye(action_size, dtype=np.float32)[rng.integers(action_size, size=n_steps)]
+        self.rewards = -rng.random(n_steps)
+        self.log_probs = np.full(n_steps, -np.log(action_size))
+        self.config['report'].put(('episode', self.episode, {'started': started, 'finished': time.time()}))
+
+    def episode_normalizer_stats(self):
+        return None
+
+
+class StandInTrainer:
+    """Stands in for the trainer of global_policy_process(), a NumPy update of the example's MLP (actor and critic)."""
+
+    def __init__(self, config):
+        self.config = config
+        rng = np.random.default_rng(0)
+        self.w1 = rng.standard_normal((state_size, 512)).astype(np.float32) * 0.1
+        self.w2 = rng.standard_normal((512, action_size + 1)).astype(np.float32) * 0.1
+
+    def update(self, experience):
+        got = time.time()
+        states = experience['states']
+        for _ in range(learner_epochs):
+            h = np.maximum(states @ self.w1, 0)
+            grad_out = h @ self.w2
+            grad_out -= grad_out.mean(axis=0)  # stand-in of the loss gradient
+            grad_h = (grad_out @ self.w2.T) * (h > 0)
+            self.w2 -= 1e-6 * (h.T @ grad_out)
+            self.w1 -= 1e-6 * (states.T @ grad_h)
+        self.config['report'].put(('update', experience['episode'], {'got': got, 'updated': time.time()}))
+
+
+def harvest(*args):
+    # main.py's harvesting function, with the start time of the task, before it waits for room in the queue
+    args[3]['report'].put(('task', args[1], {'submitted': time.time()}))
+    pipeline.run_eplus_experience_harvesting(*args)
+
+
+def stats(values) -> dict:
+    values = np.asarray(values, dtype=float)
+    return {'mean': float(values.mean()), 'p50': float(np.median(values)), 'p95': float(np.percentile(values, 95))}
+
+
+def run_pipeline(n_workers: int, queue_size_max: int, episodes: int) -> dict:
+    ctx = multiprocessing.get_context()
+    manager = ctx.Manager()
+    experience_queue = manager.Queue()
+    report = manager.Queue()
+    config = {'number_of_episodes': episodes, 'queue_size_max': queue_size_max, 'eval_every': 0, 'gamma': 0.99,
+              'experience_archive_path': '', 'report': report}
+    shared_normalizer = manager.dict()
+    global_policy = pipeline.Policy(state_size, action_size)  # copied by every harvesting task, as in main.py
+    learner = ctx.Process(target=pipeline.global_policy_process,
+                          args=(experience_queue, StandInTrainer(config), shared_normalizer))
+    start_time = time.time()
+    learner.start()
+    with RecyclingPool(ctx, processes=n_workers) as pool:
+        tasks = [(experience_queue, episode, global_policy, config, shared_normalizer, None, None, StandInManager)
+                 for episode in range(episodes)]
+        for _ in pool.imap_unordered(harvest, tasks):
+            pass
+    experience_queue.put({'episode': episodes})  # stops the learner once it used all the experience, as in main.py
+    learner.join()
+    records = {episode: {} for episode in range(episodes)}
+    while not report.empty():
+        _, episode, times = report.get()
+        records[episode].update(times)
+    manager.shutdown()
+    if pool.errors:
+        raise RuntimeError(f'ERROR: Episodes failed: {pool.errors}')
+    records = [records[episode] for episode in range(episodes)]
+    if any('updated' not in record for record in records):
+        raise RuntimeError(f'ERROR: Only [{sum("updated" in record for record in records)}] of [{episodes}] episodes '
+                           f'were used by the learner, see the log of main.py.')
+
+    updates = sorted(records, key=lambda record: record['got'])
+    previous_updated = [start_time] + [record['updated'] for record in updates[:-1]]
+    wall_time = updates[-1]['updated'] - start_time
+    busy_time = sum(record['updated'] - record['got'] for record in records)
+    return {
+        'workers': n_workers,
+        'queue_size_max': queue_size_max,
+        'episodes': episodes,
+        'wall_time': wall_time,
+        'episodes_per_s': episodes / wall_time,
+        'learner_utilization': busy_time / (updates[-1]['updated'] - updates[0]['got']),
+        'update_time': stats([record['updated'] - record['got'] for record in records]),
+        'worker_queue_wait': stats([record['started'] - record['submitted'] for record in records]),
+        'experience_queue_time': stats([record['got'] - record['finished'] for record in records]),
+        'learner_get_wait': stats([record['got'] - previous for record, previous in zip(updates, previous_updated)]),
+        'end_to_end_latency': stats([record['updated'] - record['finished'] for record in records]),
+    }
+
+
+def add_efficiency(rows: list):
+    # relative to the run with the fewest workers, per queue depth
+    for row in rows:
+        reference = min((r for r in rows if r['queue_size_max'] == row['queue_size_max']), key=lambda r: r['workers'])
+        speedup = row['episodes_per_s'] / reference['episodes_per_s']
+        row['speedup'] = speedup
+        row['efficiency'] = speedup / (row['workers'] / reference['workers'])
+
+
+def plot(results: dict, path: str):
+    import matplotlib
+    matplotlib.use('Agg')  # For saving in a headless program. Must be before importing matplotlib.pyplot or pylab!
+    from matplotlib import pyplot as plt
+
+    fig, axes = plt.subplots(2, 2, figsize=(11, 8))
+    for depth in queue_depths:
+        rows = [row for row in results['strong'] if row['queue_size_max'] == depth]
+        workers = [row['workers'] for row in rows]
+        axes[0, 0].plot(workers, [row['episodes_per_s'] for row in rows], 'o-', label=f'queue_size_max {depth}')
+        axes[0, 1].plot(workers, [row['learner_utilization'] for row in rows], 'o-', label=f'queue_size_max {depth}')
+        axes[1, 0].plot(workers, [row['end_to_end_latency']['p50'] for row in rows], 'o-',
+                        label=f'queue_size_max {depth}')
+    reference = min(results['strong'], key=lambda row: row['workers'])
+    axes[0, 0].plot(workers_sweep, [reference['episodes_per_s'] * n / reference['workers'] for n in workers_sweep],
+                    'k--', label='linear')
+    axes[1, 1].plot([row['workers'] for row in results['strong'] if row['queue_size_max'] == queue_depths[-1]],
+                    [row['efficiency'] for row in results['strong'] if row['queue_size_max'] == queue_depths[-1]],
+                    'o-', label='strong')
+    axes[1, 1].plot([row['workers'] for row in results['weak']], [row['efficiency'] for row in results['weak']],
+                    's-', label='weak')
+    for ax, title, ylabel in [(axes[0, 0], 'Strong scaling', 'Episodes/s'),
+                              (axes[0, 1], 'Learner utilization', 'Share of time updating'),
+                              (axes[1, 0], 'Episode end to weight update (median)', 'Seconds'),
+                              (axes[1, 1], f'Scaling efficiency (queue_size_max {queue_depths[-1]})', 'Efficiency')]:
+        ax.set_title(title)
+        ax.set_xlabel('Harvesting processes')
+        ax.set_ylabel(ylabel)
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close('all')
+
+
+if __name__ == '__main__':
+    results = {'parameters': {'workers': workers_sweep, 'queue_depths': queue_depths, 'n_episodes': n_episodes,
+                              'episode_cpu_seconds': episode_cpu_seconds, 'learner_epochs': learner_epochs,
+                              'n_steps': n_steps, 'cpu_count': os.cpu_count()},
+               'strong': [], 'weak': []}
+    for depth in queue_depths:
+        for n_workers in workers_sweep:
+            results['strong'].append(run_pipeline(n_workers, depth, n_episodes))
+    for n_workers in workers_sweep:
+        results['weak'].append(run_pipeline(n_workers, queue_depths[-1], n_episodes * n_workers))
+    add_efficiency(results['strong'])
+    add_efficiency(results['weak'])
+
+    with open(f'{output_base}.json', 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"{'scaling':>7} {'workers':>7} {'queue':>5} {'episodes':>8} {'ep/s':>7} {'eff':>5} {'learner':>7} "
+          f"{'wait w':>7} {'in queue':>8} {'e2e p50':>8} {'e2e p95':>8}")
+    for scaling in ['strong', 'weak']:
+        for row in results[scaling]:
+            print(f"{scaling:>7} {row['workers']:>7} {row['queue_size_max']:>5} {row['episodes']:>8} "
+                  f"{row['episodes_per_s']:>7.2f} {row['efficiency']:>5.2f} {row['learner_utilization']:>7.0%} "
+                  f"{row['worker_queue_wait']['mean']:>7.3f} {row['experience_queue_time']['mean']:>8.3f} "
+                  f"{row['end_to_end_latency']['p50']:>8.3f} {row['end_to_end_latency']['p95']:>8.3f}")
+    try:
+        plot(results, f'{output_base}.png')
+        print(f'\nResults written to {output_base}.json and {output_base}.png')
+    except ImportError:
+        print(f'\nResults written to {output_base}.json, matplotlib is not installed for the plots')
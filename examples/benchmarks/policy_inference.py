@@ -0,0 +1,51 @@
+"""
+Per-step policy inference latency: torch Policy.act() vs. the exported NumPy policy (eplus_drl.inference).
+
+Uses the 9 -> 512 -> 10 actor of the A2C example (random weights, or a trained model given as argument), checks that
+both paths compute the same action probabilities and times a single act() call, as done at every E+ timestep.
+
+Usage: python policy_inference.py [model_path] [n_steps]
+"""
+import sys
+import os
+import time
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../rl_ventilation_control/Parallel_A2C'))
+from policy import Policy
+
+model_path = sys.argv[1] if len(sys.argv) > 1 else None
+n_steps = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+state_size, action_size = (9, 1), 10
+
+
+def time_per_step(act, states):
+    for state in states[:100]:  # warm up
+        act(state)
+    start_time = time.perf_counter()
+    for state in states:
+        act(state)
+    return (time.perf_counter() - start_time) / len(states)
+
+
+if __name__ == '__main__':
+    torch.set_num_threads(1)  # as in the harvesting workers, one E+ simulation per core
+    policy = Policy(state_size, action_size)
+    if model_path:
+        policy.load_state_dict(torch.load(model_path))
+    policy.eval()
+    numpy_policy = policy.export_numpy(seed=0)
+
+    rng = np.random.default_rng(0)
+    states = rng.random((n_steps, state_size[0]), dtype=np.float32)
+
+    with torch.no_grad():
+        torch_probs = policy(torch.FloatTensor(states[:1000]))[0].numpy()
+    numpy_probs = np.array([numpy_policy.probabilities(state) for state in states[:1000]])
+    print(f'Max abs difference of the action probabilities: {np.abs(torch_probs - numpy_probs).max():.2e}')
+
+    torch_time = time_per_step(policy.act, states)
+    numpy_time = time_per_step(numpy_policy.act, states)
+    print(f'torch act(): {torch_time * 1e6:8.1f} us/step')
+    print(f'numpy act(): {numpy_time * 1e6:8.1f} us/step  ({torch_time / numpy_time:.1f}x faster)')
@@ -0,0 +1,124 @@
+"""
+Throughput per GB of RAM of EnergyPlus episodes run on threads of one process (eplus_drl.threaded, one batched policy
+forward for all the simulations) versus a pool of processes (one policy per process, as in Parallel_A2C/main.py).
+
+Memory is the total proportional set size (PSS, shared pages counted once) of this process and its children, sampled
+during the runs from /proc (Linux). Every episode controls the fan of the ventilation example with a 512 unit MLP.
+
+Usage: python threaded_vs_pool.py ep_path idf_path epw_path [n_episodes] [n_workers]
+"""
+import os
+import sys
+import time
+import threading
+import multiprocessing
+import numpy as np
+from eplus_drl import BcaEnv
+
+ep_path = sys.argv[1] if len(sys.argv) > 1 else '/usr/local/EnergyPlus-22-1-0'
+idf_path = sys.argv[2] if len(sys.argv) > 2 else '../rl_ventilation_control/BEMFiles/sdu_damper_all_rooms.idf'
+epw_path = sys.argv[3] if len(sys.argv) > 3 else '../rl_ventilation_control/BEMFiles/DNK_Jan_Feb.epw'
+n_episodes = int(sys.argv[4]) if len(sys.argv) > 4 else 8
+n_workers = int(sys.argv[5]) if len(sys.argv) > 5 else 4
+tc_vars = {
+    'zn0_temp': ('Zone Air Temperature', 'Thermal Zone 1'),
+    'fan_electric_power': ('Fan Electricity Rate', 'FANSYSTEMMODEL VAV'),
+    'deck_temp': ('System Node Temperature', 'Node 30'),
+}
+tc_weather = {'oa_db': ('outdoor_dry_bulb'), 'oa_rh': ('outdoor_relative_humidity')}
+tc_actuators = {'fan_mass_flow_act': ('Fan', 'Fan Air Mass Flow Rate', 'FANSYSTEMMODEL VAV')}
+features = ['t_hours', 'zn0_temp', 'fan_electric_power', 'deck_temp', 'oa_db', 'oa_rh']
+action_size = 10
+rng = np.random.default_rng(0)
+weights = [rng.standard_normal((len(features), 512)).astype(np.float32) * 0.1,
+           rng.standard_normal((512, action_size)).astype(np.float32) * 0.1]
+
+
+def batch_act(observations):
+    logits = np.maximum(observations @ weights[0], 0) @ weights[1]
+    return np.argmax(logits + rng.gumbel(size=logits.shape), axis=1)  # sampled from softmax(logits)
+
+
+def run_episode(episode, act=None):
+    act = act or (lambda observation: batch_act(observation[None, :])[0])
+    out_dir = BcaEnv.get_temp_run_dir()
+    sim = BcaEnv(ep_path, idf_path, 6, tc_vars, {}, {}, tc_actuators, tc_weather)
+
+    def actuation_function():
+        observation = np.array(sim.get_ems_data(features), dtype=np.float32)
+        return {'fan_mass_flow_act': float(act(observation)) * (2.18 / action_size)}
+
+    sim.set_calling_point_and_callback_function(BcaEnv.available_calling_points[7], None, actuation_function, True,
+                                                1, 1)
+    sim.run_env(epw_path, out_dir)
+    return len(sim.t_datetimes)
+
+
+def pss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    return 0.0
+
+
+def children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            child_pids = [int(child) for child in f.read().split()]
+    except FileNotFoundError:
+        return []
+    return child_pids + [grandchild for child in child_pids for grandchild in children(child)]
+
+
+class MemorySampler(threading.Thread):
+    """Peak total PSS of this process and all its children, sampled every interval seconds."""
+
+    def __init__(self, interval=0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak_mb = 0.0
+        self.stop = threading.Event()
+
+    def run(self):
+        pid = os.getpid()
+        while not self.stop.is_set():
+            self.peak_mb = max(self.peak_mb, sum(pss_mb(p) for p in [pid] + children(pid)))
+            time.sleep(self.interval)
+
+
+def benchmark(name, run):
+    sampler = MemorySampler()
+    sampler.start()
+    start_time = time.perf_counter()
+    n_steps = run()
+    wall_time = time.perf_counter() - start_time
+    sampler.stop.set()
+    sampler.join()
+    episodes_per_s = n_episodes / wall_time
+    print(f'{name:>22}: {n_episodes} episodes ({sum(n_steps)} steps) in {wall_time:7.2f} s | '
+          f'{episodes_per_s * 3600:8.1f} episodes/h | peak PSS {sampler.peak_mb:8.1f} MB | '
+          f'{episodes_per_s * 3600 / (sampler.peak_mb / 1024):8.1f} episodes/h per GB')
+
+
+def run_threads():
+    from eplus_drl.threaded import MultiStateRunner
+    runner = MultiStateRunner(batch_act, n_threads=n_workers)
+    n_steps = runner.run([lambda act, episode=episode: run_episode(episode, act) for episode in range(n_episodes)])
+    print(f'{"":>22}  {runner.policy.n_forwards} batched forwards, mean batch size {runner.policy.mean_batch_size:.2f}')
+    return n_steps
+
+
+def run_pool():
+    ctx = multiprocessing.get_context('forkserver')
+    with ctx.Pool(processes=n_workers, maxtasksperchild=1) as pool:
+        return pool.map(run_episode, range(n_episodes), chunksize=1)
+
+
+if __name__ == '__main__':
+    print(f'{n_episodes} episodes on {n_workers} workers\n')
+    benchmark(f'{n_workers} threads', run_threads)
+    benchmark(f'{n_workers} processes', run_pool)
@@ -0,0 +1,56 @@
+"""
+Worker startup-time benchmark: how long does a new worker process take before it can start an EnergyPlus episode?
+
+Compares a plain 'spawn' pool (what every new worker pays without preloading), a 'fork' pool and the preloaded
+'forkserver' context of eplus_drl.workers, with maxtasksperchild=1 so that every task runs in a new worker process,
+as happens when workers are recycled. Also reports the import time of eplus_drl itself and whether it pulls pandas.
+
+Usage: python worker_startup.py [ep_path] [n_tasks] [n_processes]
+"""
+import sys
+import time
+import subprocess
+from eplus_drl.workers import get_worker_context, worker_startup_time
+
+ep_path = sys.argv[1] if len(sys.argv) > 1 else '/usr/local/EnergyPlus-22-1-0'
+n_tasks = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+n_processes = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+worker_modules = ['numpy', 'torch', 'eplus_drl', 'pyenergyplus.api']
+
+
+def available(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+def benchmark_import():
+    code = ('import sys, time; t = time.perf_counter(); import eplus_drl; '
+            'print(time.perf_counter() - t, "pandas" in sys.modules, "matplotlib" in sys.modules)')
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()
+    print(f'import eplus_drl: {float(out[0]) * 1000:.1f} ms, pandas imported: {out[1]}, matplotlib imported: {out[2]}')
+
+
+def benchmark_pool(start_method):
+    ctx = get_worker_context(ep_path, preload=['torch'], start_method=start_method)
+    start_time = time.perf_counter()
+    with ctx.Pool(processes=n_processes, maxtasksperchild=1) as pool:
+        first_ready = time.perf_counter() - start_time
+        results = pool.map(worker_startup_time, [modules] * n_tasks, chunksize=1)
+    wall_time = time.perf_counter() - start_time
+    import_times = [r['import_time'] for r in results]
+    print(f'{start_method:>11}: pool start {first_ready * 1000:8.1f} ms | {n_tasks} tasks in {wall_time:6.2f} s | '
+          f'import per worker: mean {sum(import_times) / n_tasks * 1000:8.1f} ms, '
+          f'max {max(import_times) * 1000:8.1f} ms | preloaded: {results[-1]["preloaded"]}')
+
+
+if __name__ == '__main__':
+    if ep_path not in sys.path:
+        sys.path.insert(0, ep_path)
+    modules = [module for module in worker_modules if available(module)]
+    print(f'Worker modules found: {modules}, {n_tasks} tasks on {n_processes} processes\n')
+    benchmark_import()
+    for method in ['spawn', 'fork', 'forkserver']:
+        benchmark_pool(method)
@@ -0,0 +1,35 @@
+"""
+Builds neuromancer datasets for system identification (see part_4_node_control.py, stage 2) from the EnergyPlus
+experience archived by the A2C example (experience_archive_path in its config.ini), instead of an emulator.
+
+Windows of contiguous timesteps are sampled from the memory-mapped archive, the whole archive is never loaded in RAM.
+"""
+import sys
+import numpy as np
+from torch.utils.data import DataLoader
+from neuromancer.dataset import DictDataset
+from eplus_drl.archive import ExperienceArchive
+
+archive_path = sys.argv[1] if len(sys.argv) > 1 else '../rl_ventilation_control/Parallel_A2C/Archive'
+n_windows = 1000  # samples per dataset
+window = 10  # contiguous timesteps per sample
+
+archive = ExperienceArchive(archive_path)
+rng = np.random.default_rng(0)
+print(f"Archive with {len(archive)} timesteps of {len(archive.index['episodes'])} episodes")
+
+
+def make_dataset(name):
+    windows = archive.sample_windows(n_windows, window, rng, columns=['obs', 'actions'])
+    data = {
+        'X': windows['obs'],  # measured states
+        'U': windows['actions'],  # control inputs
+        'Y': windows['obs'],  # outputs, fully observed
+    }
+    data['xn'] = data['X'][:, 0:1, :]  # initial condition of each rollout
+    return DictDataset(data, name=name)
+
+
+train_dataset, dev_dataset = make_dataset('train'), make_dataset('dev')
+train_loader, dev_loader = [DataLoader(d, batch_size=100, collate_fn=d.collate_fn, shuffle=True)
+                            for d in [train_dataset, dev_dataset]]
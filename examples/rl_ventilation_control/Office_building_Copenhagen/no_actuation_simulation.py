@@ -149,6 +149,8 @@ sim.set_calling_point_and_callback_function(
 # -- RUN BUILDING SIMULATION --
 
 sim.run_env(config['ep_weather_path'])
+# Observation only: sim.run_env_bulk(config['ep_weather_path']) runs the same simulation without any Python callback
+# and loads the ToC metrics from the SQLite output afterwards, see examples/benchmarks/bulk_harvesting.py
 sim.reset_state()  # reset when done
 
 
@@ -2,9 +2,6 @@ import logging
 import os
 import sys
 import traceback
-import matplotlib
-matplotlib.use('Agg')  # For saving in a headless program. Must be before importing matplotlib.pyplot or pylab!
-from matplotlib import pyplot as plt
 import numpy as np
 import torch.optim as optim
 import torch
@@ -28,11 +25,11 @@ class A2C_trainer:
             os.makedirs(self.Save_Path)
         self.Model_name = config['model_path']
         self.verbose = config['eplus_verbose']
+        self.select_best = True  # save the best model by moving average score, off when the evaluator selects it
 
 
        
-    def discount_rewards(self, rewards):
-        gamma = 0.99
+    def discount_rewards(self, rewards, gamma=0.99):
         running_add = 0
         discounted_r = np.zeros_like(rewards)
         for i in reversed(range(0, len(rewards))):
@@ -42,31 +39,37 @@ class A2C_trainer:
         discounted_r /= np.std(discounted_r) + 1e-10  # Add epsilon to avoid division by zero
         return discounted_r
 
+    def loss(self, experience, model=None):
+        """Actor-critic loss of an episode, for the trained model or another copy of the policy (e.g. an A3C worker's)."""
+        model = self.model if model is None else model
+        # Convert experience data to tensors
+        states = torch.FloatTensor(np.vstack(experience['states']))
+        actions = torch.LongTensor(np.vstack(experience['actions']))
+        # per timestep discount factor of the episode's fidelity level, if given, see eplus_drl.fidelity
+        discounted_r = torch.FloatTensor(self.discount_rewards(experience['rewards'], experience.get('gamma', 0.99)))
+        
+        # Forward pass to get action probabilities and values
+        action_probs, values = model(states)
+        values = values.squeeze()
+        
+        # Ensure action_probs and actions have compatible shapes
+        action_probs = action_probs.gather(1, actions)
+        
+        # Calculate advantages
+        advantages = discounted_r - values
+        
+        # Calculate actor and critic loss
+        actor_loss = -((torch.log(action_probs) * actions).sum(dim=1) * advantages).mean()
+        #actor_loss = -(torch.log(action_probs) * advantages).sum(dim=1).mean()
+        critic_loss = advantages.pow(2).mean()
+        return actor_loss + critic_loss
+
     def replay(self, experience):
         try:
-            # Convert experience data to tensors
-            states = torch.FloatTensor(np.vstack(experience['states']))
-            actions = torch.LongTensor(np.vstack(experience['actions']))
             self.score = np.sum(experience['rewards'])
-            discounted_r = torch.FloatTensor(self.discount_rewards(experience['rewards']))
-            
-            # Forward pass to get action probabilities and values
-            action_probs, values = self.model(states)
-            values = values.squeeze()
-            
-            # Ensure action_probs and actions have compatible shapes
-            action_probs = action_probs.gather(1, actions)
-            
-            # Calculate advantages
-            advantages = discounted_r - values
-            
-            # Calculate actor and critic loss
-            actor_loss = -((torch.log(action_probs) * actions).sum(dim=1) * advantages).mean()
-            #actor_loss = -(torch.log(action_probs) * advantages).sum(dim=1).mean()
-            critic_loss = advantages.pow(2).mean()
+            loss = self.loss(experience)
             
             # Backpropagation
-            loss = actor_loss + critic_loss
             self.optimizer.zero_grad()
             loss.backward()
             torch.nn.utils.clip_grad_norm_(self.model.parameters(), max_norm=0.5)  # Gradient clipping
@@ -93,7 +96,11 @@ class A2C_trainer:
         self.average.append(sum(self.scores[-50:]) / len(self.scores[-50:]))
         
         if str(self.episode)[-1:] == "0":
-            try:      
+            try:
+                # Imported here, only the learner process plots
+                import matplotlib
+                matplotlib.use('Agg')  # For saving in a headless program. Must be before importing matplotlib.pyplot or pylab!
+                from matplotlib import pyplot as plt
                 fig, ax = plt.subplots()              
                 ax.plot(self.episodes, self.scores, 'b')
                 ax.plot(self.episodes, self.average, 'r')
@@ -107,12 +114,12 @@ class A2C_trainer:
             except:
                 e = sys.exc_info()[0]
                 print("Something else went wrong e: ", e)                                   
+        SAVING = ""
         if self.average[-1] >= self.max_average:
             self.max_average = self.average[-1]
-            self.save(suffix="_best")
-            SAVING = "SAVING"
-        else:
-            SAVING = ""
+            if self.select_best:
+                self.save(suffix="_best")
+                SAVING = "SAVING"
         logging.info("episode: {}/{}, score: {}, average: {:.2f}, max average:{:.2f} {}".format(self.episode, self.EPISODES, self.scores[-1], self.average[-1],self.max_average, SAVING))
 
         return self.average[-1]
@@ -0,0 +1,155 @@
+import os
+import copy
+import time
+import logging
+import traceback
+import contextlib
+import numpy as np
+import torch
+from a2c import A2C_trainer
+from eplus_manager import Energyplus_manager
+from eplus_drl.preprocessing import RunningNormalizer
+from eplus_drl.workers import RecyclingPool
+from eplus_drl.telemetry import LeakMonitor, throughput_report, format_throughput_report
+from eplus_drl.fidelity import speedup_report, format_speedup_report
+
+
+class SharedAdam(torch.optim.Adam):
+    """Adam whose moment estimates live in shared memory, so that all the A3C workers step the same optimizer."""
+
+    def __init__(self, params, lr):
+        super().__init__(params, lr=lr)
+        for group in self.param_groups:
+            for param in group['params']:
+                # created now (instead of lazily at the first step) so that they can be shared
+                state = self.state[param]
+                state['step'] = torch.zeros(())
+                state['exp_avg'] = torch.zeros_like(param, memory_format=torch.preserve_format)
+                state['exp_avg_sq'] = torch.zeros_like(param, memory_format=torch.preserve_format)
+                for tensor in state.values():
+                    tensor.share_memory_()
+
+
+class A3C_trainer(A2C_trainer):
+    """
+    Asynchronous advantage actor-critic (Hogwild): the global policy and its optimizer are in shared memory, every
+    worker process computes the gradients of its own episodes on a local copy of the policy and applies them to the
+    global one, without a single learner process in between.
+
+    Gradients are dropped when more than config['a3c_max_staleness'] updates were applied to the global policy since
+    the worker copied it. Updates are lock-free (Hogwild) unless config['a3c_lock_updates'].
+    """
+    def __init__(self, actor_critic_policy, config):
+        super().__init__(actor_critic_policy, config)
+        self.model.share_memory()
+        self.optimizer = SharedAdam(self.model.parameters(), lr=self.lr)
+        self.max_staleness = config.get('a3c_max_staleness', 8)
+        self.lock_updates = config.get('a3c_lock_updates', False)
+        self.version = torch.zeros(1, dtype=torch.long).share_memory_()  # updates applied to the global policy
+        self.dropped = torch.zeros(1, dtype=torch.long).share_memory_()  # stale updates dropped
+
+    def local_copy(self):
+        """Copy of the global policy for a worker's episode, and the version it was copied at."""
+        version = int(self.version.item())
+        local_model = copy.deepcopy(self.model)
+        return local_model, version
+
+    def apply_gradients(self, local_model, experience, version, lock):
+        """
+        Computes the gradients of an episode on the worker's local policy and applies them to the global policy.
+
+        :param version: version of the global policy the local one was copied at, see local_copy()
+        :param lock: lock shared by the workers (e.g. manager.Lock()), guards the version counter
+        :return: staleness of the update (global updates applied meanwhile), None if it was dropped
+        """
+        staleness = int(self.version.item()) - version
+        if staleness > self.max_staleness:
+            with lock:
+                self.dropped += 1
+            return None
+        loss = self.loss(experience, local_model)
+        local_model.zero_grad()
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(local_model.parameters(), max_norm=0.5)  # Gradient clipping
+        with lock if self.lock_updates else contextlib.nullcontext():
+            for global_param, local_param in zip(self.model.parameters(), local_model.parameters()):
+                global_param._grad = local_param.grad
+            self.optimizer.step()
+        with lock:
+            self.version += 1
+        return staleness
+
+    def record(self, result):
+        """Bookkeeping of a finished episode in the main process (scores, plots, best model)."""
+        self.episode = result['episode']
+        self.score = result['score']
+        self.episodes.append(self.episode)
+        self.scores.append(self.score)
+        self.evaluate_model()
+
+
+def run_a3c_episode(episode, trainer, config, lock, shared_normalizer, catalog=None, experiment_id=None):
+    """Worker task: runs an episode with a copy of the global policy, then updates the global policy."""
+    try:
+        local_model, version = trainer.local_copy()
+        start_time = time.time()
+        eplus_object = Energyplus_manager(episode, local_model, config, shared_normalizer.get('stats'))
+        eplus_object.run_episode()
+        wall_time = time.time() - start_time
+        experience = {'states': eplus_object.states, 'actions': eplus_object.actions, 'rewards': eplus_object.rewards,
+                      'gamma': eplus_object.gamma}
+
+        staleness = trainer.apply_gradients(local_model, experience, version, lock)
+        if staleness is None:
+            logging.info(f"Episode {episode}: update dropped, more than {trainer.max_staleness} updates behind")
+
+        worker_stats = eplus_object.episode_normalizer_stats()
+        if worker_stats is not None and worker_stats['count'] > 0:
+            with lock:
+                global_stats = shared_normalizer.get('stats')
+                stats_list = [worker_stats] if global_stats is None else [global_stats, worker_stats]
+                shared_normalizer['stats'] = RunningNormalizer.merge_stats(stats_list)
+
+        score = float(np.sum(eplus_object.rewards))
+        if catalog is not None:
+            kpis = {kpi.name: kpi(eplus_object.sim) for kpi in Energyplus_manager.kpis}
+            kpis['score'] = score
+            catalog.register_run(experiment_id, eplus_object.sim, config['ep_weather_path'], kpis=kpis,
+                                 wall_time=wall_time, episode=episode, kind='episode')
+        return {'episode': episode, 'score': score, 'staleness': staleness, 'wall_time': wall_time, 'pid': os.getpid()}
+    except Exception as e:
+        logging.error(f"Error in episode {episode}: {e}\n{traceback.format_exc()}")
+        return None
+
+
+def train_a3c(trainer, config, ctx, manager, catalog=None, experiment_id=None):
+    """
+    Runs config['number_of_episodes'] episodes on config['number_of_subprocesses'] worker processes, each one
+    updating the shared global policy of trainer (an A3C_trainer) by itself.
+    """
+    lock = manager.Lock()
+    shared_normalizer = manager.dict()  # running observation statistics, if used
+    tasks = [(episode, trainer, config, lock, shared_normalizer, catalog, experiment_id)
+             for episode in range(config['number_of_episodes'])]
+    start_time = time.time()
+    staleness = []
+    # workers are recycled once their memory grows too fast, see eplus_drl.telemetry
+    monitor = LeakMonitor(growth_limit_mb=config.get('recycle_rss_growth_mb', 50),
+                          rss_limit_mb=config.get('recycle_rss_limit_mb') or None)
+    with RecyclingPool(ctx, processes=config['number_of_subprocesses'], monitor=monitor) as pool:
+        for result in pool.imap_unordered(run_a3c_episode, tasks):
+            if result is None:
+                continue
+            trainer.record(result)
+            if result['staleness'] is not None:
+                staleness.append(result['staleness'])
+    wall_time = time.time() - start_time
+    logging.info(f"A3C: {int(trainer.version.item())} updates in {wall_time:.1f} s "
+                 f"({int(trainer.version.item()) / wall_time * 3600:.1f} updates/h), "
+                 f"mean staleness {np.mean(staleness) if staleness else 0:.2f}, "
+                 f"{int(trainer.dropped.item())} stale updates dropped")
+    logging.info(f"Worker throughput (simulated hours per wall second), {len(pool.recycled)} workers recycled:\n"
+                 f"{format_throughput_report(throughput_report(pool.episode_records))}")
+    if len(speedup_report(pool.episode_records)) > 1:
+        logging.info(f"Speedup per fidelity level:\n{format_speedup_report(speedup_report(pool.episode_records))}")
+    trainer.save()
@@ -0,0 +1,62 @@
+"""
+A2C learner of the distributed rollouts: A2C_trainer consumes the experience of Energyplus_manager episodes run by
+remote worker nodes (distributed_worker.py), and broadcasts its updated policy weights after every update.
+
+Usage: python distributed_learner.py [port]
+"""
+import sys
+import logging
+import numpy as np
+from eplus_drl.utils import load_config
+from eplus_drl.inference import export_weights
+from eplus_drl.distributed import RolloutServer
+from eplus_drl.preprocessing import RunningNormalizer
+from policy import Policy
+from a2c import A2C_trainer
+
+port = int(sys.argv[1]) if len(sys.argv) > 1 else 5555
+
+
+def policy_message(policy, normalizer_stats):
+    # policy weights, plus the merged running observation statistics if used
+    weights = export_weights(policy)
+    if normalizer_stats is not None:
+        weights['normalizer.count'] = np.array([normalizer_stats['count']])
+        weights['normalizer.mean'] = normalizer_stats['mean']
+        weights['normalizer.m2'] = normalizer_stats['m2']
+    return weights
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    config = load_config()
+    global_policy = Policy(config['state_size'], config['action_size'])
+    a2c_object = A2C_trainer(global_policy, config)
+    normalizer_stats = None
+
+    server = RolloutServer('0.0.0.0', port).start()
+    server.broadcast_weights(policy_message(global_policy, normalizer_stats))
+    server.submit(range(config['number_of_episodes']))
+
+    for _ in range(config['number_of_episodes']):
+        experience = server.get_episode()
+        if 'error' in experience:
+            logging.error(f"Episode {experience['episode']} failed: {experience['error']}")
+            continue
+        logging.debug(f"Episode {experience['episode']} from worker {experience['worker']}, "
+                      f"weights version {experience['version']} (current {server.version})")
+        experience['actions'] = experience['actions'].astype(float)  # as the one-hot actions of local workers
+        a2c_object.update(experience)
+        if experience.get('normalizer_count', 0) > 0:
+            worker_stats = {'count': experience['normalizer_count'], 'mean': experience['normalizer_mean'],
+                            'm2': experience['normalizer_m2']}
+            stats_list = [worker_stats] if normalizer_stats is None else [normalizer_stats, worker_stats]
+            normalizer_stats = RunningNormalizer.merge_stats(stats_list)
+        server.broadcast_weights(policy_message(global_policy, normalizer_stats))
+
+    server.close()
+    logging.info("All episodes have completed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Rollout worker node of the distributed A2C example: runs Energyplus_manager episodes with the policy weights broadcast
+by the learner (distributed_learner.py), in as many parallel processes as given slots.
+
+Usage: python distributed_worker.py learner_host [port] [slots]
+"""
+import sys
+import logging
+import numpy as np
+import torch
+from eplus_drl.utils import load_config
+from eplus_drl.workers import get_worker_context
+from eplus_drl.distributed import RolloutWorker
+from eplus_manager import Energyplus_manager
+from policy import Policy
+
+config = load_config()
+
+
+def run_remote_episode(episode, weights, version):
+    # module-level, runs in the node's process pool
+    policy = Policy(config['state_size'], config['action_size'])
+    policy.load_state_dict({name: torch.from_numpy(np.array(array)) for name, array in weights.items()
+                            if not name.startswith('normalizer.')})
+    normalizer_stats = None
+    if 'normalizer.count' in weights:
+        normalizer_stats = {'count': float(weights['normalizer.count'][0]), 'mean': weights['normalizer.mean'],
+                            'm2': weights['normalizer.m2']}
+    eplus_object = Energyplus_manager(episode, policy, config, normalizer_stats)
+    eplus_object.run_episode()
+
+    arrays = {
+        'states': np.array(eplus_object.states, dtype=np.float32),
+        'actions': np.array(eplus_object.actions, dtype=np.float32),
+        'rewards': np.asarray(eplus_object.rewards, dtype=np.float32),
+    }
+    meta = {'score': float(np.sum(eplus_object.rewards)), 'gamma': eplus_object.gamma}
+    worker_stats = eplus_object.episode_normalizer_stats()
+    if worker_stats is not None:
+        arrays['normalizer_mean'], arrays['normalizer_m2'] = worker_stats['mean'], worker_stats['m2']
+        meta['normalizer_count'] = float(worker_stats['count'])
+    return arrays, meta
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    host = sys.argv[1] if len(sys.argv) > 1 else '127.0.0.1'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 5555
+    slots = int(sys.argv[3]) if len(sys.argv) > 3 else config['number_of_subprocesses']
+    ctx = get_worker_context(config['ep_path'], preload=['torch', 'policy', 'eplus_manager'])
+    RolloutWorker(host, port, run_remote_episode, slots=slots, mp_context=ctx).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,17 @@
 import logging
-from pathlib import Path
-import shutil
 import os
 import numpy as np
 from eplus_drl import EmsPy, BcaEnv
+from eplus_drl.preprocessing import ObservationPipeline
+from eplus_drl.reward import RewardSpec, Deviation, Penalty
+from eplus_drl.evaluation import Energy, Mean, ViolationHours, TrackingError, Return
+from eplus_drl.evaluator import load_checkpoint
+from eplus_drl.inference import NumpyPolicy
+from eplus_drl.episodes import EpisodeSampler
+from eplus_drl.fidelity import FidelityController, FidelitySchedule
+from eplus_drl.rundirs import run_directories
+from eplus_drl.telemetry import EpisodeTelemetry
 import datetime
-import matplotlib
-matplotlib.use('Agg')  # For saving in a headless program. Must be before importing matplotlib.pyplot or pylab!
 
 """
 Main function of the manager: Run an EnergyPlus simulation, controlled by the RL agent's Policy
@@ -44,17 +49,50 @@ class Energyplus_manager:
     tc_intvars = {}
     tc_meters = {}
     ## 
+    #Policy's input (state), in order, and its normalization bounds:
+    observation_features = ['t_hours', 'zn0_temp', 'air_loop_fan_mass_flow_var', 'air_loop_fan_electric_power',
+                            'deck_temp_setpoint', 'deck_temp', 'ppd', 'oa_rh', 'oa_db']
+    observation_bounds = {
+            't_hours': (0, 24),
+            'zn0_temp': (18, 35),
+            'air_loop_fan_mass_flow_var': (0, 2.18),
+            'air_loop_fan_electric_power': (0, 3045.81),
+            'deck_temp_setpoint': (15, 30),
+            'deck_temp': (0, 35),
+            'ppd': (0, 100),
+            'oa_rh': (0, 100),
+            'oa_db': (-10, 10)
+        }
+    #RL-agent's reward: - (|21 - zone temperature| / 17 + fan power / 3045.81)
+    reward_spec = RewardSpec([
+            Deviation('zn0_temp', target=21, weight=1, scale=17),
+            Penalty('air_loop_fan_electric_power', weight=1, scale=3045.81),
+        ])
+    #KPIs of an episode, for evaluation and the experiment catalog:
+    kpis = [
+            Energy('fan_energy_kwh', 'air_loop_fan_electric_power'),
+            Mean('mean_ppd', 'ppd'),
+            ViolationHours('comfort_violation_hours', 'zn0_temp', low=20, high=24),
+            TrackingError('deck_temp_tracking_error', 'deck_temp', setpoint='deck_temp_setpoint'),
+        ]
+    #KPIs of the background checkpoint evaluation, checkpoints are selected on the score (return of the reward):
+    evaluation_kpis = kpis + [Return('score', reward_spec)]
 
-    def __init__(self, episode, control_policy, config):
+    def __init__(self, episode, control_policy, config, normalizer_stats=None, deterministic=False):
         self.local_policy = control_policy
+        self.deterministic = deterministic  # most likely action (argmax) instead of sampling, for evaluation
+        if config.get('numpy_inference', False):
+            self.local_policy = control_policy.export_numpy(seed=episode)
         self.config = config
+        self.normalizer_stats = normalizer_stats
         self.episode = episode
         self.a2c_state = None
-        self.step_reward = 0  
         self.previous_state = None
         self.previous_action = None
         self.action_size = config['action_size']
-        self.states, self.actions, self.rewards = [], [], []
+        self.states, self.actions, self.rewards, self.times = [], [], [], []
+        self.log_probs = []  # log-probabilities of the remembered actions under this (behaviour) policy, for PPO
+        self.reward_rows = []  # rows of the tracked EMS data where the agent acted, rewards are computed after the run
         
         self.setup_logging()
         self.setup_emspy_environment()
@@ -73,18 +111,39 @@ class Energyplus_manager:
     def setup_emspy_environment(self):
         self.calling_point_for_callback_fxn = EmsPy.available_calling_points[7]
         self.sim_timesteps = 6
-        self.working_dir = BcaEnv.get_temp_run_dir()
-        self.directory_name = "Energyplus_temp"
-        self.eplus_copy_path = os.path.join(self.working_dir, self.directory_name)
-        self.delete_directory(self.directory_name)
-        shutil.copytree(self.config['ep_path'], self.eplus_copy_path)
+        #Isolated run directory of the episode (on /dev/shm if available), see eplus_drl.rundirs. The EnergyPlus
+        #installation itself is shared, its API is loaded once per process:
+        self.working_dir = run_directories().allocate(f'episode{self.episode}')
         self.calling_point_for_callback_fxn = EmsPy.available_calling_points[7]
         self.sim_timesteps = 6
 
+        #Episode of a random window of episode_days days of the weather file, or of the whole RunPeriod if 0:
+        self.idf_file_name = self.config['idf_file_name']
+        self.episode_window = None
+        if self.config.get('episode_days', 0) > 0:
+            sampler = EpisodeSampler(self.config['idf_file_name'], self.config['ep_weather_path'],
+                                     episode_days=self.config['episode_days'], seed=self.config.get('episode_seed'))
+            self.idf_file_name, *self.episode_window = sampler.sample(self.episode)
+            logging.debug(f"Episode {self.episode}: {self.episode_window[0]} to {self.episode_window[1]}")
+
+        #Timesteps per hour of the episode by the fidelity schedule, or those of the model if none:
+        self.fidelity = None
+        self.reward_scale = 1.0
+        self.gamma = self.config.get('gamma', 0.99)
+        update_frequency = 1
+        if self.config.get('fidelity_schedule'):
+            self.fidelity = FidelityController(self.idf_file_name,
+                                               FidelitySchedule.from_string(self.config['fidelity_schedule']),
+                                               base_timesteps=self.sim_timesteps)
+            self.idf_file_name, self.sim_timesteps = self.fidelity.model(self.episode)
+            self.reward_scale = self.fidelity.reward_scale(self.sim_timesteps)
+            self.gamma = self.fidelity.discount(self.gamma, self.sim_timesteps)
+            update_frequency = self.fidelity.frequency(update_frequency, self.sim_timesteps)
+
         #Simulation object (sim):
         self.sim = BcaEnv(
-            ep_path=self.eplus_copy_path,
-            ep_idf_to_run=self.config['idf_file_name'],
+            ep_path=self.config['ep_path'],
+            ep_idf_to_run=self.idf_file_name,
             timesteps=self.sim_timesteps,
             tc_vars=self.tc_vars,
             tc_intvars=self.tc_intvars,
@@ -97,61 +156,55 @@ class Energyplus_manager:
             observation_function=self.observation_function,
             actuation_function=self.actuation_function,
             update_state=True,
-            update_observation_frequency=1,
-            update_actuation_frequency=1
+            update_observation_frequency=update_frequency,
+            update_actuation_frequency=update_frequency
+        )
+        self.observation_pipeline = ObservationPipeline(
+            self.sim,
+            features=self.observation_features,
+            bounds=self.observation_bounds,
+            normalization=self.config.get('observation_normalization', 'bounds')
         )
+        self.observation_pipeline.set_stats(self.normalizer_stats)
+        self.reward = self.reward_spec.compile(self.sim)
 
-    def delete_directory(self, temp_folder_name=""):
-        directory_path = os.path.join(self.working_dir, temp_folder_name)
-        if os.path.exists(directory_path):
-            shutil.rmtree(directory_path)
-        out_path = Path('out')
-        if out_path.exists() and out_path.is_dir():
-            shutil.rmtree(out_path)
+    def delete_directory(self, failed=False):
+        """Releases the run directory of the episode, its artifacts are kept by the policy of run_directories()."""
+        if self.working_dir is not None:
+            run_directories().release(self.working_dir, failed)
+            self.working_dir = None
 
-    def remember(self, state, action, reward):
+    def remember(self, state, action):
         self.states.append(state)
         action_onehot = np.zeros([self.action_size])
         action_onehot[action] = 1
         self.actions.append(action_onehot)
-        self.rewards.append(reward)
+        self.reward_rows.append(len(self.sim.t_datetimes) - 1)
+        self.times.append(self.time)
 
     def reward_function(self):
+        """Rewards of the whole episode, computed at once from the tracked EMS data, after the simulation."""
         try:
-            nomalized_setpoint = (21 - 18) / 17
-            alpha = 1
-            beta = 1
-            reward = - (alpha * abs(nomalized_setpoint - self.a2c_state[1]) + beta * self.a2c_state[3])
-            logging.debug(f"Calculated reward: {reward}")
-            return reward
+            rewards = self.reward.evaluate(self.reward_rows)[:, 0] * self.reward_scale
+            logging.debug(f"Calculated episode rewards, total: {rewards.sum()}")
+            return rewards
         except Exception as e:
             logging.error(f"Error in reward_function: {e}")
             raise
 
-    def normalize_state(self, state):
+    def episode_normalizer_stats(self):
+        """Running observation statistics of this episode (since the last sync), weighted by the fidelity level."""
+        stats = self.observation_pipeline.get_stats(since_sync=True)
+        if self.fidelity is not None:
+            stats = self.fidelity.scale_stats(stats, self.sim_timesteps)
+        return stats
+
+    def get_state(self):
         try:
-            assert len(state) == 9, "State vector length is not 9"
-            state[0] = state[0] / 24
-            state[1] = (state[1] - 18) / 17
-            state[2] = state[2] / 2.18
-            state[3] = state[3] / 3045.81
-            state[4] = (state[4] - 15) / 15
-            state[5] = state[5] / 35
-            state[6] = state[6] / 100
-            state[7] = state[7] / 100
-            state[8] = (state[8] + 10) / 20
+            # copy, the pipeline reuses its buffer at every timestep
+            state = self.observation_pipeline.observe().copy()
             logging.debug(f"Normalized state: {state}")
             return state
-        except Exception as e:
-            logging.error(f"Error in normalize_state: {e}")
-            raise
-
-    def get_state(self, var_data, weather_data):
-        try:
-            self.time_of_day = self.sim.get_ems_data(['t_hours'])
-            weather_data = list(weather_data.values())[:2]
-            state = np.concatenate((np.array([self.time_of_day]), var_data, weather_data))
-            return self.normalize_state(state)
         except Exception as e:
             logging.error(f"Error in get_state: {e}")
             raise
@@ -160,21 +213,22 @@ class Energyplus_manager:
         self.time = self.sim.get_ems_data(['t_datetimes'])
         #To skip warming up and pre-simulation routines from energyplus
         if self.time < datetime.datetime.now(): 
-            var_data = self.sim.get_ems_data(list(self.tc_vars.keys()))
-            weather_data = self.sim.get_ems_data(list(self.tc_weather.keys()), return_dict=True)
-            self.a2c_state = self.get_state(var_data, weather_data)
-            self.step_reward = self.reward_function()
+            self.a2c_state = self.get_state()
             if self.previous_state is None:
                 self.previous_state = self.a2c_state
                 self.previous_action = 0
-            self.remember(self.a2c_state, self.previous_action, self.step_reward)
+            self.remember(self.a2c_state, self.previous_action)
             self.previous_state = self.a2c_state
-        return self.step_reward           
 
     def actuation_function(self): 
         if self.time < datetime.datetime.now():    
-            action = self.local_policy.act(self.a2c_state)
-            fan_flow_rate = action * (2.18 / 10)
+            if self.deterministic:
+                action = self.local_policy.act(self.a2c_state, deterministic=True)
+            else:
+                action, probs = self.local_policy.act(self.a2c_state, return_probabilities=True)
+                #Log-probability of the (state, action) pair just remembered, as the learner pairs them:
+                self.log_probs.append(np.log(probs[self.previous_action] + 1e-10))
+            fan_flow_rate = action * (2.18 / self.action_size)
             self.previous_action = action            
         return { 'fan_mass_flow_act': fan_flow_rate }
        
@@ -200,15 +254,41 @@ class Energyplus_manager:
     
     def run_episode(self):
         """Entry point for running a single episode."""
-        if self.config['eplus_verbose'] == 2:
-            self.run_simulation()
-        elif self.config['eplus_verbose'] == 1:
-            self.run_simulation()    
-        elif self.config['eplus_verbose'] == 0:
-            self.silence_simulation()
-        else:
-            raise ValueError("eplus_verbose must be 0, 1, or 2")        
-        self.delete_directory()
+        try:
+            #Resources of the run (RSS, CPU, I/O), sent to the coordinator by eplus_drl.workers.RecyclingPool:
+            with EpisodeTelemetry(self.sim, self.episode) as self.telemetry:
+                if self.config['eplus_verbose'] == 2:
+                    self.run_simulation()
+                elif self.config['eplus_verbose'] == 1:
+                    self.run_simulation()    
+                elif self.config['eplus_verbose'] == 0:
+                    self.silence_simulation()
+                else:
+                    raise ValueError("eplus_verbose must be 0, 1, or 2")        
+            self.rewards = self.reward_function()
+        except BaseException:
+            self.delete_directory(failed=True)
+            raise
+        self.delete_directory(failed=self.sim.simulation_success != 0)
+
+
+def make_evaluation_manager(policy, idf_path, config, normalizer_stats=None):
+    """
+    Deterministic (argmax) agent of a frozen policy over the whole RunPeriod of the model at its own timestep, none of
+    the training settings (episode windows, fidelity schedule, NumPy inference) apply, so that KPIs are comparable and
+    reproducible. The run directory of the manager is released, evaluations simulate in their own.
+    """
+    eval_config = dict(config, idf_file_name=idf_path, numpy_inference=False, episode_days=0, fidelity_schedule='')
+    manager = Energyplus_manager(0, policy, eval_config, normalizer_stats, deterministic=True)
+    manager.delete_directory()
+    return manager
 
 
-    
\ No newline at end of file
+def make_evaluation_env(checkpoint_path, idf_path, config):
+    """
+    Evaluation agent of a published checkpoint (see eplus_drl.evaluator and make_evaluation_manager()). Module-level,
+    to be sent to the evaluation processes with functools.partial(..., config=config).
+    """
+    weights, normalizer_stats = load_checkpoint(checkpoint_path)
+    policy = NumpyPolicy(weights, layers=['fc1', 'fc2'], activation='elu')
+    return make_evaluation_manager(policy, idf_path, config, normalizer_stats).sim
@@ -0,0 +1,34 @@
+"""
+Rule-based baseline of the ventilation fan, compiled to a native EnergyPlus EMS program (eplus_drl.erl) instead of
+running as Python callbacks: the whole simulation runs inside EnergyPlus, the ToC data is harvested from its outputs.
+
+The fan runs at full flow when the zone is warm, at a third when occupied and comfortable, and is released to the
+model's own control otherwise. Reports the same KPIs as the trained agent, for comparison.
+"""
+import os
+import logging
+from eplus_drl import BcaEnv
+from eplus_drl.erl import RuleController
+from eplus_drl.utils import load_config
+from eplus_manager import Energyplus_manager
+
+baseline = RuleController('fan_mass_flow_act', [
+    ([('zn0_temp', '>', 24)], 2.18),
+    ([('t_hours', '>=', 7), ('t_hours', '<', 18)], 2.18 / 3),
+], default=None)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    config = load_config()
+    sim = BcaEnv(config['ep_path'], config['idf_file_name'], 6, Energyplus_manager.tc_vars,
+                 Energyplus_manager.tc_intvars, Energyplus_manager.tc_meters, Energyplus_manager.tc_actuators,
+                 Energyplus_manager.tc_weather)
+    sim.run_env_erl([baseline], config['ep_weather_path'], os.path.join(BcaEnv.get_temp_run_dir(), 'out'))
+    for kpi in Energyplus_manager.kpis:
+        logging.info(f"{kpi.name}: {kpi(sim):.3f}")
+    sim.get_df(to_csv_file='Dataframes/erl_baseline.csv')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Compares all trained checkpoints (Models/*.pth) on all weather files (../BEMFiles/*.epw) and building models in
+parallel, with fan energy, comfort and setpoint tracking KPIs, replacing the serial deprecated_model_test.py.
+
+Results are appended to Dataframes/evaluation_matrix.csv, rerunning skips the cells already evaluated.
+"""
+import glob
+import logging
+import torch
+from eplus_drl.evaluation import EvaluationMatrix
+from eplus_drl.catalog import ExperimentCatalog
+from eplus_drl.utils import load_config
+from eplus_manager import Energyplus_manager, make_evaluation_manager
+from policy import Policy
+
+config = load_config()
+kpis = Energyplus_manager.kpis
+
+
+def make_env(policy_path, idf_path):
+    # module-level so that it can be sent to the pool processes
+    policy = Policy(config['state_size'], config['action_size'])
+    policy.load_state_dict(torch.load(policy_path))
+    policy.eval()
+    return make_evaluation_manager(policy, idf_path, config).sim
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    matrix = EvaluationMatrix(make_env,
+                              policies=sorted(glob.glob('Models/*.pth')),
+                              weathers=sorted(glob.glob('../BEMFiles/*.epw')),
+                              idfs=[config['idf_file_name']],
+                              kpis=kpis,
+                              results_path='Dataframes/evaluation_matrix.csv',
+                              processes=config['number_of_subprocesses'],
+                              catalog=ExperimentCatalog(config['catalog_path']) if config['catalog_path'] else None)
+    results = matrix.run()
+    logging.info(f"Evaluation matrix:\n{results.to_string()}")
+    logging.info(f"Mean KPIs per policy:\n{results.groupby('policy')[[kpi.name for kpi in kpis]].mean().to_string()}")
+
+
+if __name__ == "__main__":
+    main()
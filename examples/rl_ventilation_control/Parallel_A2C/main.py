@@ -1,13 +1,25 @@
 import time
 import os
 import copy
+import functools
 import logging
-from multiprocessing import Pool, Manager, queues
+from multiprocessing import queues
 from eplus_drl.utils import load_config
-from eplus_manager import Energyplus_manager
+from eplus_drl.workers import get_worker_context, RecyclingPool
+from eplus_drl.telemetry import LeakMonitor, throughput_report, format_throughput_report
+from eplus_drl.fidelity import speedup_report, format_speedup_report
+from eplus_drl.evaluator import CheckpointEvaluator, publish_checkpoint, load_checkpoint
+from eplus_drl.inference import export_weights
+from eplus_manager import Energyplus_manager, make_evaluation_env
 from policy import Policy
 from a2c import A2C_trainer
+from ppo import PPO_trainer
+from a3c import A3C_trainer, train_a3c
+from eplus_drl.preprocessing import RunningNormalizer
+from eplus_drl.archive import ExperienceArchive
+from eplus_drl.catalog import ExperimentCatalog
 import numpy as np
+import torch
 
 def setup_logging():
     logging.basicConfig(
@@ -19,7 +31,8 @@ def setup_logging():
         ]
     )
 
-def run_eplus_experience_harvesting(queue, episode, global_policy, config):
+def run_eplus_experience_harvesting(queue, episode, global_policy, config, shared_normalizer, catalog=None,
+                                    experiment_id=None, manager_class=Energyplus_manager):
     pid = os.getpid()
     logging.debug(f"Experience harvesting process number: {episode}, pid: {pid}")
     try:
@@ -30,16 +43,34 @@ def run_eplus_experience_harvesting(queue, episode, global_policy, config):
 
         control_policy = copy.deepcopy(global_policy)
 
-        eplus_object = Energyplus_manager(episode, control_policy, config)
+        start_time = time.time()
+        eplus_object = manager_class(episode, control_policy, config, shared_normalizer.get('stats'))
         eplus_object.run_episode()
+        wall_time = time.time() - start_time
 
         episode_experience = {
             'episode': episode,
             'states': eplus_object.states,
             'actions': eplus_object.actions,
-            'rewards': eplus_object.rewards
+            'rewards': eplus_object.rewards,
+            'log_probs': eplus_object.log_probs,
+            'gamma': eplus_object.gamma,
+            'normalizer_stats': eplus_object.episode_normalizer_stats()
         }
 
+        if config['experience_archive_path']:
+            # Keep the experience on disk for off-policy/offline learning and system identification
+            archive = ExperienceArchive(config['experience_archive_path'], obs_size=int(np.prod(config['state_size'])),
+                                        action_size=config['action_size'])
+            archive.append_episode(episode, eplus_object.states, eplus_object.actions, eplus_object.rewards,
+                                   eplus_object.times)
+
+        if catalog is not None:
+            kpis = {kpi.name: kpi(eplus_object.sim) for kpi in manager_class.kpis}
+            kpis['score'] = float(np.sum(eplus_object.rewards))
+            catalog.register_run(experiment_id, eplus_object.sim, config['ep_weather_path'], kpis=kpis,
+                                 wall_time=wall_time, episode=episode, kind='episode')
+
         queue.put(episode_experience)
 
         logging.debug(f"Episode {episode} completed with reward: {np.sum(eplus_object.rewards)}")
@@ -47,10 +78,21 @@ def run_eplus_experience_harvesting(queue, episode, global_policy, config):
         logging.error(f"Error in episode {episode}: {e}")
 
 
-def global_policy_process(queue, a2c_object):
+def sync_normalizer_stats(shared_normalizer, worker_stats):
+    # Merge the running observation statistics gathered by a worker into the ones shared with all workers
+    if worker_stats is None or worker_stats['count'] == 0:
+        return
+    global_stats = shared_normalizer.get('stats')
+    stats_list = [worker_stats] if global_stats is None else [global_stats, worker_stats]
+    shared_normalizer['stats'] = RunningNormalizer.merge_stats(stats_list)
+
+
+def global_policy_process(queue, a2c_object, shared_normalizer):
     pid = os.getpid()
     logging.debug(f"Global policy process, pid: {pid}")
-    max_number_of_episodes = a2c_object.config['number_of_episodes']
+    config = a2c_object.config
+    max_number_of_episodes = config['number_of_episodes']
+    n_updates = 0
     
     while True:
         try:
@@ -68,13 +110,57 @@ def global_policy_process(queue, a2c_object):
             
             # Update the global policy with the experience batch
             a2c_object.update(experience_batch)
+            sync_normalizer_stats(shared_normalizer, experience_batch.get('normalizer_stats'))
+            n_updates += 1
+            if config['eval_every'] and n_updates % config['eval_every'] == 0:
+                # Evaluated on held-out weather in the background by the main process, see make_evaluator()
+                publish_checkpoint(config['checkpoint_dir'], n_updates, export_weights(a2c_object.model),
+                                   shared_normalizer.get('stats'))
             
         except Exception as e:
             logging.error(f"Error processing experience batch: {e}")
 
+    if config['eval_every'] and n_updates % config['eval_every'] != 0:
+        # Final model
+        publish_checkpoint(config['checkpoint_dir'], n_updates, export_weights(a2c_object.model),
+                           shared_normalizer.get('stats'))
     logging.info("Shutting down global policy process")
 
 
+def make_worker_pool(ctx, config, processes):
+    # Workers are recycled once their memory grows too fast (E+ does not free all its memory between runs)
+    monitor = LeakMonitor(growth_limit_mb=config['recycle_rss_growth_mb'],
+                          rss_limit_mb=config['recycle_rss_limit_mb'] or None)
+    return RecyclingPool(ctx, processes=processes, monitor=monitor)
+
+
+def make_evaluator(ctx, config):
+    # Deterministic evaluation of the published checkpoints on held-out weather, on the last eval_processes cores
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    model_base = config['model_path'][:-4]
+    return CheckpointEvaluator(functools.partial(make_evaluation_env, config=config), config['checkpoint_dir'],
+                               weathers=[config['eval_weather_path']], idf_path=config['eval_idf_file_name'],
+                               kpis=Energyplus_manager.evaluation_kpis,
+                               results_path=os.path.join(config['checkpoint_dir'], 'evaluation.csv'),
+                               select_kpi='score', processes=config['eval_processes'],
+                               cores=cores[-config['eval_processes']:], mp_context=ctx,
+                               best_path=f"{model_base}_best.npz")
+
+
+def promote_best_checkpoint(best, config):
+    # The best evaluated checkpoint is the selected model, saved as the trainer's best model (Policy state dict)
+    weights, _ = load_checkpoint(best[2])
+    torch.save({name: torch.from_numpy(array) for name, array in weights.items()},
+               f"{config['model_path'][:-4]}_best.pth")
+
+
+def log_throughput_report(pool):
+    logging.info(f"Worker throughput (simulated hours per wall second), {len(pool.recycled)} workers recycled:\n"
+                 f"{format_throughput_report(throughput_report(pool.episode_records))}")
+    if len(speedup_report(pool.episode_records)) > 1:
+        logging.info(f"Speedup per fidelity level:\n{format_speedup_report(speedup_report(pool.episode_records))}")
+
+
 def main():
     pid = os.getpid()
 
@@ -82,31 +168,72 @@ def main():
     logging.info(f"Main process, pid: {pid}")
 
     config = load_config()
+    if config['eval_every']:
+        # Checkpoints and their evaluation results of this run only, versions restart at every run
+        config['checkpoint_dir'] = os.path.join(config['checkpoint_dir'], time.strftime('run_%Y%m%d_%H%M%S'))
     pool_size = config['number_of_subprocesses']
     EPISODES = config['number_of_episodes']
 
-    manager = Manager()
+    # Workers are forked from a server process that already imported torch, numpy and pyenergyplus
+    ctx = get_worker_context(config['ep_path'], preload=['torch', 'policy', 'a2c', 'ppo', 'a3c', 'eplus_manager'])
+    manager = ctx.Manager()
     experience_queue = manager.Queue()
+    shared_normalizer = manager.dict()  # running observation statistics, if used
     global_policy = Policy(config['state_size'], config['action_size'])
-    a2c_object = A2C_trainer(global_policy, config)
+    trainers = {'a2c': A2C_trainer, 'ppo': PPO_trainer, 'a3c': A3C_trainer}
+    if config['trainer'] not in trainers:
+        raise ValueError(f"trainer must be one of {list(trainers)}")
+    a2c_object = trainers[config['trainer']](global_policy, config)
+    catalog, experiment_id = None, None
+    if config['catalog_path']:
+        catalog = ExperimentCatalog(config['catalog_path'])
+        experiment_id = catalog.create_experiment(f"{config['trainer']}_training", config)
+
+    if config['trainer'] == 'a3c':
+        # Workers update the shared-memory global policy themselves, no global policy process
+        train_a3c(a2c_object, config, ctx, manager, catalog, experiment_id)
+    else:
+        evaluator = None
+        if config['eval_every']:
+            logging.info("Starting checkpoint evaluator")
+            evaluator = make_evaluator(ctx, config)
+            evaluator.start()
+            pool_size -= config['eval_processes']  # cores reserved for the evaluation
+            a2c_object.select_best = False  # the best model is the best evaluated checkpoint, not the best average
 
-    with Pool(processes=pool_size, maxtasksperchild=3) as pool:
-        results = []
         logging.info("Starting global policy process")
-        result = pool.apply_async(global_policy_process, args=(experience_queue, a2c_object))
-        results.append(result)
+        learner = ctx.Process(target=global_policy_process, args=(experience_queue, a2c_object, shared_normalizer))
+        learner.start()
 
         logging.info("Starting experience harvesting processes")
-        for index in range(EPISODES):
-            result = pool.apply_async(run_eplus_experience_harvesting, args=(experience_queue, index, global_policy, config))
-            results.append(result)
-
-        pool.close()
-        pool.join()
-
-        # Ensure all tasks have completed
-        for result in results:
-            result.get()  # This will raise exceptions if any occurred during execution
+        with make_worker_pool(ctx, config, max(1, pool_size - 1)) as pool:
+            tasks = [(experience_queue, index, global_policy, config, shared_normalizer, catalog, experiment_id)
+                     for index in range(EPISODES)]
+            for _ in pool.imap_unordered(run_eplus_experience_harvesting, tasks):
+                pass
+        for index, error in pool.errors:
+            logging.error(f"Error in episode {index}: {error}")
+        log_throughput_report(pool)
+
+        # Episode number past the last one, stops the global policy process once it used all the experience
+        experience_queue.put({'episode': EPISODES})
+        learner.join()
+
+        if evaluator is not None:
+            best = evaluator.stop()  # waits for the evaluation of the final model
+            if best is not None:
+                promote_best_checkpoint(best, config)
+                logging.info(f"Best evaluated checkpoint: {best[0]} updates, score {best[1]:.2f} on held-out weather, "
+                             f"{evaluator.n_cancelled} stale evaluations cancelled, saved as the best model")
+
+    if catalog is not None:
+        model_base = config['model_path'][:-4]
+        for kind, path in [('model', f"{model_base}.pth"), ('best_model', f"{model_base}_best.pth"),
+                           ('best_checkpoint', f"{model_base}_best.npz"),
+                           ('evaluation', os.path.join(config['checkpoint_dir'], 'evaluation.csv')),
+                           ('plot', f"{model_base}.png"), ('log', 'a2c_example_program.log')]:
+            if os.path.exists(path):
+                catalog.add_artifact(experiment_id, kind, path)
 
     logging.info("All subprocesses have completed.")
 
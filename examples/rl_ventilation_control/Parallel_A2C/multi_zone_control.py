@@ -0,0 +1,75 @@
+"""
+Multi-zone control with one shared-parameter policy: the cooling setpoint of every thermal zone of the model is
+chosen by the same Policy, for all zones at once in one batched forward pass per timestep.
+
+The per-zone sensors and actuators are declared once as ToC templates (BcaEnv.zone_toc), the observations of all zones
+are fetched as one [n_zones, n_features] array and the actions returned as one [n_zones, 1] setpoint array.
+"""
+import numpy as np
+import torch
+from eplus_drl import EmsPy, BcaEnv
+from eplus_drl.utils import load_config
+from policy import Policy
+
+config = load_config()
+
+zones = {f'z{i}': f'Thermal Zone {i}' for i in range(1, 8)}
+zone_vars = {
+    'temp': ('Zone Air Temperature', '{zone}'),
+    'rh': ('Zone Air Relative Humidity', '{zone}'),
+}
+zone_actuators = {
+    'clg_setpoint': ('Zone Temperature Control', 'Cooling Setpoint', '{zone}'),
+}
+tc_weather = {
+    'oa_db': ('outdoor_dry_bulb'),
+}
+features = ['t_hours', 'temp', 'rh', 'oa_db']
+feature_low = np.array([0, 18, 0, -10])
+feature_high = np.array([24, 35, 100, 10])
+setpoints = np.arange(22, 27, 0.5)  # discrete cooling setpoints, one action per setpoint
+
+
+class Multi_zone_agent:
+    def __init__(self, sim, policy):
+        self.sim = sim
+        self.policy = policy
+        self.observations = None
+
+    def observation_function(self):
+        # [n_zones, n_features], normalized with the feature bounds
+        self.observations = (self.sim.get_zone_observations() - feature_low) / (feature_high - feature_low)
+
+    def actuation_function(self):
+        with torch.no_grad():
+            action_probs, _ = self.policy(torch.from_numpy(self.observations).float())  # all zones in one pass
+        actions = torch.multinomial(action_probs, 1).numpy()
+        return setpoints[actions]  # [n_zones, 1] setpoints, in zone_actuation_order
+
+
+def main():
+    sim = BcaEnv(
+        ep_path=config['ep_path'],
+        ep_idf_to_run=config['idf_file_name'],
+        timesteps=6,
+        tc_vars=BcaEnv.zone_toc(zone_vars, zones),
+        tc_intvars={},
+        tc_meters={},
+        tc_actuator=BcaEnv.zone_toc(zone_actuators, zones),
+        tc_weather=tc_weather
+    )
+    sim.set_zone_layout(list(zones), features, actuators=list(zone_actuators))
+    agent = Multi_zone_agent(sim, Policy((len(features),), len(setpoints)))
+    sim.set_calling_point_and_callback_function(
+        calling_point=EmsPy.available_calling_points[7],
+        observation_function=agent.observation_function,
+        actuation_function=agent.actuation_function,
+        update_state=True,
+        actuation_order=sim.zone_actuation_order
+    )
+    sim.run_env(config['ep_weather_path'])
+    print(sim.get_df(['var', 'actuator'])['all'].describe().to_string())
+
+
+if __name__ == "__main__":
+    main()
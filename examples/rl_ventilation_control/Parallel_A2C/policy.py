@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import numpy as np
+from eplus_drl.inference import NumpyPolicy, export_weights
 
 class Policy(nn.Module):
     def __init__(self, input_shape, action_size):
@@ -23,10 +24,19 @@ class Policy(nn.Module):
         state_value = self.fc3(x)
         return action_probs, state_value
     
-    def act(self, state):
+    def act(self, state, deterministic=False, return_probabilities=False):
         #It is recommended that the state is normalized and preprocessed implementing any embeddings that are deemed fit.
+        #return_probabilities: also return the action probabilities, (action, probabilities)
         state = torch.FloatTensor(state).unsqueeze(0)
         with torch.no_grad():
             action_probs, _ = self(state)
-        action = np.random.choice(self.action_size, p=action_probs.numpy().squeeze())
-        return action
\ No newline at end of file
+        probs = action_probs.numpy().squeeze()
+        if deterministic:
+            action = int(action_probs.argmax())
+        else:
+            action = np.random.choice(self.action_size, p=probs)
+        return (action, probs) if return_probabilities else action
+
+    def export_numpy(self, seed=None):
+        #Frozen NumPy copy of the actor, much faster act() inside the EnergyPlus callbacks (no torch dispatch)
+        return NumpyPolicy(export_weights(self), layers=['fc1', 'fc2'], activation='elu', seed=seed)
@@ -0,0 +1,131 @@
+import logging
+import traceback
+import numpy as np
+import torch
+from a2c import A2C_trainer
+
+
+def discounted_cumsum(x, discount, block_size=64):
+    """
+    Reverse discounted cumulative sum, y[t] = sum_k discount^k * x[t + k], vectorized.
+
+    Computed block by block from the end (discount^t would underflow over a whole episode), within a block as a
+    reversed cumulative sum of x weighted by powers of the discount. Blocks are shortened so that these powers never
+    underflow, down to one step for tiny discounts.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if discount == 0:
+        return x.copy()
+    if discount < 1:
+        block_size = max(1, min(block_size, int(np.log(1e-280) / np.log(discount))))
+    y = np.empty_like(x)
+    powers = discount ** np.arange(block_size + 1)
+    carry = 0.0
+    for end in range(len(x), 0, -block_size):
+        start = max(0, end - block_size)
+        n = end - start
+        w = powers[:n]
+        y[start:end] = (np.cumsum((x[start:end] * w)[::-1])[::-1] + powers[n] * carry) / w
+        carry = y[start]
+    return y
+
+
+class PPO_trainer(A2C_trainer):
+    """
+    Proximal Policy Optimization (clipped objective) of the same actor-critic Policy and experience format as A2C.
+
+    Each episode (or group of config['ppo_episodes_per_update'] episodes) is reused for several epochs of shuffled
+    minibatches, instead of one gradient step per episode, with GAE advantages, value clipping and an early stop of
+    the epochs when the policy moves too far from the one that collected the experience (approximate KL divergence).
+    """
+    def __init__(self, actor_critic_policy, config):
+        super().__init__(actor_critic_policy, config)
+        self.gamma = config.get('gamma', 0.99)
+        self.gae_lambda = config.get('gae_lambda', 0.95)
+        self.epochs = config.get('ppo_epochs', 10)
+        self.minibatch_size = config.get('ppo_minibatch_size', 256)
+        self.clip = config.get('ppo_clip', 0.2)
+        self.target_kl = config.get('ppo_target_kl', 0.02)
+        self.entropy_coef = config.get('ppo_entropy_coef', 0.01)
+        self.episodes_per_update = config.get('ppo_episodes_per_update', 1)
+        self.batch = []  # episodes waiting for the next update
+
+    def gae(self, rewards, values, gamma=None):
+        # episodes end at the end of the RunPeriod, no bootstrapping after the last step
+        gamma = self.gamma if gamma is None else gamma
+        next_values = np.append(values[1:], 0.0)
+        deltas = rewards + gamma * next_values - values
+        advantages = discounted_cumsum(deltas, gamma * self.gae_lambda)
+        return advantages, advantages + values
+
+    def prepare_episode(self, experience):
+        states = torch.FloatTensor(np.vstack(experience['states']))
+        actions = torch.LongTensor(np.argmax(np.vstack(experience['actions']), axis=1))
+        rewards = np.asarray(experience['rewards'], dtype=np.float64)
+        with torch.no_grad():
+            action_probs, values = self.model(states)
+        # log-probabilities of the actions under the policy the worker acted with (Energyplus_manager.log_probs).
+        # Fallback for experience without them (e.g. from an experience archive): recomputed with the current model,
+        # the importance ratio then ignores that the worker's weights were stale.
+        old_log_probs = experience.get('log_probs')
+        if old_log_probs is not None and len(old_log_probs) == states.shape[0]:
+            old_log_probs = torch.FloatTensor(np.asarray(old_log_probs))
+        else:
+            old_log_probs = torch.log(action_probs.gather(1, actions.unsqueeze(1)).squeeze(1) + 1e-10)
+        values = values.squeeze(1).numpy().astype(np.float64)
+        # per timestep discount factor of the episode's fidelity level, if given, see eplus_drl.fidelity
+        advantages, returns = self.gae(rewards, values, experience.get('gamma'))
+        return states, actions, old_log_probs, torch.FloatTensor(values), torch.FloatTensor(advantages), \
+            torch.FloatTensor(returns)
+
+    def replay(self, experience):
+        try:
+            self.score = np.sum(experience['rewards'])
+            self.batch.append(self.prepare_episode(experience))
+            if len(self.batch) < self.episodes_per_update:
+                return
+            states, actions, old_log_probs, old_values, advantages, returns = [torch.cat(tensors)
+                                                                                for tensors in zip(*self.batch)]
+            self.batch = []
+            advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-10)
+
+            n_samples = states.shape[0]
+            approx_kl, n_updates = 0.0, 0
+            for epoch in range(self.epochs):
+                permutation = torch.randperm(n_samples)
+                for start in range(0, n_samples, self.minibatch_size):
+                    index = permutation[start:start + self.minibatch_size]
+                    action_probs, values = self.model(states[index])
+                    values = values.squeeze(1)
+                    log_probs = torch.log(action_probs.gather(1, actions[index].unsqueeze(1)).squeeze(1) + 1e-10)
+
+                    # clipped surrogate objective
+                    ratio = torch.exp(log_probs - old_log_probs[index])
+                    surrogate = torch.min(ratio * advantages[index],
+                                          torch.clamp(ratio, 1 - self.clip, 1 + self.clip) * advantages[index])
+                    actor_loss = -surrogate.mean()
+                    # clipped value loss
+                    values_clipped = old_values[index] + torch.clamp(values - old_values[index], -self.clip, self.clip)
+                    critic_loss = 0.5 * torch.max((values - returns[index]).pow(2),
+                                                  (values_clipped - returns[index]).pow(2)).mean()
+                    entropy = -(action_probs * torch.log(action_probs + 1e-10)).sum(dim=1).mean()
+
+                    loss = actor_loss + critic_loss - self.entropy_coef * entropy
+                    self.optimizer.zero_grad()
+                    loss.backward()
+                    torch.nn.utils.clip_grad_norm_(self.model.parameters(), max_norm=0.5)  # Gradient clipping
+                    self.optimizer.step()
+                    n_updates += 1
+
+                with torch.no_grad():
+                    action_probs, _ = self.model(states)
+                    log_probs = torch.log(action_probs.gather(1, actions.unsqueeze(1)).squeeze(1) + 1e-10)
+                    approx_kl = (old_log_probs - log_probs).mean().item()
+                if approx_kl > 1.5 * self.target_kl:
+                    break  # early stop, the policy moved too far from the one that collected the experience
+            logging.debug(f"PPO update: {n_updates} minibatch steps over {epoch + 1} epochs, approx KL {approx_kl:.4f}")
+
+        except Exception as e:
+            error_message = f"An error occurred during the replay: {e}\n{traceback.format_exc()}"
+            print(error_message)
+            logging.error(error_message)
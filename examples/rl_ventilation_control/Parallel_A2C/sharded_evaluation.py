@@ -0,0 +1,38 @@
+"""
+Evaluates a trained (frozen) policy over the whole RunPeriod of the model, split in monthly shards that are simulated
+in parallel processes and stitched back together.
+"""
+import logging
+import torch
+from eplus_drl import ShardedEvaluation
+from eplus_drl.utils import load_config
+from eplus_manager import Energyplus_manager
+from policy import Policy
+
+config = load_config()
+
+
+def make_env(idf_path):
+    # module-level so that it can be sent to the shard processes
+    shard_config = dict(config, idf_file_name=idf_path)
+    policy = Policy(config['state_size'], config['action_size'])
+    policy.load_state_dict(torch.load(f"{config['model_path'][:-4]}_best.pth"))
+    policy.eval()
+    manager = Energyplus_manager(0, policy, shard_config)
+    return manager.sim
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    evaluation = ShardedEvaluation(make_env, config['idf_file_name'], config['ep_weather_path'],
+                                   n_shards=None,  # one shard per month of the RunPeriod
+                                   overlap_days=7,
+                                   processes=config['number_of_subprocesses'])
+    logging.info(f"Shards: {evaluation.shards}")
+    output_dfs = evaluation.run()
+    output_dfs['all'].to_csv(config['cvs_output_path'], index=False)
+    logging.info(f"Discontinuity error at shard boundaries:\n{evaluation.boundary_report.to_string()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Hyperparameter sweep of the A2C example: many configurations (learning rate, number of discrete fan actions) trained
+at once on one shared pool of EnergyPlus workers, with poor configurations pruned early by ASHA on the moving average
+score of A2C_trainer (A2C_trainer.average).
+
+The learners run in this process, the workers only run episodes with the current weights of their trial's policy.
+Trial models are saved in Models/sweep/, one row per finished trial is appended to Dataframes/sweep_results.csv.
+"""
+import os
+import copy
+import logging
+import torch
+from eplus_drl.utils import load_config
+from eplus_drl.workers import get_worker_context
+from eplus_drl.inference import export_weights
+from eplus_drl.preprocessing import RunningNormalizer
+from eplus_drl.sweep import SweepRunner, SweepTrial, AshaScheduler, LogUniform, random_search
+from eplus_manager import Energyplus_manager
+from policy import Policy
+from a2c import A2C_trainer
+
+config = load_config()
+
+space = {
+    'learning_rate': LogUniform(1e-5, 1e-2),
+    'action_size': [5, 10, 20],
+}
+n_trials = 100
+min_episodes, max_episodes, eta = 5, 135, 3  # rungs at 5, 15 and 45 episodes
+
+
+def run_sweep_episode(trial_config, episode, weights, normalizer_stats):
+    # module-level, runs in the pool workers
+    policy = Policy(trial_config['state_size'], trial_config['action_size'])
+    policy.load_state_dict({name: torch.from_numpy(array) for name, array in weights.items()})
+    eplus_object = Energyplus_manager(episode, policy, trial_config, normalizer_stats)
+    eplus_object.run_episode()
+    return {
+        'episode': episode,
+        'states': eplus_object.states,
+        'actions': eplus_object.actions,
+        'rewards': eplus_object.rewards,
+        'gamma': eplus_object.gamma,
+        'normalizer_stats': eplus_object.episode_normalizer_stats()
+    }
+
+
+class A2C_trial(SweepTrial):
+    def __init__(self, trial_id, params):
+        super().__init__(trial_id, params)
+        os.makedirs('Models/sweep', exist_ok=True)
+        self.config = dict(copy.deepcopy(config), number_of_episodes=max_episodes,
+                           model_path=f'Models/sweep/trial_{trial_id}.pth', **params)
+        self.a2c = A2C_trainer(Policy(self.config['state_size'], self.config['action_size']), self.config)
+        self.normalizer_stats = None
+
+    def episode_args(self, episode):
+        return self.config, episode, export_weights(self.a2c.model), self.normalizer_stats
+
+    def update(self, episode, result):
+        self.a2c.update(result)
+        worker_stats = result['normalizer_stats']
+        if worker_stats is not None and worker_stats['count'] > 0:
+            stats_list = [worker_stats] if self.normalizer_stats is None else [self.normalizer_stats, worker_stats]
+            self.normalizer_stats = RunningNormalizer.merge_stats(stats_list)
+        return self.a2c.average[-1]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    ctx = get_worker_context(config['ep_path'], preload=['torch', 'policy', 'eplus_manager'])
+    sweep = SweepRunner(run_sweep_episode, A2C_trial, random_search(space, n_trials, seed=0),
+                        AshaScheduler(min_episodes, max_episodes, eta),
+                        processes=config['number_of_subprocesses'],
+                        results_path='Dataframes/sweep_results.csv',
+                        mp_context=ctx)
+    results = sweep.run()
+    logging.info(f"Best trials: {results[:5]}")
+    logging.info(f"Episodes run: {sum(row['episodes'] for row in results)} of "
+                 f"{n_trials * max_episodes} without pruning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Trains the agent with episodes simulated on threads of this single process (eplus_drl.threaded) instead of a pool of
+processes: torch and the policy are loaded once, and every timestep the states of all the running episodes go through
+one batched forward pass of the global policy.
+
+Every round, config['number_of_subprocesses'] episodes are simulated at the same time with the current policy, then
+the trainer is updated with their experience.
+"""
+import os
+import logging
+import numpy as np
+import torch
+from eplus_drl.threaded import MultiStateRunner
+from eplus_drl.utils import load_config
+from eplus_manager import Energyplus_manager
+from policy import Policy
+from a2c import A2C_trainer
+from ppo import PPO_trainer
+
+
+class BatchedActor:
+    """Stands in for the Policy of an Energyplus_manager, its act() goes through the batched forward."""
+
+    def __init__(self, batched_probabilities):
+        self.batched_probabilities = batched_probabilities  # action probabilities of a state, from the batched forward
+
+    def act(self, state, deterministic=False, return_probabilities=False):
+        probs = np.asarray(self.batched_probabilities(state), dtype=np.float64)
+        probs /= probs.sum()
+        action = int(np.argmax(probs)) if deterministic else int(np.random.choice(len(probs), p=probs))
+        return (action, probs) if return_probabilities else action
+
+
+def run_episode(episode, config, act):
+    # verbosity handled once for all threads, stdout/stderr redirections are process-wide
+    eplus_object = Energyplus_manager(episode, BatchedActor(act), dict(config, numpy_inference=False, eplus_verbose=1))
+    eplus_object.run_episode()
+    return {'episode': episode, 'states': eplus_object.states, 'actions': eplus_object.actions,
+            'rewards': eplus_object.rewards, 'log_probs': eplus_object.log_probs, 'gamma': eplus_object.gamma}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    config = load_config()
+    global_policy = Policy(config['state_size'], config['action_size'])
+    trainers = {'a2c': A2C_trainer, 'ppo': PPO_trainer}
+    trainer = trainers[config['trainer']](global_policy, config)
+
+    def batch_act(states):
+        # action probabilities, the actions are sampled by each BatchedActor to record their log-probabilities
+        with torch.no_grad():
+            action_probs, _ = global_policy(torch.from_numpy(states))
+        return action_probs.numpy()
+
+    runner = MultiStateRunner(batch_act, n_threads=config['number_of_subprocesses'])
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    for first_episode in range(0, config['number_of_episodes'], runner.n_threads):
+        episodes = range(first_episode, min(first_episode + runner.n_threads, config['number_of_episodes']))
+        tasks = [lambda act, episode=episode: run_episode(episode, config, act) for episode in episodes]
+        if config['eplus_verbose'] == 0:
+            stdout, stderr = os.dup(1), os.dup(2)
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+        try:
+            experiences = runner.run(tasks)
+        finally:
+            if config['eplus_verbose'] == 0:
+                os.dup2(stdout, 1)
+                os.dup2(stderr, 2)
+                os.close(stdout)
+                os.close(stderr)
+        for error in runner.errors:
+            logging.error(error[1])
+        for experience in experiences:
+            if experience is not None:
+                trainer.update(experience)
+                logging.info(f"Episode {experience['episode']} score: {np.sum(experience['rewards']):.2f}")
+        logging.info(f"Episodes {episodes.start}-{episodes.stop - 1} in {runner.wall_time:.1f} s, "
+                     f"mean policy batch size {runner.policy.mean_batch_size:.2f}")
+    os.close(devnull)
+
+
+if __name__ == "__main__":
+    main()